@@ -7,9 +7,11 @@ import msgq
 
 import os
 import capnp
+import heapq
+import struct
 import time
 
-from typing import Optional, List, Union, Dict, Deque
+from typing import Optional, List, Union, Dict, Deque, Tuple
 from collections import deque
 
 from cereal import log
@@ -17,6 +19,15 @@ from cereal.services import SERVICE_LIST
 
 NO_TRAVERSAL_LIMIT = 2**64-1
 
+# Event layout, for reading which(), logMonoTime and valid without building a reader
+_EVENT_STRUCT = log.Event.schema.node.struct
+_EVENT_FIELDS = log.Event.schema.fields
+_EVENT_UNION = {_EVENT_FIELDS[f].proto.discriminantValue: f for f in log.Event.schema.union_fields}
+_EVENT_WHICH_OFFSET = _EVENT_STRUCT.discriminantOffset * 2
+_EVENT_LOGMONOTIME_OFFSET = _EVENT_FIELDS['logMonoTime'].proto.slot.offset * 8
+_EVENT_VALID_BIT = _EVENT_FIELDS['valid'].proto.slot.offset
+_EVENT_VALID_DEFAULT = _EVENT_FIELDS['valid'].proto.slot.defaultValue.bool
+
 
 def reset_context():
   msgq.context = Context()
@@ -27,13 +38,14 @@ def log_from_bytes(dat: bytes, struct: capnp.lib.capnp._StructModule = log.Event
     return msg
 
 
-def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+def new_message(service: Optional[str], size: Optional[int] = None, num_first_segment_words: Optional[int] = None,
+                **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
   args = {
     'valid': False,
     'logMonoTime': int(time.monotonic() * 1e9),
     **kwargs
   }
-  dat = log.Event.new_message(**args)
+  dat = log.Event.new_message(num_first_segment_words=num_first_segment_words, **args)
   if service is not None:
     if size is None:
       dat.init(service)
@@ -42,12 +54,69 @@ def new_message(service: Optional[str], size: Optional[int] = None, **kwargs) ->
   return dat
 
 
+class LazyEvent:
+  """
+  Received Event that reads which(), logMonoTime and valid straight out of the serialized
+  message. The capnp reader is only built once any other field is accessed.
+  """
+  __slots__ = ('dat', '_data_offset', '_data_size', '_reader')
+
+  def __init__(self, dat: bytes):
+    self.dat = dat
+    self._reader: Optional[capnp.lib.capnp._DynamicStructReader] = None
+
+    # root struct pointer follows the segment table
+    segments = struct.unpack_from('<I', dat)[0] + 1
+    root = (4 + 4 * segments + 7) // 8 * 8
+    pointer, data_words = struct.unpack_from('<iH', dat, root)
+    # far pointers aren't followed, the reader handles those
+    self._data_offset = root + 8 + (pointer >> 2) * 8 if pointer & 3 == 0 else None
+    self._data_size = data_words * 8
+
+  def _has_data(self, offset: int, size: int) -> bool:
+    return self._data_offset is not None and offset + size <= self._data_size
+
+  @property
+  def reader(self) -> capnp.lib.capnp._DynamicStructReader:
+    if self._reader is None:
+      self._reader = log_from_bytes(self.dat)
+    return self._reader
+
+  def which(self) -> str:
+    if self._has_data(_EVENT_WHICH_OFFSET, 2):
+      which = _EVENT_UNION.get(struct.unpack_from('<H', self.dat, self._data_offset + _EVENT_WHICH_OFFSET)[0])
+      if which is not None:
+        return which
+    return self.reader.which()
+
+  @property
+  def logMonoTime(self) -> int:
+    if self._has_data(_EVENT_LOGMONOTIME_OFFSET, 8):
+      return struct.unpack_from('<Q', self.dat, self._data_offset + _EVENT_LOGMONOTIME_OFFSET)[0]
+    return self.reader.logMonoTime
+
+  @property
+  def valid(self) -> bool:
+    if self._has_data(_EVENT_VALID_BIT // 8, 1):
+      bit = (self.dat[self._data_offset + _EVENT_VALID_BIT // 8] >> (_EVENT_VALID_BIT % 8)) & 1
+      return bool(bit) != _EVENT_VALID_DEFAULT
+    return self.reader.valid
+
+  def __getattr__(self, name: str):
+    return getattr(self.reader, name)
+
+
 def drain_sock(sock: SubSocket, wait_for_one: bool = False) -> List[capnp.lib.capnp._DynamicStructReader]:
   """Receive all message currently available on the queue"""
   msgs = drain_sock_raw(sock, wait_for_one=wait_for_one)
   return [log_from_bytes(m) for m in msgs]
 
 
+def drain_sock_lazy(sock: SubSocket, wait_for_one: bool = False) -> List[LazyEvent]:
+  """Same as drain sock, but messages are only parsed when needed, see LazyEvent"""
+  return [LazyEvent(m) for m in drain_sock_raw(sock, wait_for_one=wait_for_one)]
+
+
 # TODO: print when we drop packets?
 def recv_sock(sock: SubSocket, wait: bool = False) -> Optional[capnp.lib.capnp._DynamicStructReader]:
   """Same as drain sock, but only returns latest message. Consider using conflate instead."""
@@ -112,6 +181,15 @@ class SubMaster:
     self.max_freq = {}
     self.min_freq = {}
 
+    # running sums over recv_dts and its recent window, so checks don't re-sum the history
+    self.recv_dts_sum: Dict[str, float] = {}
+    self.recent_dts: Dict[str, Deque[float]] = {}
+    self.recent_dts_sum: Dict[str, float] = {}
+    self.alive_timeout: Dict[str, float] = {}
+    # (recv_time + alive_timeout, service) of alive services, to find the ones timing out without checking all
+    self.alive_deadlines: List[Tuple[float, str]] = []
+    self.prev_updated: List[str] = []
+
     self.poller = Poller()
     polled_services = set([poll, ] if poll is not None else services)
     self.non_polled_services = set(services) - polled_services
@@ -154,6 +232,11 @@ class SubMaster:
       self.max_freq[s] = max_freq*1.2
       self.min_freq[s] = min_freq*0.8
       self.recv_dts[s] = deque(maxlen=int(10*freq))
+      self.recv_dts_sum[s] = 0.
+      self.recent_dts[s] = deque(maxlen=int(10*freq / 10) or int(10*freq))
+      self.recent_dts_sum[s] = 0.
+      if SERVICE_LIST[s].frequency > 1e-5:
+        self.alive_timeout[s] = 10. / SERVICE_LIST[s].frequency
 
   def __getitem__(self, s: str) -> capnp.lib.capnp._DynamicStructReader:
     return self.data[s]
@@ -173,7 +256,10 @@ class SubMaster:
 
   def update_msgs(self, cur_time: float, msgs: List[capnp.lib.capnp._DynamicStructReader]) -> None:
     self.frame += 1
-    self.updated = dict.fromkeys(self.updated, False)
+    for s in self.prev_updated:
+      self.updated[s] = False
+
+    updated = []
     for msg in msgs:
       if msg is None:
         continue
@@ -181,40 +267,71 @@ class SubMaster:
       s = msg.which()
       self.seen[s] = True
       self.updated[s] = True
+      updated.append(s)
 
       if self.recv_time[s] > 1e-5:
-        self.recv_dts[s].append(cur_time - self.recv_time[s])
+        self._add_recv_dt(s, cur_time - self.recv_time[s])
       self.recv_time[s] = cur_time
       self.recv_frame[s] = self.frame
       self.data[s] = getattr(msg, s)
       self.logMonoTime[s] = msg.logMonoTime
       self.valid[s] = msg.valid
 
-    for s in self.data:
-      if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
-        # alive if delay is within 10x the expected frequency
-        self.alive[s] = (cur_time - self.recv_time[s]) < (10. / SERVICE_LIST[s].frequency)
-
-        # check average frequency; slow to fall, quick to recover
-        dts = self.recv_dts[s]
-        assert dts.maxlen is not None
-        recent_dts = list(dts)[-int(dts.maxlen / 10):]
-        try:
-          avg_freq = 1 / (sum(dts) / len(dts))
-          avg_freq_recent = 1 / (sum(recent_dts) / len(recent_dts))
-        except ZeroDivisionError:
-          avg_freq = 0
-          avg_freq_recent = 0
-
-        avg_freq_ok = self.min_freq[s] <= avg_freq <= self.max_freq[s]
-        recent_freq_ok = self.min_freq[s] <= avg_freq_recent <= self.max_freq[s]
-        self.freq_ok[s] = avg_freq_ok or recent_freq_ok
+    # only received services and alive services timing out can change state
+    for s in (self.data if self.frame == 0 else updated):
+      self._update_checks(s, cur_time)
+    self._expire_alive(cur_time)
+    self.prev_updated = updated
+
+  def _add_recv_dt(self, s: str, dt: float) -> None:
+    for dts, sums in ((self.recv_dts[s], self.recv_dts_sum), (self.recent_dts[s], self.recent_dts_sum)):
+      assert dts.maxlen is not None
+      if len(dts) == dts.maxlen:
+        sums[s] -= dts[0]
+      dts.append(dt)
+      sums[s] += dt
+
+    # re-sum once per history length to keep the running sums from drifting
+    if self.frame % self.recv_dts[s].maxlen == 0:
+      self.recv_dts_sum[s] = sum(self.recv_dts[s])
+      self.recent_dts_sum[s] = sum(self.recent_dts[s])
+
+  def _update_checks(self, s: str, cur_time: float) -> None:
+    if SERVICE_LIST[s].frequency > 1e-5 and not self.simulation:
+      # alive if delay is within 10x the expected frequency
+      self.alive[s] = (cur_time - self.recv_time[s]) < self.alive_timeout[s]
+      if self.alive[s]:
+        heapq.heappush(self.alive_deadlines, (self.recv_time[s] + self.alive_timeout[s], s))
+
+      # check average frequency; slow to fall, quick to recover
+      try:
+        avg_freq = 1 / (self.recv_dts_sum[s] / len(self.recv_dts[s]))
+        avg_freq_recent = 1 / (self.recent_dts_sum[s] / len(self.recent_dts[s]))
+      except ZeroDivisionError:
+        avg_freq = 0
+        avg_freq_recent = 0
+
+      avg_freq_ok = self.min_freq[s] <= avg_freq <= self.max_freq[s]
+      recent_freq_ok = self.min_freq[s] <= avg_freq_recent <= self.max_freq[s]
+      self.freq_ok[s] = avg_freq_ok or recent_freq_ok
+    else:
+      self.freq_ok[s] = True
+      if self.simulation:
+        self.alive[s] = self.seen[s] # alive is defined as seen when simulation flag set
       else:
-        self.freq_ok[s] = True
-        if self.simulation:
-          self.alive[s] = self.seen[s] # alive is defined as seen when simulation flag set
-        else:
-          self.alive[s] = True
+        self.alive[s] = True
+
+  def _expire_alive(self, cur_time: float) -> None:
+    keep = []
+    while len(self.alive_deadlines) and self.alive_deadlines[0][0] <= cur_time + 1e-6:
+      deadline, s = heapq.heappop(self.alive_deadlines)
+      if (cur_time - self.recv_time[s]) >= self.alive_timeout[s]:
+        self.alive[s] = False
+      elif deadline == self.recv_time[s] + self.alive_timeout[s]:
+        # not timed out yet by the exact check, entries of older receives are dropped
+        keep.append((deadline, s))
+    for entry in keep:
+      heapq.heappush(self.alive_deadlines, entry)
 
   def all_alive(self, service_list: Optional[List[str]] = None) -> bool:
     if service_list is None:
@@ -241,11 +358,29 @@ class PubMaster:
     for s in services:
       self.sock[s] = pub_sock(s)
 
+    # per service send stats: serialized size in words, number of sends and total time spent in send
+    self.msg_words: Dict[str, int] = {}
+    self.send_count: Dict[str, int] = {}
+    self.send_time: Dict[str, float] = {}
+
+  def new_message(self, s: str, size: Optional[int] = None, **kwargs) -> capnp.lib.capnp._DynamicStructBuilder:
+    """new_message with its first segment sized to fit the last message sent on s, so it's built in a single segment"""
+    return new_message(s, size, num_first_segment_words=self.msg_words.get(s), **kwargs)
+
   def send(self, s: str, dat: Union[bytes, capnp.lib.capnp._DynamicStructBuilder]) -> None:
+    start_time = time.monotonic()
     if not isinstance(dat, bytes):
       dat = dat.to_bytes()
     self.sock[s].send(dat)
 
+    self.msg_words[s] = len(dat) // 8
+    self.send_count[s] = self.send_count.get(s, 0) + 1
+    self.send_time[s] = self.send_time.get(s, 0.) + time.monotonic() - start_time
+
+  def send_cost(self) -> Dict[str, float]:
+    """Mean time in seconds spent in send for each service, including serialization"""
+    return {s: self.send_time[s] / n for s, n in self.send_count.items()}
+
   def wait_for_readers_to_update(self, s: str, timeout: int, dt: float = 0.05) -> bool:
     for _ in range(int(timeout*(1./dt))):
       if self.sock[s].all_readers_updated():
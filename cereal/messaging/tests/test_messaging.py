@@ -83,6 +83,7 @@ class TestMessaging:
   @parameterized.expand([
     (messaging.drain_sock, capnp._DynamicStructReader),
     (messaging.drain_sock_raw, bytes),
+    (messaging.drain_sock_lazy, messaging.LazyEvent),
   ])
   def test_drain_sock(self, func, expected_type):
     sock = "carState"
@@ -105,6 +106,22 @@ class TestMessaging:
     assert all(isinstance(msg, expected_type) for msg in msgs)
     assert len(msgs) == num_msgs
 
+  @parameterized.expand(events)
+  def test_lazy_event(self, evt):
+    try:
+      msg = messaging.new_message(evt)
+    except capnp.lib.capnp.KjException:
+      msg = messaging.new_message(evt, random.randrange(200))
+    msg.valid = random.random() > 0.5
+    msg.logMonoTime = random.getrandbits(63)
+
+    dat = msg.to_bytes()
+    lazy_msg = messaging.LazyEvent(dat)
+    assert lazy_msg.which() == evt
+    assert lazy_msg.logMonoTime == msg.logMonoTime
+    assert lazy_msg.valid == msg.valid
+    assert lazy_msg.to_dict() == messaging.log_from_bytes(dat).to_dict()
+
   def test_recv_sock(self):
     sock = "carState"
     pub_sock = messaging.pub_sock(sock)
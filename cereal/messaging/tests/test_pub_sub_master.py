@@ -95,7 +95,23 @@ class TestSubMaster:
           assert not sm._check_avg_freq(service)
 
   def test_alive(self):
-    pass
+    sm = messaging.SubMaster(["carState", "modelV2"], poll="carState")
+    msg = messaging.new_message("carState").as_reader()
+    t = 100.
+    for _ in range(10):
+      t += 0.01
+      sm.update_msgs(t, [msg])
+    assert sm.alive["carState"]
+    assert not sm.alive["modelV2"]
+
+    # alive until 10x the expected period passes without a message
+    sm.update_msgs(t + 0.09, [])
+    assert sm.alive["carState"]
+    sm.update_msgs(t + 0.11, [])
+    assert not sm.alive["carState"]
+
+    sm.update_msgs(t + 0.12, [msg])
+    assert sm.alive["carState"]
 
   def test_ignore_alive(self):
     pass
@@ -155,3 +171,23 @@ class TestPubMaster:
           msg.clear_write_flag()
           msg = msg.to_bytes()
         assert msg == recvd, i
+
+  def test_new_message(self):
+    pm = messaging.PubMaster(['modelV2'])
+    sub_sock = messaging.sub_sock('modelV2', conflate=True, timeout=1000)
+    zmq_sleep()
+
+    for i in range(10):
+      msg = pm.new_message('modelV2')
+      msg.modelV2.frameId = i
+      msg.modelV2.position.x = list(range(33))
+      dat = msg.to_bytes()
+      pm.send('modelV2', msg)
+
+      assert sub_sock.receive() == dat
+      # once the size is known, the message is built in a single segment
+      if i > 0:
+        assert len(msg.to_segments()) == 1
+    assert pm.msg_words['modelV2'] == len(dat) // 8
+    assert pm.send_count['modelV2'] == 10
+    assert pm.send_cost()['modelV2'] > 0
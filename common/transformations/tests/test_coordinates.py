@@ -1,6 +1,7 @@
 import numpy as np
 
 import openpilot.common.transformations.coordinates as coord
+from openpilot.common.transformations.transformations import ecef2geodetic_single, geodetic2ecef_single
 
 geodetic_positions = np.array([[37.7610403, -122.4778699, 115],
                                  [27.4840915, -68.5867592, 2380],
@@ -102,3 +103,13 @@ class TestNED:
     np.testing.assert_allclose(converter.ned2ecef(ned_offsets_batch),
                                                            ecef_positions_offset_batch,
                                                            rtol=1e-9, atol=1e-7)
+
+  def test_batch_matches_single(self):
+    converter = coord.LocalCoord.from_ecef(ecef_init_batch)
+    for batch, single, inp in [(coord.geodetic2ecef, geodetic2ecef_single, geodetic_positions),
+                               (coord.ecef2geodetic, ecef2geodetic_single, ecef_positions),
+                               (converter.ecef2ned, converter.ecef2ned_single, ecef_positions_offset_batch),
+                               (converter.ned2ecef, converter.ned2ecef_single, ned_offsets_batch),
+                               (converter.geodetic2ned, converter.geodetic2ned_single, geodetic_positions),
+                               (converter.ned2geodetic, converter.ned2geodetic_single, ned_offsets_batch)]:
+      np.testing.assert_array_equal(batch(inp), [single(i) for i in inp])
@@ -2,7 +2,10 @@ import numpy as np
 
 from openpilot.common.transformations.orientation import euler2quat, quat2euler, euler2rot, rot2euler, \
                                                rot2quat, quat2rot, \
-                                               ned_euler_from_ecef
+                                               ned_euler_from_ecef, ecef_euler_from_ned
+from openpilot.common.transformations.transformations import euler2quat_single, quat2euler_single, euler2rot_single, \
+                                               rot2euler_single, rot2quat_single, quat2rot_single, \
+                                               ned_euler_from_ecef_single, ecef_euler_from_ned_single
 
 eulers = np.array([[ 1.46520501,  2.78688383,  2.92780854],
        [ 4.86909526,  3.60618161,  4.30648981],
@@ -59,3 +62,16 @@ class TestOrientation:
       np.testing.assert_allclose(ned_eulers[i], ned_euler_from_ecef(ecef_positions[i], eulers[i]), rtol=1e-7)
       #np.testing.assert_allclose(eulers[i], ecef_euler_from_ned(ecef_positions[i], ned_eulers[i]), rtol=1e-7)
     # np.testing.assert_allclose(ned_eulers, ned_euler_from_ecef(ecef_positions, eulers), rtol=1e-7)
+
+  def test_batch_matches_single(self):
+    rots = np.array([euler2rot_single(eul) for eul in eulers])
+    for batch, single, inp in [(euler2quat, euler2quat_single, eulers),
+                               (quat2euler, quat2euler_single, quats),
+                               (quat2rot, quat2rot_single, quats),
+                               (rot2quat, rot2quat_single, rots),
+                               (euler2rot, euler2rot_single, eulers),
+                               (rot2euler, rot2euler_single, rots)]:
+      np.testing.assert_array_equal(batch(inp), [single(i) for i in inp])
+
+    np.testing.assert_array_equal(ned_euler_from_ecef(ecef_positions[0], eulers), [ned_euler_from_ecef_single(ecef_positions[0], i) for i in eulers])
+    np.testing.assert_array_equal(ecef_euler_from_ned(ecef_positions[0], ned_eulers), [ecef_euler_from_ned_single(ecef_positions[0], i) for i in ned_eulers])
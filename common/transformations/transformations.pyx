@@ -19,6 +19,7 @@ from openpilot.common.transformations.transformations cimport LocalCoord_c
 
 import numpy as np
 cimport numpy as np
+cimport cython
 
 cdef np.ndarray[double, ndim=2] matrix2numpy(Matrix3 m):
     return np.array([
@@ -53,6 +54,20 @@ cdef Geodetic list2geodetic(geodetic):
     g.alt = geodetic[2]
     return g
 
+cdef inline Matrix3 buf2matrix(const double[:, ::1] m, double * buf):
+    # Matrix3 reads column major, like numpy2matrix
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            buf[c * 3 + r] = m[r, c]
+    return Matrix3(buf)
+
+cdef inline void matrix2buf(Matrix3 m, double[:, ::1] out):
+    cdef int r, c
+    for r in range(3):
+        for c in range(3):
+            out[r, c] = m(r, c)
+
 def euler2quat_single(euler):
     cdef Vector3 e = Vector3(euler[0], euler[1], euler[2])
     cdef Quaternion q = euler2quat_c(e)
@@ -111,6 +126,169 @@ def ecef2geodetic_single(ecef):
     return [g.lat, g.lon, g.alt]
 
 
+# Batch versions take (N, ...) arrays and call the same C++ functions as the single versions for every row
+
+
+def as_batch(inp, shape):
+    return np.ascontiguousarray(inp, dtype=np.double).reshape((-1,) + shape)
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2quat_batch(euler):
+    cdef const double[:, ::1] e = as_batch(euler, (3,))
+    res = np.empty((e.shape[0], 4))
+    cdef double[:, ::1] out = res
+    cdef Quaternion q
+    cdef Py_ssize_t i
+    for i in range(e.shape[0]):
+        q = euler2quat_c(Vector3(e[i, 0], e[i, 1], e[i, 2]))
+        out[i, 0] = q.w()
+        out[i, 1] = q.x()
+        out[i, 2] = q.y()
+        out[i, 3] = q.z()
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2euler_batch(quat):
+    cdef const double[:, ::1] q = as_batch(quat, (4,))
+    res = np.empty((q.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef Vector3 e
+    cdef Py_ssize_t i
+    for i in range(q.shape[0]):
+        e = quat2euler_c(Quaternion(q[i, 0], q[i, 1], q[i, 2], q[i, 3]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def quat2rot_batch(quat):
+    cdef const double[:, ::1] q = as_batch(quat, (4,))
+    res = np.empty((q.shape[0], 3, 3))
+    cdef double[:, :, ::1] out = res
+    cdef Py_ssize_t i
+    for i in range(q.shape[0]):
+        matrix2buf(quat2rot_c(Quaternion(q[i, 0], q[i, 1], q[i, 2], q[i, 3])), out[i])
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2quat_batch(rot):
+    cdef const double[:, :, ::1] r = as_batch(rot, (3, 3))
+    res = np.empty((r.shape[0], 4))
+    cdef double[:, ::1] out = res
+    cdef double buf[9]
+    cdef Quaternion q
+    cdef Py_ssize_t i
+    for i in range(r.shape[0]):
+        q = rot2quat_c(buf2matrix(r[i], buf))
+        out[i, 0] = q.w()
+        out[i, 1] = q.x()
+        out[i, 2] = q.y()
+        out[i, 3] = q.z()
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def euler2rot_batch(euler):
+    cdef const double[:, ::1] e = as_batch(euler, (3,))
+    res = np.empty((e.shape[0], 3, 3))
+    cdef double[:, :, ::1] out = res
+    cdef Py_ssize_t i
+    for i in range(e.shape[0]):
+        matrix2buf(euler2rot_c(Vector3(e[i, 0], e[i, 1], e[i, 2])), out[i])
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def rot2euler_batch(rot):
+    cdef const double[:, :, ::1] r = as_batch(rot, (3, 3))
+    res = np.empty((r.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef double buf[9]
+    cdef Vector3 e
+    cdef Py_ssize_t i
+    for i in range(r.shape[0]):
+        e = rot2euler_c(buf2matrix(r[i], buf))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef_euler_from_ned_batch(ecef_init, ned_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef const double[:, ::1] p = as_batch(ned_pose, (3,))
+    res = np.empty((p.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef Vector3 e
+    cdef Py_ssize_t i
+    for i in range(p.shape[0]):
+        e = ecef_euler_from_ned_c(init, Vector3(p[i, 0], p[i, 1], p[i, 2]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ned_euler_from_ecef_batch(ecef_init, ecef_pose):
+    cdef ECEF init = list2ecef(ecef_init)
+    cdef const double[:, ::1] p = as_batch(ecef_pose, (3,))
+    res = np.empty((p.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef Vector3 e
+    cdef Py_ssize_t i
+    for i in range(p.shape[0]):
+        e = ned_euler_from_ecef_c(init, Vector3(p[i, 0], p[i, 1], p[i, 2]))
+        out[i, 0] = e(0)
+        out[i, 1] = e(1)
+        out[i, 2] = e(2)
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def geodetic2ecef_batch(geodetic):
+    cdef const double[:, ::1] g = as_batch(geodetic, (3,))
+    res = np.empty((g.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef Geodetic gi
+    cdef ECEF e
+    cdef Py_ssize_t i
+    for i in range(g.shape[0]):
+        gi.lat = g[i, 0]
+        gi.lon = g[i, 1]
+        gi.alt = g[i, 2]
+        e = geodetic2ecef_c(gi)
+        out[i, 0] = e.x
+        out[i, 1] = e.y
+        out[i, 2] = e.z
+    return res
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+def ecef2geodetic_batch(ecef):
+    cdef const double[:, ::1] e = as_batch(ecef, (3,))
+    res = np.empty((e.shape[0], 3))
+    cdef double[:, ::1] out = res
+    cdef ECEF ei
+    cdef Geodetic g
+    cdef Py_ssize_t i
+    for i in range(e.shape[0]):
+        ei.x = e[i, 0]
+        ei.y = e[i, 1]
+        ei.z = e[i, 2]
+        g = ecef2geodetic_c(ei)
+        out[i, 0] = g.lat
+        out[i, 1] = g.lon
+        out[i, 2] = g.alt
+    return res
+
+
 cdef class LocalCoord:
     cdef LocalCoord_c * lc
 
@@ -169,5 +347,85 @@ cdef class LocalCoord:
         cdef Geodetic g = self.lc.ned2geodetic(n)
         return [g.lat, g.lon, g.alt]
 
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ecef2ned_batch(self, ecef):
+        assert self.lc
+        cdef const double[:, ::1] e = as_batch(ecef, (3,))
+        res = np.empty((e.shape[0], 3))
+        cdef double[:, ::1] out = res
+        cdef ECEF ei
+        cdef NED n
+        cdef Py_ssize_t i
+        for i in range(e.shape[0]):
+            ei.x = e[i, 0]
+            ei.y = e[i, 1]
+            ei.z = e[i, 2]
+            n = self.lc.ecef2ned(ei)
+            out[i, 0] = n.n
+            out[i, 1] = n.e
+            out[i, 2] = n.d
+        return res
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2ecef_batch(self, ned):
+        assert self.lc
+        cdef const double[:, ::1] n = as_batch(ned, (3,))
+        res = np.empty((n.shape[0], 3))
+        cdef double[:, ::1] out = res
+        cdef NED ni
+        cdef ECEF e
+        cdef Py_ssize_t i
+        for i in range(n.shape[0]):
+            ni.n = n[i, 0]
+            ni.e = n[i, 1]
+            ni.d = n[i, 2]
+            e = self.lc.ned2ecef(ni)
+            out[i, 0] = e.x
+            out[i, 1] = e.y
+            out[i, 2] = e.z
+        return res
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def geodetic2ned_batch(self, geodetic):
+        assert self.lc
+        cdef const double[:, ::1] g = as_batch(geodetic, (3,))
+        res = np.empty((g.shape[0], 3))
+        cdef double[:, ::1] out = res
+        cdef Geodetic gi
+        cdef NED n
+        cdef Py_ssize_t i
+        for i in range(g.shape[0]):
+            gi.lat = g[i, 0]
+            gi.lon = g[i, 1]
+            gi.alt = g[i, 2]
+            n = self.lc.geodetic2ned(gi)
+            out[i, 0] = n.n
+            out[i, 1] = n.e
+            out[i, 2] = n.d
+        return res
+
+    @cython.boundscheck(False)
+    @cython.wraparound(False)
+    def ned2geodetic_batch(self, ned):
+        assert self.lc
+        cdef const double[:, ::1] n = as_batch(ned, (3,))
+        res = np.empty((n.shape[0], 3))
+        cdef double[:, ::1] out = res
+        cdef NED ni
+        cdef Geodetic g
+        cdef Py_ssize_t i
+        for i in range(n.shape[0]):
+            ni.n = n[i, 0]
+            ni.e = n[i, 1]
+            ni.d = n[i, 2]
+            g = self.lc.ned2geodetic(ni)
+            out[i, 0] = g.lat
+            out[i, 1] = g.lon
+            out[i, 2] = g.alt
+        return res
+
     def __dealloc__(self):
         del self.lc
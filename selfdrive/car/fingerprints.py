@@ -19,10 +19,35 @@ _FINGERPRINTS = get_interface_attr('FINGERPRINTS', combine_brands=True, ignore_n
 _DEBUG_ADDRESS = {1880: 8}   # reserved for debug purposes
 
 
-def is_valid_for_fingerprint(msg, car_fingerprint: dict[int, int]):
-  adr = msg.address
+def _build_fingerprint_index() -> dict[int, dict[int, int]]:
+  # address -> length -> bitmask of the cars with a fingerprint containing that message
+  index: dict[int, dict[int, int]] = {}
+  for bit, car_fingerprints in enumerate(_FINGERPRINTS.values()):
+    for fingerprint in car_fingerprints:
+      # add alien debug address
+      for adr, length in (fingerprint | _DEBUG_ADDRESS).items():
+        lengths = index.setdefault(adr, {})
+        lengths[length] = lengths.get(length, 0) | (1 << bit)
+  return index
+
+
+_FINGERPRINT_CARS = list(_FINGERPRINTS.keys())
+_FINGERPRINT_CAR_BITS = {car_name: bit for bit, car_name in enumerate(_FINGERPRINT_CARS)}
+_FINGERPRINT_INDEX = _build_fingerprint_index()
+ALL_FINGERPRINT_CARS_MASK = (1 << len(_FINGERPRINT_CARS)) - 1
+
+
+def compatible_cars_mask(address: int, length: int) -> int:
+  """Bitmask of the FPv1 cars that could have sent a message with this address and length."""
   # ignore addresses that are more than 11 bits
-  return (adr in car_fingerprint and car_fingerprint[adr] == len(msg.dat)) or adr >= 0x800
+  if address >= 0x800:
+    return ALL_FINGERPRINT_CARS_MASK
+  return _FINGERPRINT_INDEX.get(address, {}).get(length, 0)
+
+
+def cars_from_mask(mask: int) -> list[str]:
+  """Returns the car strings in a bitmask from compatible_cars_mask, in all_legacy_fingerprint_cars order."""
+  return [car_name for bit, car_name in enumerate(_FINGERPRINT_CARS) if (mask >> bit) & 1]
 
 
 def eliminate_incompatible_cars(msg, candidate_cars):
@@ -35,18 +60,8 @@ def eliminate_incompatible_cars(msg, candidate_cars):
      Returns:
       A list containing the subset of candidate_cars that could have sent msg.
   """
-  compatible_cars = []
-
-  for car_name in candidate_cars:
-    car_fingerprints = _FINGERPRINTS[car_name]
-
-    for fingerprint in car_fingerprints:
-      # add alien debug address
-      if is_valid_for_fingerprint(msg, fingerprint | _DEBUG_ADDRESS):
-        compatible_cars.append(car_name)
-        break
-
-  return compatible_cars
+  mask = compatible_cars_mask(msg.address, len(msg.dat))
+  return [car_name for car_name in candidate_cars if (mask >> _FINGERPRINT_CAR_BITS[car_name]) & 1]
 
 
 def all_known_cars():
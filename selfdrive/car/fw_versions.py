@@ -1,6 +1,8 @@
 #!/usr/bin/env python3
+import time
 from collections import defaultdict
 from collections.abc import Callable, Iterator
+from functools import cache
 from typing import Any, Protocol, TypeVar
 
 from tqdm import tqdm
@@ -12,9 +14,10 @@ from openpilot.selfdrive.car import carlog
 from openpilot.selfdrive.car.ecu_addrs import get_ecu_addrs
 from openpilot.selfdrive.car.fingerprints import FW_VERSIONS
 from openpilot.selfdrive.car.can_definitions import CanRecvCallable, CanSendCallable
-from openpilot.selfdrive.car.fw_query_definitions import AddrType, EcuAddrBusType, FwQueryConfig, LiveFwVersions, OfflineFwVersions
+from openpilot.selfdrive.car.fw_query_definitions import AddrType, EcuAddrBusType, EcuAddrSubAddr, FwQueryConfig, LiveFwVersions, \
+                                                         OfflineFwVersions, Request
 from openpilot.selfdrive.car.interfaces import get_interface_attr
-from openpilot.selfdrive.car.isotp_parallel_query import IsoTpParallelQuery
+from openpilot.selfdrive.car.isotp_parallel_query import IsoTpParallelQuery, get_data_concurrent
 
 Ecu = car.CarParams.Ecu
 ESSENTIAL_ECUS = [Ecu.engine, Ecu.eps, Ecu.abs, Ecu.fwdRadar, Ecu.fwdCamera, Ecu.vsa]
@@ -28,6 +31,8 @@ REQUESTS = [(brand, config, r) for brand, config in FW_QUERY_CONFIGS.items() for
 
 T = TypeVar('T')
 ObdCallback = Callable[[bool], None]
+# brand, config, request and the (addr, sub_addr) to query
+FwQuery = tuple[str, FwQueryConfig, Request, list[AddrType]]
 
 
 def chunks(l: list[T], n: int = 128) -> Iterator[list[T]]:
@@ -49,6 +54,102 @@ def build_fw_dict(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], filt
   return dict(fw_versions_dict)
 
 
+class FwMatchIndex:
+  """Lookup tables over FW_VERSIONS for one brand (or all brands) that reduce exact and fuzzy matching
+  to set operations. Use get_fw_match_index to share them between calls."""
+
+  def __init__(self, match_brand: str = None, extra_fw_versions: dict = None):
+    if extra_fw_versions is None:
+      extra_fw_versions = {}
+
+    self.candidates: set[str] = set()
+    # exact matching: ECUs at each (addr, sub_addr), candidates by (ecu, addr, sub_addr, version),
+    # candidates that have each ECU and candidates that can't be missing each ECU
+    self.ecus_by_addr: defaultdict[AddrType, set[EcuAddrSubAddr]] = defaultdict(set)
+    self.candidates_by_version: defaultdict[tuple[int, int, int | None, bytes], set[str]] = defaultdict(set)
+    self.candidates_by_ecu: defaultdict[EcuAddrSubAddr, set[str]] = defaultdict(set)
+    self.essential_candidates_by_ecu: defaultdict[EcuAddrSubAddr, set[str]] = defaultdict(set)
+    # fuzzy matching: candidates by (addr, sub_addr, version)
+    self.fuzzy_candidates: defaultdict[tuple[int, int | None, bytes], list[str]] = defaultdict(list)
+
+    for candidate, fw_by_addr in FW_VERSIONS.items():
+      if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
+        continue
+
+      self.candidates.add(candidate)
+      config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
+      for ecu, fws in fw_by_addr.items():
+        ecu_type = ecu[0]
+
+        # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
+        # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
+        # impossible to get 3 matching versions, even if two models with shared parts are released at the same
+        # time and only one is in our database.
+        if ecu_type not in FUZZY_EXCLUDE_ECUS:
+          for f in fws:
+            self.fuzzy_candidates[(ecu[1], ecu[2], f)].append(candidate)
+
+        # Virtual debug ecu doesn't need to match the database
+        if ecu_type == Ecu.debug:
+          continue
+
+        self.ecus_by_addr[ecu[1:]].add(ecu)
+        self.candidates_by_ecu[ecu].add(candidate)
+        for f in fws + extra_fw_versions.get(candidate, {}).get(ecu, []):
+          self.candidates_by_version[(*ecu, f)].add(candidate)
+
+        # Some models can sometimes miss an ecu, or show on two different addresses
+        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
+        if ecu_type in ESSENTIAL_ECUS and candidate not in config.non_essential_ecus.get(ecu_type, []):
+          self.essential_candidates_by_ecu[ecu].add(candidate)
+
+  def match_exact(self, live_fw_versions: LiveFwVersions) -> set[str]:
+    invalid: set[str] = set()
+    present_ecus = set()
+    for addr, found_versions in live_fw_versions.items():
+      if not len(found_versions):
+        continue
+
+      # candidates with this ECU need to have one of the found versions
+      for ecu in self.ecus_by_addr.get(addr, ()):
+        present_ecus.add(ecu)
+        matched = set().union(*[self.candidates_by_version.get((*ecu, version), ()) for version in found_versions])
+        invalid |= self.candidates_by_ecu[ecu] - matched
+
+    # and can only miss non-essential ECUs
+    for ecu, candidates in self.essential_candidates_by_ecu.items():
+      if ecu not in present_ecus:
+        invalid |= candidates
+
+    return self.candidates - invalid
+
+  def match_fuzzy(self, live_fw_versions: LiveFwVersions, exclude: str = None) -> tuple[str | None, int]:
+    matched_ecus = set()
+    match: str | None = None
+    for addr, versions in live_fw_versions.items():
+      ecu_key = (addr[0], addr[1])
+      for version in versions:
+        # All cars that have this FW response on the specified address
+        candidates = self.fuzzy_candidates.get((*ecu_key, version), [])
+        if exclude is not None:
+          candidates = [c for c in candidates if c != exclude]
+
+        if len(candidates) == 1:
+          matched_ecus.add(ecu_key)
+          if match is None:
+            match = candidates[0]
+          # We uniquely matched two different cars. No fuzzy match possible
+          elif match != candidates[0]:
+            return None, 0
+
+    return match, len(matched_ecus)
+
+
+@cache
+def get_fw_match_index(match_brand: str = None) -> FwMatchIndex:
+  return FwMatchIndex(match_brand)
+
+
 class MatchFwToCar(Protocol):
   def __call__(self, live_fw_versions: LiveFwVersions, match_brand: str = None, log: bool = True) -> set[str]:
     ...
@@ -59,46 +160,13 @@ def match_fw_to_car_fuzzy(live_fw_versions: LiveFwVersions, match_brand: str = N
   that were matched uniquely to that specific car. If multiple ECUs uniquely match to different cars
   the match is rejected."""
 
-  # Build lookup table from (addr, sub_addr, fw) to list of candidate cars
-  all_fw_versions = defaultdict(list)
-  for candidate, fw_by_addr in FW_VERSIONS.items():
-    if not is_brand(MODEL_TO_BRAND[candidate], match_brand):
-      continue
-
-    if candidate == exclude:
-      continue
-
-    for addr, fws in fw_by_addr.items():
-      # These ECUs are known to be shared between models (EPS only between hybrid/ICE version)
-      # Getting this exactly right isn't crucial, but excluding camera and radar makes it almost
-      # impossible to get 3 matching versions, even if two models with shared parts are released at the same
-      # time and only one is in our database.
-      if addr[0] in FUZZY_EXCLUDE_ECUS:
-        continue
-      for f in fws:
-        all_fw_versions[(addr[1], addr[2], f)].append(candidate)
-
-  matched_ecus = set()
-  match: str | None = None
-  for addr, versions in live_fw_versions.items():
-    ecu_key = (addr[0], addr[1])
-    for version in versions:
-      # All cars that have this FW response on the specified address
-      candidates = all_fw_versions[(*ecu_key, version)]
-
-      if len(candidates) == 1:
-        matched_ecus.add(ecu_key)
-        if match is None:
-          match = candidates[0]
-        # We uniquely matched two different cars. No fuzzy match possible
-        elif match != candidates[0]:
-          return set()
+  match, matched_ecus = get_fw_match_index(match_brand).match_fuzzy(live_fw_versions, exclude)
 
   # Note that it is possible to match to a candidate without all its ECUs being present
   # if there are enough matches. FIXME: parameterize this or require all ECUs to exist like exact matching
-  if match and len(matched_ecus) >= 2:
+  if match and matched_ecus >= 2:
     if log:
-      carlog.error(f"Fingerprinted {match} using fuzzy match. {len(matched_ecus)} matching ECUs")
+      carlog.error(f"Fingerprinted {match} using fuzzy match. {matched_ecus} matching ECUs")
     return {match}
   else:
     return set()
@@ -109,40 +177,11 @@ def match_fw_to_car_exact(live_fw_versions: LiveFwVersions, match_brand: str = N
   FW versions for a list of "essential" ECUs. If an ECU is not considered
   essential the FW version can be missing to get a fingerprint, but if it's present it
   needs to match the database."""
-  if extra_fw_versions is None:
-    extra_fw_versions = {}
-
-  invalid = set()
-  candidates = {c: f for c, f in FW_VERSIONS.items() if
-                is_brand(MODEL_TO_BRAND[c], match_brand)}
-
-  for candidate, fws in candidates.items():
-    config = FW_QUERY_CONFIGS[MODEL_TO_BRAND[candidate]]
-    for ecu, expected_versions in fws.items():
-      expected_versions = expected_versions + extra_fw_versions.get(candidate, {}).get(ecu, [])
-      ecu_type = ecu[0]
-      addr = ecu[1:]
-
-      found_versions = live_fw_versions.get(addr, set())
-      if not len(found_versions):
-        # Some models can sometimes miss an ecu, or show on two different addresses
-        # FIXME: this logic can be improved to be more specific, should require one of the two addresses
-        if candidate in config.non_essential_ecus.get(ecu_type, []):
-          continue
-
-        # Ignore non essential ecus
-        if ecu_type not in ESSENTIAL_ECUS:
-          continue
-
-      # Virtual debug ecu doesn't need to match the database
-      if ecu_type == Ecu.debug:
-        continue
-
-      if not any(found_version in expected_versions for found_version in found_versions):
-        invalid.add(candidate)
-        break
-
-  return set(candidates.keys()) - invalid
+  if extra_fw_versions:
+    index = FwMatchIndex(match_brand, extra_fw_versions)
+  else:
+    index = get_fw_match_index(match_brand)
+  return index.match_exact(live_fw_versions)
 
 
 def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vin: str,
@@ -172,6 +211,39 @@ def match_fw_to_car(fw_versions: list[capnp.lib.capnp._DynamicStructBuilder], vi
   return True, set()
 
 
+def schedule_fw_queries(queries: list[FwQuery]) -> list[list[int]]:
+  """Groups queries into batches that can run at the same time, returns the indices of the queries in each batch.
+
+  Queries in a batch don't share an address for requests or responses, and all queries on bus 1 use the
+  same OBD multiplexing mode. Addresses conflict across buses too, since gatewayed ECUs see the requests
+  sent on both sides of the gateway. A query never runs before an earlier query it conflicts with, so each
+  ECU sees its requests in the original order."""
+  addrs = []
+  for _, _, r, query_addrs in queries:
+    tx_addrs = {a for a, _ in query_addrs}
+    addrs.append(tx_addrs | {uds.get_rx_addr_for_tx_addr(a, r.rx_offset) for a in tx_addrs})
+
+  batches = []
+  pending = list(range(len(queries)))
+  while len(pending):
+    batch: list[int] = []
+    blocked_addrs: set[int] = set()
+    obd_multiplexing: bool | None = None
+    for i in pending:
+      r = queries[i][2]
+      obd_conflict = r.bus % 4 == 1 and obd_multiplexing is not None and r.obd_multiplexing != obd_multiplexing
+      if not obd_conflict and not (addrs[i] & blocked_addrs):
+        batch.append(i)
+        if r.bus % 4 == 1:
+          obd_multiplexing = r.obd_multiplexing
+      # later queries on these addresses wait for this one, even if it's not in this batch
+      blocked_addrs |= addrs[i]
+
+    batches.append(batch)
+    pending = [i for i in pending if i not in batch]
+  return batches
+
+
 def get_present_ecus(can_recv: CanRecvCallable, can_send: CanSendCallable, set_obd_multiplexing: ObdCallback, num_pandas: int = 1) -> set[EcuAddrBusType]:
   # queries are split by OBD multiplexing mode
   queries: dict[bool, list[list[EcuAddrBusType]]] = {True: [], False: []}
@@ -286,51 +358,81 @@ def get_fw_versions(can_recv: CanRecvCallable, can_send: CanSendCallable, set_ob
 
   addrs.insert(0, parallel_addrs)
 
-  # Get versions and build capnp list to put into CarParams
-  car_fw = []
+  # Build the queries in the order they would be sent one by one
   requests = [(brand, config, r) for brand, config, r in REQUESTS if is_brand(brand, query_brand)]
-  for addr_group in tqdm(addrs, disable=not progress):  # split by subaddr, if any
+  queries: list[FwQuery] = []
+  for addr_group in addrs:  # split by subaddr, if any
     for addr_chunk in chunks(addr_group):
       for brand, config, r in requests:
         # Skip query if no panda available
         if r.bus > num_pandas * 4 - 1:
           continue
 
-        # Toggle OBD multiplexing for each request
-        if r.bus % 4 == 1:
-          set_obd_multiplexing(r.obd_multiplexing)
-
-        try:
-          query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
-                         (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
-
-          if query_addrs:
-            query = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset, debug=debug)
-            for (tx_addr, sub_addr), version in query.get_data(timeout).items():
-              f = car.CarParams.CarFw.new_message()
-
-              f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
-              f.fwVersion = version
-              f.address = tx_addr
-              f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
-              f.request = r.request
-              f.brand = brand
-              f.bus = r.bus
-              f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
-              f.obdMultiplexing = r.obd_multiplexing
+        query_addrs = [(a, s) for (b, a, s) in addr_chunk if b in (brand, 'any') and
+                       (len(r.whitelist_ecus) == 0 or ecu_types[(b, a, s)] in r.whitelist_ecus)]
+        if query_addrs:
+          queries.append((brand, config, r, query_addrs))
 
-              if sub_addr is not None:
-                f.subAddress = sub_addr
-
-              car_fw.append(f)
-        except Exception:
-          carlog.exception("FW query exception")
-
-  return car_fw
+  # Get versions and build capnp list to put into CarParams
+  car_fw_by_query: dict[int, list[capnp.lib.capnp._DynamicStructBuilder]] = defaultdict(list)
+  brand_query_times: defaultdict[str, float] = defaultdict(float)
+  for batch in tqdm(schedule_fw_queries(queries), disable=not progress):
+    start_time = time.monotonic()
+
+    # Toggle OBD multiplexing for the batch, all its bus 1 requests use the same mode
+    obd_multiplexing = {queries[i][2].obd_multiplexing for i in batch if queries[i][2].bus % 4 == 1}
+    if len(obd_multiplexing):
+      set_obd_multiplexing(obd_multiplexing.pop())
+
+    isotp_queries = {}
+    for i in batch:
+      _, _, r, query_addrs = queries[i]
+      try:
+        isotp_queries[i] = IsoTpParallelQuery(can_send, can_recv, r.bus, query_addrs, r.request, r.response, r.rx_offset, debug=debug)
+      except Exception:
+        carlog.exception("FW query exception")
+
+    # exceptions raised by a single query are handled in get_data_concurrent and only drop its own results
+    try:
+      batch_results = get_data_concurrent(can_recv, list(isotp_queries.values()), timeout)
+    except Exception:
+      carlog.exception("FW query exception")
+      batch_results = [{} for _ in isotp_queries]
+
+    for i, results in zip(isotp_queries, batch_results, strict=True):
+      brand, config, r, _ = queries[i]
+      try:
+        for (tx_addr, sub_addr), version in results.items():
+          f = car.CarParams.CarFw.new_message()
+
+          f.ecu = ecu_types.get((brand, tx_addr, sub_addr), Ecu.unknown)
+          f.fwVersion = version
+          f.address = tx_addr
+          f.responseAddress = uds.get_rx_addr_for_tx_addr(tx_addr, r.rx_offset)
+          f.request = r.request
+          f.brand = brand
+          f.bus = r.bus
+          f.logging = r.logging or (f.ecu, tx_addr, sub_addr) in config.extra_ecus
+          f.obdMultiplexing = r.obd_multiplexing
+
+          if sub_addr is not None:
+            f.subAddress = sub_addr
+
+          car_fw_by_query[i].append(f)
+      except Exception:
+        carlog.exception("FW query exception")
+
+    # brands share the time of the batches they're queried in
+    for brand in {queries[i][0] for i in batch}:
+      brand_query_times[brand] += time.monotonic() - start_time
+
+  if len(brand_query_times):
+    carlog.info({"event": "FW query time", "brand_times": {brand: round(t, 3) for brand, t in brand_query_times.items()}})
+
+  return [f for i in range(len(queries)) for f in car_fw_by_query[i]]
 
 
 if __name__ == "__main__":
-  import time
   import argparse
   import cereal.messaging as messaging
   from openpilot.common.params import Params
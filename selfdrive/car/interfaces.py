@@ -1,6 +1,7 @@
 import json
 import os
 import numpy as np
+import time
 import tomllib
 from abc import abstractmethod, ABC
 from enum import StrEnum
@@ -84,6 +85,53 @@ def get_torque_params():
 
   return torque_params
 
+class CanParserDispatcher:
+  """Splits each cycle's CAN packets by bus and address once and feeds every parser only the frames it's
+  subscribed to, instead of every parser walking all frames of all buses"""
+
+  def __init__(self, can_parsers: list):
+    self.can_parsers = [cp for cp in can_parsers if cp is not None]
+    self.buses = [cp.bus for cp in self.can_parsers]
+    # bus -> address -> indices of the parsers subscribed to it, vl is keyed by both message name and address
+    self.subscribers: dict[int, dict[int, list[int]]] = {}
+    for i, cp in enumerate(self.can_parsers):
+      bus_subscribers = self.subscribers.setdefault(cp.bus, {})
+      for address in cp.vl:
+        if isinstance(address, int):
+          bus_subscribers.setdefault(address, []).append(i)
+
+    # time spent in each parser and in splitting the frames during the last update
+    self.parse_times_ns = [0] * len(self.can_parsers)
+    self.dispatch_time_ns = 0
+
+  def update(self, can_packets: list[tuple[int, list[CanData]]]) -> None:
+    start_time = time.monotonic_ns()
+    parser_packets: list[list[tuple[int, list[CanData]]]] = [[] for _ in self.can_parsers]
+    for nanos, frames in can_packets:
+      parser_frames: list[list[CanData]] = [[] for _ in self.can_parsers]
+      bus_frames = {}
+      for frame in frames:
+        src = frame[2]
+        if src not in bus_frames:
+          bus_frames[src] = frame
+        bus_subscribers = self.subscribers.get(src)
+        if bus_subscribers is not None:
+          for i in bus_subscribers.get(frame[0], ()):
+            parser_frames[i].append(frame)
+
+      for i, bus in enumerate(self.buses):
+        # parsers time out their bus if it has no frames at all, so pass one frame to keep it alive
+        if not len(parser_frames[i]) and bus in bus_frames:
+          parser_frames[i].append(bus_frames[bus])
+        parser_packets[i].append((nanos, parser_frames[i]))
+    self.dispatch_time_ns = time.monotonic_ns() - start_time
+
+    for i, cp in enumerate(self.can_parsers):
+      start_time = time.monotonic_ns()
+      cp.update_strings(parser_packets[i])
+      self.parse_times_ns[i] = time.monotonic_ns() - start_time
+
+
 # generic car and radar interfaces
 
 class CarInterfaceBase(ABC):
@@ -104,6 +152,8 @@ class CarInterfaceBase(ABC):
     self.cp_body = self.CS.get_body_can_parser(CP)
     self.cp_loopback = self.CS.get_loopback_can_parser(CP)
     self.can_parsers = [self.cp, self.cp_cam, self.cp_adas, self.cp_body, self.cp_loopback]
+    # built on the first update, interfaces can add parsers after this
+    self.can_dispatcher: CanParserDispatcher | None = None
 
     dbc_name = "" if self.cp is None else self.cp.dbc_name
     self.CC: CarControllerBase = CarController(dbc_name, CP)
@@ -230,9 +280,9 @@ class CarInterfaceBase(ABC):
 
   def update(self, c: car.CarControl, can_packets: list[tuple[int, list[CanData]]]) -> car.CarState:
     # parse can
-    for cp in self.can_parsers:
-      if cp is not None:
-        cp.update_strings(can_packets)
+    if self.can_dispatcher is None:
+      self.can_dispatcher = CanParserDispatcher(self.can_parsers)
+    self.can_dispatcher.update(can_packets)
 
     # get CarState
     ret = self._update(c)
@@ -30,8 +30,9 @@ class IsoTpParallelQuery:
 
   def rx(self) -> None:
     """Drain can socket and sort messages into buffers based on address"""
-    can_packets = self.can_recv(wait_for_one=True)
+    self._sort_rx(self.can_recv(wait_for_one=True))
 
+  def _sort_rx(self, can_packets: list[list[CanData]]) -> None:
     for packet in can_packets:
       for msg in packet:
         if msg.src == self.bus and msg.address in self.msg_addrs.values():
@@ -75,98 +76,142 @@ class IsoTpParallelQuery:
     # as well as reduces chances we process messages from previous queries
     return IsoTpMessage(can_client, timeout=0, separation_time=0.01, debug=self.debug, max_len=max_len)
 
-  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
-    self._drain_rx()
-
-    # Create message objects
-    msgs = {}
-    request_counter = {}
-    request_done = {}
+  def _start(self, timeout: float) -> None:
+    """Create message objects and send the first request to all addresses"""
+    self.timeout = timeout
+    self.msgs = {}
+    self.request_counter = {}
+    self.request_done = {}
     for tx_addr, rx_addr in self.msg_addrs.items():
-      msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
-      request_counter[tx_addr] = 0
-      request_done[tx_addr] = False
+      self.msgs[tx_addr] = self._create_isotp_msg(*tx_addr, rx_addr)
+      self.request_counter[tx_addr] = 0
+      self.request_done[tx_addr] = False
 
     # Send first request to functional addrs, subsequent responses are handled on physical addrs
     if len(self.functional_addrs):
       for addr in self.functional_addrs:
         self._create_isotp_msg(addr, None, -1).send(self.request[0])
 
-    # Send first frame (single or first) to all addresses and receive asynchronously in the loop below.
+    # Send first frame (single or first) to all addresses and receive asynchronously in _update.
     # If querying functional addrs, only set up physical IsoTpMessages to send consecutive frames
-    for msg in msgs.values():
+    for msg in self.msgs.values():
       msg.send(self.request[0], setup_only=len(self.functional_addrs) > 0)
 
-    results = {}
-    start_time = time.monotonic()
-    addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
-    response_timeouts = {tx_addr: start_time + timeout for tx_addr in self.msg_addrs}
+    self.results: dict[AddrType, bytes] = {}
+    self.start_time = time.monotonic()
+    self.addrs_responded = set()  # track addresses that have ever sent a valid iso-tp frame for timeout logging
+    self.response_timeouts = dict.fromkeys(self.msg_addrs, self.start_time + timeout)
+
+  def _update(self) -> bool:
+    """Process buffered frames, send the next requests and time out addresses. Returns True once all requests are done"""
+    timeout = self.timeout
+    for tx_addr, msg in self.msgs.items():
+      try:
+        dat, rx_in_progress = msg.recv()
+      except Exception:
+        carlog.exception(f"Error processing UDS response: {tx_addr}")
+        self.request_done[tx_addr] = True
+        continue
+
+      # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
+      if rx_in_progress:
+        self.addrs_responded.add(tx_addr)
+        self.response_timeouts[tx_addr] = time.monotonic() + timeout
+
+      if dat is None:
+        continue
+
+      # Log unexpected empty responses
+      if len(dat) == 0:
+        carlog.error(f"iso-tp query empty response: {tx_addr}")
+        self.request_done[tx_addr] = True
+        continue
+
+      counter = self.request_counter[tx_addr]
+      expected_response = self.response[counter]
+      response_valid = dat.startswith(expected_response)
+
+      if response_valid:
+        if counter + 1 < len(self.request):
+          self.response_timeouts[tx_addr] = time.monotonic() + timeout
+          msg.send(self.request[counter + 1])
+          self.request_counter[tx_addr] += 1
+        else:
+          self.results[tx_addr] = dat[len(expected_response):]
+          self.request_done[tx_addr] = True
+      else:
+        error_code = dat[2] if len(dat) > 2 else -1
+        if error_code == 0x78:
+          self.response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
+          carlog.error(f"iso-tp query response pending: {tx_addr}")
+        else:
+          self.request_done[tx_addr] = True
+          carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
+
+    # Mark request done if address timed out
+    cur_time = time.monotonic()
+    for tx_addr in self.response_timeouts:
+      if cur_time - self.response_timeouts[tx_addr] > 0:
+        if not self.request_done[tx_addr]:
+          if self.request_counter[tx_addr] > 0:
+            carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
+          elif tx_addr in self.addrs_responded:
+            carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
+          # TODO: handle functional addresses
+          # else:
+          #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
+        self.request_done[tx_addr] = True
+
+    # Done if all requests are done (finished or timed out)
+    return all(self.request_done.values())
+
+  def get_data(self, timeout: float, total_timeout: float = 60.) -> dict[AddrType, bytes]:
+    self._drain_rx()
+    self._start(timeout)
     while True:
       self.rx()
-
-      for tx_addr, msg in msgs.items():
-        try:
-          dat, rx_in_progress = msg.recv()
-        except Exception:
-          carlog.exception(f"Error processing UDS response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        # Extend timeout for each consecutive ISO-TP frame to avoid timing out on long responses
-        if rx_in_progress:
-          addrs_responded.add(tx_addr)
-          response_timeouts[tx_addr] = time.monotonic() + timeout
-
-        if dat is None:
-          continue
-
-        # Log unexpected empty responses
-        if len(dat) == 0:
-          carlog.error(f"iso-tp query empty response: {tx_addr}")
-          request_done[tx_addr] = True
-          continue
-
-        counter = request_counter[tx_addr]
-        expected_response = self.response[counter]
-        response_valid = dat.startswith(expected_response)
-
-        if response_valid:
-          if counter + 1 < len(self.request):
-            response_timeouts[tx_addr] = time.monotonic() + timeout
-            msg.send(self.request[counter + 1])
-            request_counter[tx_addr] += 1
-          else:
-            results[tx_addr] = dat[len(expected_response):]
-            request_done[tx_addr] = True
-        else:
-          error_code = dat[2] if len(dat) > 2 else -1
-          if error_code == 0x78:
-            response_timeouts[tx_addr] = time.monotonic() + self.response_pending_timeout
-            carlog.error(f"iso-tp query response pending: {tx_addr}")
-          else:
-            request_done[tx_addr] = True
-            carlog.error(f"iso-tp query bad response: {tx_addr} - 0x{dat.hex()}")
-
-      # Mark request done if address timed out
-      cur_time = time.monotonic()
-      for tx_addr in response_timeouts:
-        if cur_time - response_timeouts[tx_addr] > 0:
-          if not request_done[tx_addr]:
-            if request_counter[tx_addr] > 0:
-              carlog.error(f"iso-tp query timeout after receiving partial response: {tx_addr}")
-            elif tx_addr in addrs_responded:
-              carlog.error(f"iso-tp query timeout while receiving response: {tx_addr}")
-            # TODO: handle functional addresses
-            # else:
-            #   carlog.error(f"iso-tp query timeout with no response: {tx_addr}")
-          request_done[tx_addr] = True
-
-      # Break if all requests are done (finished or timed out)
-      if all(request_done.values()):
+      if self._update():
         break
 
-      if cur_time - start_time > total_timeout:
+      if time.monotonic() - self.start_time > total_timeout:
         carlog.error("iso-tp query timeout while receiving data")
         break
 
-    return results
+    return self.results
+
+
+def get_data_concurrent(can_recv: CanRecvCallable, queries: list[IsoTpParallelQuery], timeout: float,
+                        total_timeout: float = 60.) -> list[dict[AddrType, bytes]]:
+  """Runs queries at the same time, sharing one receive loop. The queries must not wait for responses
+  on the same bus and address, frames are sorted to every query like IsoTpParallelQuery.get_data does.
+  A query that raises is stopped and returns no results, the others keep running."""
+  can_recv()
+  running = []
+  for query in queries:
+    query.msg_buffer = defaultdict(list)
+    query.results = {}
+    try:
+      query._start(timeout)
+      running.append(query)
+    except Exception:
+      carlog.exception("iso-tp query exception")
+
+  start_time = time.monotonic()
+  while len(running):
+    can_packets = can_recv(wait_for_one=True)
+    still_running = []
+    for query in running:
+      try:
+        query._sort_rx(can_packets)
+        if not query._update():
+          still_running.append(query)
+      except Exception:
+        carlog.exception("iso-tp query exception")
+        query.results = {}
+    running = still_running
+
+    if len(running) and time.monotonic() - start_time > total_timeout:
+      carlog.error("iso-tp query timeout while receiving data")
+      break
+
+  return [query.results for query in queries]
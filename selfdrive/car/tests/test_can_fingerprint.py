@@ -2,7 +2,7 @@ from parameterized import parameterized
 
 from openpilot.selfdrive.car.can_definitions import CanData
 from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
-from openpilot.selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS
+from openpilot.selfdrive.car.fingerprints import _FINGERPRINTS as FINGERPRINTS, _DEBUG_ADDRESS, cars_from_mask, compatible_cars_mask
 
 
 class TestCanFingerprint:
@@ -22,6 +22,14 @@ class TestCanFingerprint:
       assert finger[1] == fingerprint
       assert finger[2] == {}
 
+  def test_compatible_cars_mask(self):
+    addresses = {address for fingerprints in FINGERPRINTS.values() for fingerprint in fingerprints for address in fingerprint}
+    for address in sorted(addresses | _DEBUG_ADDRESS.keys() | {1, 0x800}):
+      for length in range(9):
+        expected = [car_model for car_model, fingerprints in FINGERPRINTS.items()
+                    if address >= 0x800 or any((fingerprint | _DEBUG_ADDRESS).get(address) == length for fingerprint in fingerprints)]
+        assert cars_from_mask(compatible_cars_mask(address, length)) == expected, f"{address=} {length=}"
+
   def test_timing(self, subtests):
     # just pick any CAN fingerprinting car
     car_model = "CHEVROLET_BOLT_EUV"
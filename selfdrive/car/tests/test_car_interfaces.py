@@ -10,7 +10,7 @@ from openpilot.selfdrive.car import DT_CTRL, gen_empty_fingerprint
 from openpilot.selfdrive.car.car_helpers import interfaces
 from openpilot.selfdrive.car.fingerprints import all_known_cars
 from openpilot.selfdrive.car.fw_versions import FW_VERSIONS, FW_QUERY_CONFIGS
-from openpilot.selfdrive.car.interfaces import get_interface_attr
+from openpilot.selfdrive.car.interfaces import CanParserDispatcher, get_interface_attr
 from openpilot.selfdrive.controls.lib.latcontrol_angle import LatControlAngle
 from openpilot.selfdrive.controls.lib.latcontrol_pid import LatControlPID
 from openpilot.selfdrive.controls.lib.latcontrol_torque import LatControlTorque
@@ -157,3 +157,26 @@ class TestCarInterfaces:
     ret = get_interface_attr('FINGERPRINTS', ignore_none=True)
     none_brands_in_ret = none_brands.intersection(ret)
     assert len(none_brands_in_ret) == 0, f'Brands with None values in ignore_none=True result: {none_brands_in_ret}'
+
+  def test_can_parser_dispatcher(self):
+    class FakeParser:
+      def __init__(self, bus, addresses):
+        self.bus = bus
+        self.vl = {a: {} for a in addresses} | {f"MSG_{a}": {} for a in addresses}
+        self.packets = []
+
+      def update_strings(self, packets):
+        self.packets = packets
+
+    pt, pt2, cam, empty = FakeParser(0, [0x100, 0x200]), FakeParser(0, [0x200]), FakeParser(2, [0x300]), FakeParser(1, [])
+    dispatcher = CanParserDispatcher([pt, None, pt2, cam, empty])
+
+    frames = [(0x100, b'\x01', 0), (0x200, b'\x02', 0), (0x300, b'\x03', 0), (0x300, b'\x04', 2), (0x100, b'\x05', 1)]
+    dispatcher.update([(1, frames), (2, [(0x400, b'', 2)]), (3, [])])
+
+    assert pt.packets == [(1, frames[:2]), (2, []), (3, [])]
+    assert pt2.packets == [(1, [frames[1]]), (2, []), (3, [])]
+    # parsers still see traffic on their bus without subscribed messages, for the bus timeout
+    assert cam.packets == [(1, [frames[3]]), (2, [(0x400, b'', 2)]), (3, [])]
+    assert empty.packets == [(1, [frames[4]]), (2, []), (3, [])]
+    assert len(dispatcher.parse_times_ns) == 4
@@ -8,8 +8,9 @@ from cereal import car
 from openpilot.selfdrive.car.can_definitions import CanData
 from openpilot.selfdrive.car.car_helpers import interfaces
 from openpilot.selfdrive.car.fingerprints import FW_VERSIONS
-from openpilot.selfdrive.car.fw_versions import ESSENTIAL_ECUS, FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, VERSIONS, build_fw_dict, \
-                                                match_fw_to_car, get_brand_ecu_matches, get_fw_versions, get_fw_versions_ordered, get_present_ecus
+from openpilot.selfdrive.car.fw_versions import ESSENTIAL_ECUS, FW_QUERY_CONFIGS, FUZZY_EXCLUDE_ECUS, REQUESTS, VERSIONS, build_fw_dict, \
+                                                match_fw_to_car, match_fw_to_car_exact, get_brand_ecu_matches, get_fw_match_index, get_fw_versions, \
+                                                get_fw_versions_ordered, get_present_ecus, schedule_fw_queries
 from openpilot.selfdrive.car.vin import get_vin
 
 CarFw = car.CarParams.CarFw
@@ -18,6 +19,44 @@ Ecu = car.CarParams.Ecu
 ECU_NAME = {v: k for k, v in Ecu.schema.enumerants.items()}
 
 
+def expected_exact_matches(live_fw_versions, brand, extra_fw_versions=None):
+  # every car whose non-debug ECUs have one of the live versions, essential ECUs can't be missing
+  if extra_fw_versions is None:
+    extra_fw_versions = {}
+
+  config = FW_QUERY_CONFIGS[brand]
+  matches = set()
+  for car_model, ecus in VERSIONS[brand].items():
+    for ecu, versions in ecus.items():
+      ecu_type, addr, sub_addr = ecu
+      found_versions = live_fw_versions.get((addr, sub_addr), set())
+      if ecu_type == Ecu.debug:
+        continue
+      if not len(found_versions) and (ecu_type not in ESSENTIAL_ECUS or car_model in config.non_essential_ecus.get(ecu_type, [])):
+        continue
+      if not found_versions & set(versions + extra_fw_versions.get(car_model, {}).get(ecu, [])):
+        break
+    else:
+      matches.add(car_model)
+  return matches
+
+
+def expected_fuzzy_matches(live_fw_versions, brand):
+  # the one car that at least two ECUs' versions uniquely belong to
+  cars = defaultdict(list)
+  for car_model, ecus in VERSIONS[brand].items():
+    for (ecu_type, addr, sub_addr), versions in ecus.items():
+      if ecu_type not in FUZZY_EXCLUDE_ECUS:
+        for version in versions:
+          cars[(addr, sub_addr, version)].append(car_model)
+
+  unique = {(addr, cars[(*addr, v)][0]) for addr, versions in live_fw_versions.items() for v in versions if len(cars[(*addr, v)]) == 1}
+  matched_cars = {car_model for _, car_model in unique}
+  if len(matched_cars) == 1 and len(unique) >= 2:
+    return matched_cars
+  return set()
+
+
 class TestFwFingerprint:
   def assertFingerprints(self, candidates, expected):
     candidates = list(candidates)
@@ -95,6 +134,57 @@ class TestFwFingerprint:
       elif len(matches):
         self.assertFingerprints(matches, car_model)
 
+  @pytest.mark.parametrize("brand", VERSIONS.keys())
+  def test_match_index(self, brand):
+    # matching with the cached index finds the same cars as checking every car in the database
+    rng = random.Random(0)
+    brand_versions = defaultdict(list)
+    for ecus in VERSIONS[brand].values():
+      for (_, addr, sub_addr), versions in ecus.items():
+        brand_versions[(addr, sub_addr)] += versions
+
+    for ecus in VERSIONS[brand].values():
+      for _ in range(5):
+        # a random subset of the car's ECUs, some with versions of other cars or unknown versions
+        live_fw_versions = defaultdict(set)
+        for (_, addr, sub_addr), versions in ecus.items():
+          if rng.random() < 0.8:
+            versions = brand_versions[(addr, sub_addr)] if rng.random() < 0.2 else versions
+            live_fw_versions[(addr, sub_addr)].add(rng.choice(versions) if rng.random() < 0.95 else b'unknown')
+        fw = [{"ecu": Ecu.unknown, "fwVersion": version, "brand": brand, "address": addr, "subAddress": 0 if sub_addr is None else sub_addr}
+              for (addr, sub_addr), versions in live_fw_versions.items() for version in versions]
+        CP = car.CarParams.new_message(carFw=fw)
+
+        # other brands only get their FW, which is none here
+        expected = set().union(*[expected_exact_matches(live_fw_versions if b == brand else {}, b) for b in VERSIONS])
+        assert match_fw_to_car(CP.carFw, CP.carVin, allow_fuzzy=False, log=False) == (True, expected)
+
+        expected = set()
+        for b, config in FW_QUERY_CONFIGS.items():
+          live = dict(live_fw_versions) if b == brand else {}
+          expected |= expected_fuzzy_matches(live, b)
+          if not len(expected) and config.match_fw_to_car_fuzzy is not None:
+            expected |= config.match_fw_to_car_fuzzy(live, CP.carVin, VERSIONS[b])
+        assert match_fw_to_car(CP.carFw, CP.carVin, allow_exact=False, log=False) == (len(expected) == 0, expected)
+
+  def test_match_extra_fw_versions(self):
+    # extra versions are only used for the call they're passed to, the cached index doesn't change
+    brand, car_model = 'toyota', 'TOYOTA_COROLLA_TSS2'
+    ecus = VERSIONS[brand][car_model]
+    live_fw_versions = {(addr, sub_addr): {versions[0]} for (_, addr, sub_addr), versions in ecus.items()}
+    assert car_model in match_fw_to_car_exact(live_fw_versions, brand)
+
+    ecu = next(ecu for ecu in ecus if ecu[0] in ESSENTIAL_ECUS)
+    live_fw_versions[ecu[1:]] = {b'new version'}
+    extra_fw_versions = {car_model: {ecu: [b'new version']}}
+    cached_index = get_fw_match_index(brand)
+    for _ in range(2):
+      assert car_model not in match_fw_to_car_exact(live_fw_versions, brand)
+      matches = match_fw_to_car_exact(live_fw_versions, brand, extra_fw_versions=extra_fw_versions)
+      assert car_model in matches
+      assert matches == expected_exact_matches(live_fw_versions, brand, extra_fw_versions)
+    assert get_fw_match_index(brand) is cached_index
+
   def test_fw_version_lists(self, subtests):
     for car_model, ecus in FW_VERSIONS.items():
       with subtests.test(car_model=car_model.value):
@@ -195,6 +285,50 @@ class TestFwFingerprint:
     expected_response = empty_response | {'toyota': {(0x750, 0xf)}}
     assert get_brand_ecu_matches({(0x758, 0xf, 99)}) == expected_response
 
+  def test_schedule_fw_queries(self):
+    queries = []
+    for brand, config, r in REQUESTS:
+      for ecu_type, addr, sub_addr in config.get_all_ecus(VERSIONS[brand]):
+        if len(r.whitelist_ecus) == 0 or ecu_type in r.whitelist_ecus:
+          queries.append((brand, config, r, [(addr, sub_addr)]))
+
+    batches = schedule_fw_queries(queries)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(queries)))
+
+    batch_idx = {i: n for n, batch in enumerate(batches) for i in batch}
+    for batch in batches:
+      # one OBD multiplexing mode per batch
+      assert len({queries[i][2].obd_multiplexing for i in batch if queries[i][2].bus % 4 == 1}) <= 1
+
+    # queries to the same ECU keep their order and never run together, even on different buses
+    for i, (_, _, _, ((addr1, _),)) in enumerate(queries):
+      for j in range(i + 1, len(queries)):
+        _, _, _, ((addr2, _),) = queries[j]
+        if addr1 == addr2:
+          assert batch_idx[i] < batch_idx[j]
+
+  def test_fw_query_exception(self, mocker):
+    # an exception in one query doesn't lose the responses of the queries running with it
+    def fake_update(query, fail_bus):
+      if query.bus == fail_bus:
+        raise Exception("query failed")
+      query.results = dict.fromkeys(query.msg_addrs, b'fw')
+      return True
+
+    def get_fws(fail_bus):
+      mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.IsoTpParallelQuery._start", lambda query, timeout: None)
+      mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.IsoTpParallelQuery._update", lambda query: fake_update(query, fail_bus))
+      car_fw = get_fw_versions(lambda wait_for_one=False: [], lambda msgs: None, lambda obd: None, num_pandas=2)
+      return {(fw.brand, fw.bus, fw.address, fw.subAddress, bytes(b''.join(fw.request))) for fw in car_fw}
+
+    exception_mock = mocker.patch("openpilot.selfdrive.car.carlog.exception")
+    all_fws = get_fws(fail_bus=None)
+    assert not exception_mock.called
+
+    fws = get_fws(fail_bus=1)
+    assert exception_mock.called
+    assert len(fws) and fws == {fw for fw in all_fws if fw[1] != 1}
+
 
 class TestFwFingerprintTiming:
   N: int = 5
@@ -223,9 +357,14 @@ class TestFwFingerprintTiming:
     self.total_time += timeout
     return {}
 
+  def fake_get_data_concurrent(self, can_recv, queries, timeout):
+    # concurrent queries share the timeout
+    self.total_time += timeout
+    return [{} for _ in queries]
+
   def _benchmark_brand(self, brand, num_pandas, mocker):
     self.total_time = 0
-    mocker.patch("openpilot.selfdrive.car.isotp_parallel_query.IsoTpParallelQuery.get_data", self.fake_get_data)
+    mocker.patch("openpilot.selfdrive.car.fw_versions.get_data_concurrent", self.fake_get_data_concurrent)
     for _ in range(self.N):
       # Treat each brand as the most likely (aka, the first) brand with OBD multiplexing initially on
       self.current_obd_multiplexing = True
@@ -267,7 +406,7 @@ class TestFwFingerprintTiming:
         print(f'get_vin {name} case, query time={self.total_time / self.N} seconds')
 
   def test_fw_query_timing(self, subtests, mocker):
-    total_ref_time = {1: 7.2, 2: 7.8}
+    total_ref_time = {1: 5.71, 2: 6.3}
     brand_ref_times = {
       1: {
         'gm': 1.0,
@@ -277,16 +416,15 @@ class TestFwFingerprintTiming:
         'honda': 0.45,
         'hyundai': 0.65,
         'mazda': 0.1,
-        'nissan': 0.8,
         'subaru': 0.65,
-        'tesla': 0.3,
-        'toyota': 0.7,
-        'volkswagen': 0.65,
+        'tesla': 0.2,
+        'toyota': 0.4,
+        'volkswagen': 0.35,
       },
       2: {
         'ford': 1.6,
         'hyundai': 1.15,
-        'tesla': 0.3,
+        'tesla': 0.2,
       }
     }
 
@@ -1,7 +1,6 @@
 import copy
 import os
 import json
-from collections import defaultdict
 from dataclasses import dataclass
 
 from openpilot.common.basedir import BASEDIR
@@ -33,11 +32,17 @@ class AlertEntry:
 
 class AlertManager:
   def __init__(self):
-    self.alerts: dict[str, AlertEntry] = defaultdict(AlertEntry)
+    # only active alerts are kept, an entry is dropped once it expires or is cleared
+    self.alerts: dict[str, AlertEntry] = {}
+    # order in which each alert type was first seen, breaks ties between equal priority and start_frame
+    self.alert_order: dict[str, int] = {}
 
   def add_many(self, frame: int, alerts: list[Alert]) -> None:
     for alert in alerts:
-      entry = self.alerts[alert.alert_type]
+      entry = self.alerts.get(alert.alert_type)
+      if entry is None:
+        entry = self.alerts[alert.alert_type] = AlertEntry()
+        self.alert_order.setdefault(alert.alert_type, len(self.alert_order))
       entry.alert = alert
       if not entry.active(frame):
         entry.start_frame = frame
@@ -45,17 +50,16 @@ class AlertManager:
       entry.end_frame = max(frame + 1, min_end_frame)
 
   def process_alerts(self, frame: int, clear_event_types: set) -> Alert | None:
-    current_alert = AlertEntry()
-    for v in self.alerts.values():
-      if not v.alert:
+    current_alert = None
+    current_key = None
+    for alert_type, v in list(self.alerts.items()):
+      if v.alert.event_type in clear_event_types or not v.active(frame):
+        del self.alerts[alert_type]
         continue
 
-      if v.alert.event_type in clear_event_types:
-        v.end_frame = -1
+      # sort by priority first, then by start_frame and then by first seen
+      key = (v.alert.priority, v.start_frame, -self.alert_order[alert_type])
+      if current_key is None or key > current_key:
+        current_alert, current_key = v.alert, key
 
-      # sort by priority first and then by start_frame
-      greater = current_alert.alert is None or (v.alert.priority, v.start_frame) > (current_alert.alert.priority, current_alert.start_frame)
-      if v.active(frame) and greater:
-        current_alert = v
-
-    return current_alert.alert
+    return current_alert
@@ -51,7 +51,11 @@ class Events:
   def __init__(self):
     self.events: list[int] = []
     self.static_events: list[int] = []
-    self.event_counters = dict.fromkeys(EVENTS.keys(), 0)
+    # consecutive cycles each event has been active for, inactive events are 0
+    self.event_counters: dict[int, int] = {}
+    # bitsets of the current and static events, matched against EVENT_TYPE_MASKS
+    self.mask = 0
+    self.static_mask = 0
 
   @property
   def names(self) -> list[int]:
@@ -63,30 +67,41 @@ class Events:
   def add(self, event_name: int, static: bool=False) -> None:
     if static:
       bisect.insort(self.static_events, event_name)
+      self.static_mask |= 1 << event_name
     bisect.insort(self.events, event_name)
+    self.mask |= 1 << event_name
 
   def clear(self) -> None:
-    self.event_counters = {k: (v + 1 if k in self.events else 0) for k, v in self.event_counters.items()}
+    event_counters = self.event_counters
+    self.event_counters = {e: event_counters.get(e, 0) + 1 for e in self.events}
     self.events = self.static_events.copy()
+    self.mask = self.static_mask
 
   def contains(self, event_type: str) -> bool:
-    return any(event_type in EVENTS.get(e, {}) for e in self.events)
+    return bool(self.mask & EVENT_TYPE_MASKS.get(event_type, 0))
 
   def create_alerts(self, event_types: list[str], callback_args=None):
     if callback_args is None:
       callback_args = []
 
+    types_mask = 0
+    for et in event_types:
+      types_mask |= EVENT_TYPE_MASKS.get(et, 0)
+
     ret = []
     for e in self.events:
-      types = EVENTS[e].keys()
+      if not (types_mask >> e) & 1:
+        continue
+
+      alerts = EVENTS[e]
       for et in event_types:
-        if et in types:
-          alert = EVENTS[e][et]
+        if et in alerts:
+          alert = alerts[et]
           if not isinstance(alert, Alert):
             alert = alert(*callback_args)
 
-          if DT_CTRL * (self.event_counters[e] + 1) >= alert.creation_delay:
-            alert.alert_type = f"{EVENT_NAME[e]}/{et}"
+          if DT_CTRL * (self.event_counters.get(e, 0) + 1) >= alert.creation_delay:
+            alert.alert_type = ALERT_TYPES[(e, et)]
             alert.event_type = et
             ret.append(alert)
     return ret
@@ -94,6 +109,7 @@ class Events:
   def add_from_msg(self, events):
     for e in events:
       bisect.insort(self.events, e.name.raw)
+      self.mask |= 1 << e.name.raw
 
   def to_msg(self):
     ret = []
@@ -959,6 +975,14 @@ EVENTS: dict[int, dict[str, Alert | AlertCallbackType]] = {
 
 }
 
+# bitset of the events that have an alert for each event type
+EVENT_TYPE_MASKS: dict[str, int] = {}
+ALERT_TYPES: dict[tuple[int, str], str] = {}
+for _event, _alerts in EVENTS.items():
+  for _et in _alerts:
+    EVENT_TYPE_MASKS[_et] = EVENT_TYPE_MASKS.get(_et, 0) | (1 << _event)
+    ALERT_TYPES[(_event, _et)] = f"{EVENT_NAME[_event]}/{_et}"
+
 
 if __name__ == '__main__':
   # print all alerts by type and priority
@@ -3,7 +3,6 @@ import math
 import numpy as np
 from openpilot.common.numpy_fast import clip, interp
 
-import cereal.messaging as messaging
 from openpilot.common.conversions import Conversions as CV
 from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.realtime import DT_MDL
@@ -154,7 +153,7 @@ class LongitudinalPlanner:
     self.v_desired_filter.x = self.v_desired_filter.x + self.dt * (self.a_desired + a_prev) / 2.0
 
   def publish(self, sm, pm):
-    plan_send = messaging.new_message('longitudinalPlan')
+    plan_send = pm.new_message('longitudinalPlan')
 
     plan_send.valid = sm.all_checks(service_list=['carState', 'controlsState'])
 
@@ -1,6 +1,6 @@
 import random
 
-from openpilot.selfdrive.controls.lib.events import Alert, EVENTS
+from openpilot.selfdrive.controls.lib.events import Alert, EVENTS, ET, NormalPermanentAlert, Priority
 from openpilot.selfdrive.controls.lib.alertmanager import AlertManager
 
 
@@ -37,3 +37,27 @@ class TestAlertManager:
           shown = current_alert is not None
           should_show = frame <= show_duration
           assert shown == should_show, f"{frame=} {add_duration=} {duration=}"
+
+  def test_priority(self):
+    """
+      Highest priority alert is shown, ties go to the newest and then to the first seen alert type
+    """
+    AM = AlertManager()
+    alerts = []
+    for i, priority in enumerate((Priority.LOW, Priority.MID, Priority.MID, Priority.LOW)):
+      alert = NormalPermanentAlert(f"alert {i}", priority=priority, duration=1.)
+      alert.alert_type = f"alert{i}/{ET.PERMANENT}"
+      alert.event_type = ET.PERMANENT
+      alerts.append(alert)
+
+    AM.add_many(0, alerts)
+    assert AM.process_alerts(0, set()) is alerts[1]
+    AM.add_many(1, alerts[2:0:-1])
+    assert AM.process_alerts(1, set()) is alerts[1]
+
+    # expired and cleared alerts are dropped
+    AM.add_many(200, [alerts[3], alerts[2]])
+    assert AM.process_alerts(200, set()) is alerts[2]
+    assert set(AM.alerts) == {alerts[2].alert_type, alerts[3].alert_type}
+    assert AM.process_alerts(200, {ET.PERMANENT}) is None
+    assert len(AM.alerts) == 0
@@ -8,7 +8,7 @@ from cereal import log, car
 from cereal.messaging import SubMaster
 from openpilot.common.basedir import BASEDIR
 from openpilot.common.params import Params
-from openpilot.selfdrive.controls.lib.events import Alert, EVENTS, ET
+from openpilot.selfdrive.controls.lib.events import Alert, EVENTS, ET, Events
 from openpilot.selfdrive.controls.lib.alertmanager import set_offroad_alert
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS
 
@@ -45,6 +45,26 @@ class TestAlerts:
         fail_msg = "%s @%d not in EVENTS" % (name, e)
         assert e in EVENTS.keys(), fail_msg
 
+  def test_events_contains(self):
+    event_types = [v for k, v in vars(ET).items() if not k.startswith('_')]
+    events = Events()
+    static_event = random.choice(list(EVENTS))
+    events.add(static_event, static=True)
+    for _ in range(100):
+      events.clear()
+      for e in random.sample(list(EVENTS), random.randint(0, 5)):
+        events.add(e)
+
+      for et in event_types:
+        assert events.contains(et) == any(et in EVENTS[e] for e in events.names)
+
+      # counters only advance for events that stay active
+      counters = events.event_counters
+      names = events.names.copy()
+      events.clear()
+      assert events.event_counters == {e: counters.get(e, 0) + 1 for e in names}
+      assert events.names == [static_event]
+
   # ensure alert text doesn't exceed allowed width
   def test_alert_text_length(self):
     font_path = os.path.join(BASEDIR, "selfdrive/assets/fonts")
@@ -1,10 +1,35 @@
 import cereal.messaging as messaging
 
+from openpilot.common.simple_kalman import KF1D
+from openpilot.selfdrive.controls.radard import KalmanParams, Tracks
 from openpilot.selfdrive.test.process_replay import replay_process_with_name
 from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
 
 
 class TestLeads:
+  def test_tracks(self):
+    kalman_params = KalmanParams(0.05)
+    tracks = Tracks(kalman_params)
+    kf = KF1D([[15.0], [0.0]], kalman_params.A, kalman_params.C, kalman_params.K)
+
+    # tracks keep the order they first appeared in, missing tracks are removed
+    frames = [
+      ({3: [20., 0., 5., True], 1: [10., 1., 0., True]}, [3, 1]),
+      ({5: [30., 0., 1., False], 3: [21., 0., 6., True]}, [3, 5]),
+      ({3: [22., 0., 7., True], 7: [40., 1., 2., True], 5: [31., 0., 1., True]}, [3, 5, 7]),
+    ]
+    for i, (ar_pts, identifiers) in enumerate(frames):
+      tracks.update(ar_pts, 10.)
+      if i > 0:
+        kf.update(ar_pts[3][2] + 10.)
+      assert tracks.identifiers.tolist() == identifiers
+      assert tracks.vLeadK[0] == kf.x[0][0]
+      assert tracks.aLeadK[0] == kf.x[1][0]
+
+    assert tracks.cnt.tolist() == [3, 2, 1]
+    assert tracks.dRel.tolist() == [22., 31., 40.]
+    assert tracks.vLeadK[2] == 12.
+
   def test_radar_fault(self):
     # if there's no radar-related can traffic, radard should either not respond or respond with an error
     # this is tightly coupled with underlying car radar_interface implementation, but it's a good sanity check
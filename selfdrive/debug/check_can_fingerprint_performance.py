@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import argparse
+import numpy as np
+import time
+from tqdm import tqdm
+
+from openpilot.selfdrive.car.can_definitions import CanData
+from openpilot.selfdrive.car.car_helpers import FRAME_FINGERPRINT, can_fingerprint
+from openpilot.tools.lib.logreader import LogReader
+from openpilot.tools.plotjuggler.juggle import DEMO_ROUTE
+
+N_RUNS = 10
+
+
+def get_fingerprinting_window(lr: LogReader) -> list[list[CanData]]:
+  # can_fingerprint gives up after 200 packets, start from the first CAN packet like card does
+  window = []
+  for msg in lr:
+    if msg.which() == 'can':
+      window.append([CanData(c.address, c.dat, c.src) for c in msg.can])
+      if len(window) > FRAME_FINGERPRINT * 2 + 1:
+        break
+  return window
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark CAN fingerprinting on the start of a route',
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument('route', nargs='?', default=f'{DEMO_ROUTE}/0/r')
+  args = parser.parse_args()
+
+  window = get_fingerprinting_window(LogReader(args.route))
+
+  ets = []
+  for _ in tqdm(range(N_RUNS)):
+    packets = iter(window)
+    start_t = time.process_time_ns()
+    car_fingerprint, _ = can_fingerprint(lambda **kwargs: [next(packets, [])])  # noqa: B023
+    ets.append((time.process_time_ns() - start_t) * 1e-6)
+
+  n_frames = sum(len(packet) for packet in window)
+  print(f'fingerprint: {car_fingerprint}, {len(window)} CAN packets, {n_frames} CAN frames, {N_RUNS} runs')
+  print(f'{np.mean(ets):.2f} mean ms, {max(ets):.2f} max ms, {min(ets):.2f} min ms, {np.std(ets):.2f} std ms')
+  print(f'{np.mean(ets) * 1e3 / n_frames:.4f} mean us / CAN frame')
@@ -1,9 +1,10 @@
 #!/usr/bin/env python3
+import argparse
 import numpy as np
 import time
 from tqdm import tqdm
 
-from cereal import car
+from openpilot.selfdrive.car.interfaces import CanParserDispatcher
 from openpilot.selfdrive.car.tests.routes import CarTestRoute
 from openpilot.selfdrive.car.tests.test_models import TestCarModelBase
 from openpilot.selfdrive.pandad import can_capnp_to_list
@@ -17,24 +18,56 @@ class CarModelTestCase(TestCarModelBase):
   ci = False
 
 
+def print_stats(name: str, ets: list[float], n_packets: int) -> None:
+  print(f'{name}: {np.mean(ets):.2f} mean ms, {max(ets):.2f} max ms, {min(ets):.2f} min ms, {np.std(ets):.2f} std ms, ' +
+        f'{np.mean(ets) / n_packets:.4f} mean ms / CAN packet')
+
+
 if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Benchmark CAN parsing of a car interface on a route',
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument('--route', default=DEMO_ROUTE)
+  parser.add_argument('--car', help='platform of the route, detected from the route if not given')
+  args = parser.parse_args()
+  CarModelTestCase.test_route = CarTestRoute(args.route, args.car)
+
   # Get CAN messages and parsers
   tm = CarModelTestCase()
   tm.setUpClass()
   tm.setUp()
 
-  CC = car.CarControl.new_message()
+  can_parsers = [cp for cp in tm.CI.can_parsers if cp is not None]
+  msgs = [m.as_builder().to_bytes() for m in tm.can_msgs]
+  can_lists = [can_capnp_to_list([msg]) for msg in msgs]
+
+  # every parser walks all frames, as before dispatching
   ets = []
   for _ in tqdm(range(N_RUNS)):
-    msgs = [m.as_builder().to_bytes() for m in tm.can_msgs]
     start_t = time.process_time_ns()
-    for msg in msgs:
-      can_list = can_capnp_to_list([msg])
-      for cp in tm.CI.can_parsers:
-        if cp is not None:
-          cp.update_strings(can_list)
+    for can_list in can_lists:
+      for cp in can_parsers:
+        cp.update_strings(can_list)
     ets.append((time.process_time_ns() - start_t) * 1e-6)
 
+  # frames are split by bus and address once, CarInterfaceBase.update
+  dispatcher = CanParserDispatcher(can_parsers)
+  dispatched_ets = []
+  parse_ets = np.zeros(len(can_parsers))
+  dispatch_et = 0.
+  for _ in tqdm(range(N_RUNS)):
+    start_t = time.process_time_ns()
+    for can_list in can_lists:
+      dispatcher.update(can_list)
+      parse_ets += dispatcher.parse_times_ns
+      dispatch_et += dispatcher.dispatch_time_ns
+    dispatched_ets.append((time.process_time_ns() - start_t) * 1e-6)
+
   print(f'{len(tm.can_msgs)} CAN packets, {N_RUNS} runs')
-  print(f'{np.mean(ets):.2f} mean ms, {max(ets):.2f} max ms, {min(ets):.2f} min ms, {np.std(ets):.2f} std ms')
-  print(f'{np.mean(ets) / len(tm.can_msgs):.4f} mean ms / CAN packet')
+  print_stats('all frames', ets, len(tm.can_msgs))
+  print_stats('dispatched', dispatched_ets, len(tm.can_msgs))
+
+  print('\ndispatched, mean us / CAN packet:')
+  n_updates = N_RUNS * len(tm.can_msgs)
+  print(f'  {"dispatch":>24}: {dispatch_et * 1e-3 / n_updates:.2f}')
+  for cp, et in zip(can_parsers, parse_ets, strict=True):
+    print(f'  {f"{cp.dbc_name} bus {cp.bus}":>24}: {et * 1e-3 / n_updates:.2f}')
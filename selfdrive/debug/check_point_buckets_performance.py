@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+import numpy as np
+import time
+
+from openpilot.selfdrive.locationd.torqued import TorqueBuckets, STEER_BUCKET_BOUNDS, MIN_BUCKET_POINTS, MIN_POINTS_TOTAL, \
+                                                 POINTS_PER_BUCKET, FIT_POINTS_TOTAL
+
+N_POINTS = 100000
+N_GETS = 1000
+
+
+def timed(f, n):
+  ets = []
+  for _ in range(n):
+    start_t = time.process_time_ns()
+    f()
+    ets.append((time.process_time_ns() - start_t) * 1e-3)
+  return np.mean(ets)
+
+
+if __name__ == '__main__':
+  buckets = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS, min_points=MIN_BUCKET_POINTS, min_points_total=MIN_POINTS_TOTAL,
+                          points_per_bucket=POINTS_PER_BUCKET, rowsize=3)
+  points = np.column_stack([np.random.uniform(-0.5, 0.5, N_POINTS), np.random.normal(0., 1., N_POINTS)]).tolist()
+
+  # filling the buckets, then adding to full buckets, as torqued does all drive long
+  ets = []
+  for x, y in points:
+    start_t = time.process_time_ns()
+    buckets.add_point(x, y)
+    ets.append((time.process_time_ns() - start_t) * 1e-3)
+  print(f'add_point, filling: {np.mean(ets[:len(buckets)]):.2f} us, full: {np.mean(ets[len(buckets):]):.2f} us')
+
+  print(f'{len(buckets)} points')
+  print(f'get_points({FIT_POINTS_TOTAL}): {timed(lambda: buckets.get_points(FIT_POINTS_TOTAL), N_GETS):.2f} us')
+  print(f'get_points(): {timed(buckets.get_points, N_GETS):.2f} us')
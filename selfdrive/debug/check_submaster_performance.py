@@ -0,0 +1,28 @@
+#!/usr/bin/env python3
+import numpy as np
+import time
+
+import cereal.messaging as messaging
+from cereal.services import SERVICE_LIST
+
+N_UPDATES = 10000
+N_SERVICES = (1, 5, 10, 20, 40)
+
+
+if __name__ == '__main__':
+  # services with a frequency, so they all go through the alive and average frequency checks
+  services = sorted(s for s, v in SERVICE_LIST.items() if v.frequency > 1. and s != 'carState')
+  msg = messaging.new_message('carState').as_reader()
+
+  # only the polled service is received, as in most cycles of a process subscribed to many services
+  print('services, mean us / update')
+  for n in N_SERVICES:
+    sm = messaging.SubMaster(['carState', *services[:n - 1]], poll='carState')
+    cur_time = time.monotonic()
+    ets = []
+    for _ in range(N_UPDATES):
+      cur_time += 0.01
+      start_t = time.process_time_ns()
+      sm.update_msgs(cur_time, [msg])
+      ets.append((time.process_time_ns() - start_t) * 1e-3)
+    print(f'{n:8d}, {np.mean(ets):.2f}')
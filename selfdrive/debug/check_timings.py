@@ -17,7 +17,7 @@ if __name__ == "__main__":
     while True:
       print()
       for s, sock in socks.items():
-        msgs = messaging.drain_sock(sock)
+        msgs = messaging.drain_sock_lazy(sock)
         for m in msgs:
           ts[s].append(m.logMonoTime / 1e6)
 
@@ -29,7 +29,7 @@ if __name__ == "__main__":
     print("\n")
     print("="*5, "timing summary", "="*5)
     for s, sock in socks.items():
-      msgs = messaging.drain_sock(sock)
+      msgs = messaging.drain_sock_lazy(sock)
       if len(ts[s]) > 2:
         d = np.diff(ts[s])
         print(f"{s:25} {np.mean(d):7.2f} {np.std(d):7.2f} {np.max(d):7.2f} {np.min(d):7.2f}")
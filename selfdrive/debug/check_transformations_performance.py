@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import numpy as np
+import time
+
+import openpilot.common.transformations.transformations as T
+from openpilot.common.transformations.coordinates import LocalCoord
+
+N_SAMPLES = 100000
+
+
+def timed(f, inp):
+  start_t = time.process_time_ns()
+  out = f(inp)
+  return out, (time.process_time_ns() - start_t) * 1e-6
+
+
+if __name__ == '__main__':
+  eulers = np.random.uniform(-np.pi, np.pi, (N_SAMPLES, 3))
+  quats = np.asarray([T.euler2quat_single(e) for e in eulers])
+  rots = np.asarray([T.euler2rot_single(e) for e in eulers])
+  geodetics = np.column_stack([np.random.uniform(-90, 90, N_SAMPLES), np.random.uniform(-180, 180, N_SAMPLES), np.random.uniform(-100, 3000, N_SAMPLES)])
+  ecefs = T.geodetic2ecef_batch(geodetics)
+  lc = LocalCoord.from_geodetic(geodetics[0])
+
+  # the single versions in a python loop, as the numpy wrappers used to run them
+  funcs = [
+    ('euler2quat', T.euler2quat_single, T.euler2quat_batch, eulers),
+    ('quat2euler', T.quat2euler_single, T.quat2euler_batch, quats),
+    ('quat2rot', T.quat2rot_single, T.quat2rot_batch, quats),
+    ('rot2quat', T.rot2quat_single, T.rot2quat_batch, rots),
+    ('euler2rot', T.euler2rot_single, T.euler2rot_batch, eulers),
+    ('rot2euler', T.rot2euler_single, T.rot2euler_batch, rots),
+    ('geodetic2ecef', T.geodetic2ecef_single, T.geodetic2ecef_batch, geodetics),
+    ('ecef2geodetic', T.ecef2geodetic_single, T.ecef2geodetic_batch, ecefs),
+    ('ecef2ned', lc.ecef2ned_single, lc.ecef2ned_batch, ecefs),
+    ('ned2geodetic', lc.ned2geodetic_single, lc.ned2geodetic_batch, lc.ecef2ned_batch(ecefs)),
+  ]
+
+  print(f'{N_SAMPLES} samples, single ms, batch ms, speedup')
+  for name, single, batch, inp in funcs:
+    single_out, single_ms = timed(lambda x, f=single: np.asarray([f(i) for i in x]), inp)
+    batch_out, batch_ms = timed(batch, inp)
+    assert np.array_equal(single_out, batch_out, equal_nan=True), name
+    print(f'{name:>14s}, {single_ms:9.1f}, {batch_ms:8.1f}, {single_ms / batch_ms:7.1f}x')
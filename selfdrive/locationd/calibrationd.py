@@ -117,6 +117,7 @@ class Calibrator:
     self.idx = 0
     self.block_idx = 0
     self.v_ego = 0.0
+    self.valid_idxs_changed = True
 
     if smooth_from is None:
       self.old_rpy = RPY_INIT
@@ -131,7 +132,7 @@ class Calibrator:
     after_current = list(range(min(self.valid_blocks, self.block_idx + 1), self.valid_blocks))
     return before_current + after_current
 
-  def update_status(self) -> None:
+  def update_block_stats(self) -> None:
     valid_idxs = self.get_valid_idxs()
     if valid_idxs:
       self.wide_from_device_euler = np.mean(self.wide_from_device_eulers[valid_idxs], axis=0)
@@ -143,6 +144,12 @@ class Calibrator:
       self.calib_spread = np.abs(max_rpy_calib - min_rpy_calib)
     else:
       self.calib_spread = np.zeros(3)
+    self.valid_idxs_changed = False
+
+  def update_status(self) -> None:
+    # only the current block is updated between block boundaries, and it is excluded from the stats
+    if self.valid_idxs_changed:
+      self.update_block_stats()
 
     if self.valid_blocks < INPUTS_NEEDED:
       if self.cal_status == log.LiveCalibrationData.Status.recalibrating:
@@ -219,6 +226,7 @@ class Calibrator:
 
     self.idx = (self.idx + 1) % BLOCK_SIZE
     if self.idx == 0:
+      self.valid_idxs_changed = True
       self.block_idx += 1
       self.valid_blocks = max(self.block_idx, self.valid_blocks)
       self.block_idx = self.block_idx % INPUTS_WANTED
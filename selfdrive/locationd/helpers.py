@@ -13,25 +13,66 @@ def rotate_std(rot_matrix, std_in):
 
 
 class NPQueue:
-  def __init__(self, maxlen: int, rowsize: int) -> None:
+  """
+  Fixed size FIFO of rows in a preallocated buffer. Every row is written twice, maxlen rows apart,
+  so the rows in the queue are always a contiguous, oldest first slice of the buffer.
+  """
+  def __init__(self, maxlen: int, rowsize: int, buf: np.ndarray | None = None) -> None:
     self.maxlen = maxlen
-    self.arr = np.empty((0, rowsize))
+    self.buf = np.empty((2 * maxlen, rowsize)) if buf is None else buf
+    self.start = 0
+    self.size = 0
 
   def __len__(self) -> int:
-    return len(self.arr)
+    return self.size
+
+  @property
+  def arr(self) -> np.ndarray:
+    # view into the buffer, only valid until the next append
+    return self.buf[self.start:self.start + self.size]
 
   def append(self, pt: list[float]) -> None:
-    if len(self.arr) < self.maxlen:
-      self.arr = np.append(self.arr, [pt], axis=0)
+    idx = (self.start + self.size) % self.maxlen
+    self.buf[idx] = pt
+    self.buf[idx + self.maxlen] = pt
+    if self.size < self.maxlen:
+      self.size += 1
     else:
-      self.arr[:-1] = self.arr[1:]
-      self.arr[-1] = pt
+      self.start = (self.start + 1) % self.maxlen
+
+
+class TimeSeriesBuffer(NPQueue):
+  """
+  Fixed size history of timestamped samples. The buffer is column major, so the times and
+  each field are contiguous, oldest first views that can be interpolated without copies.
+  """
+  def __init__(self, maxlen: int, fields: list[str]) -> None:
+    super().__init__(maxlen, len(fields) + 1, buf=np.empty((len(fields) + 1, 2 * maxlen)).T)
+    self.fields = {field: i + 1 for i, field in enumerate(fields)}
+
+  @property
+  def t(self) -> np.ndarray:
+    return self.arr[:, 0]
+
+  def __getitem__(self, field: str) -> np.ndarray:
+    return self.arr[:, self.fields[field]]
+
+  def append(self, t: float, *values: float) -> None:
+    super().append([t, *values])
+
+  def interp(self, t: float | np.ndarray, field: str) -> Any:
+    # clamped to the oldest and newest sample, like np.interp
+    return np.interp(t, self.t, self[field])
 
 
 class PointBuckets:
   def __init__(self, x_bounds: list[tuple[float, float]], min_points: list[float], min_points_total: int, points_per_bucket: int, rowsize: int) -> None:
     self.x_bounds = x_bounds
-    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize) for bounds in x_bounds}
+    # all buckets share one buffer, so points can be gathered from any bucket at once
+    self.bucket_size = 2 * points_per_bucket
+    self.buf = np.empty((len(x_bounds) * self.bucket_size, rowsize))
+    self.buckets = {bounds: NPQueue(maxlen=points_per_bucket, rowsize=rowsize, buf=self.buf[i * self.bucket_size:(i + 1) * self.bucket_size])
+                    for i, bounds in enumerate(x_bounds)}
     self.buckets_min_points = dict(zip(x_bounds, min_points, strict=True))
     self.min_points_total = min_points_total
 
@@ -49,11 +90,24 @@ class PointBuckets:
   def add_point(self, x: float, y: float) -> None:
     raise NotImplementedError
 
+  def bucket_points(self) -> list[np.ndarray]:
+    # views into the shared buffer, oldest first for every bucket, only valid until the next add_point
+    return [x.arr for x in self.buckets.values()]
+
   def get_points(self, num_points: int = None) -> Any:
-    points = np.vstack([x.arr for x in self.buckets.values()])
+    # returns a copy that stays valid while points are added, bucket_points() reads them in place
     if num_points is None:
-      return points
-    return points[np.random.choice(np.arange(len(points)), min(len(points), num_points), replace=False)]
+      return np.concatenate(self.bucket_points())
+    return self.sample_points(num_points)
+
+  def sample_points(self, num_points: int) -> np.ndarray:
+    # same points as indexing get_points() with a random choice, without stacking all buckets first
+    lengths = [len(x) for x in self.buckets.values()]
+    offsets = np.cumsum([0, *lengths])
+    idxs = np.random.choice(np.arange(offsets[-1]), min(offsets[-1], num_points), replace=False)
+    bucket_idxs = np.searchsorted(offsets, idxs, side='right') - 1
+    starts = np.arange(len(self.buckets)) * self.bucket_size + [x.start for x in self.buckets.values()]
+    return self.buf.take(starts[bucket_idxs] + idxs - offsets[bucket_idxs], axis=0)
 
   def load_points(self, points: list[list[float]]) -> None:
     for point in points:
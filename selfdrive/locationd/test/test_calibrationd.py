@@ -110,3 +110,13 @@ class TestCalibrationd:
     assert c.valid_blocks == 1
     assert c.cal_status == log.LiveCalibrationData.Status.recalibrating
     np.testing.assert_allclose(c.rpy, [0.0, 0.0, MAX_ALLOWED_YAW_SPREAD*1.1], atol=1e-2)
+
+  def test_block_stats(self):
+    c = Calibrator(param_put=False)
+    process_messages(c, [0.0, 0.0, 0.0], BLOCK_SIZE * 2)
+    for i in range(2 * INPUTS_WANTED):
+      process_messages(c, [0.0, 0.01 * np.sin(i), 0.01 * np.cos(i)], BLOCK_SIZE // 2)
+      valid_idxs = c.get_valid_idxs()
+      np.testing.assert_array_equal(c.rpy, np.mean(c.rpys[valid_idxs], axis=0))
+      np.testing.assert_array_equal(c.height, np.mean(c.heights[valid_idxs], axis=0))
+      np.testing.assert_array_equal(c.calib_spread, np.ptp(c.rpys[valid_idxs], axis=0))
@@ -0,0 +1,65 @@
+import numpy as np
+
+from openpilot.selfdrive.locationd.helpers import NPQueue, PointBuckets, TimeSeriesBuffer
+
+
+class SimplePointBuckets(PointBuckets):
+  def add_point(self, x, y):
+    for bound_min, bound_max in self.x_bounds:
+      if bound_min <= x < bound_max:
+        self.buckets[(bound_min, bound_max)].append([x, y])
+        break
+
+
+class TestHelpers:
+  def test_np_queue(self):
+    q = NPQueue(maxlen=5, rowsize=2)
+    assert q.arr.shape == (0, 2)
+    for i in range(12):
+      q.append([i, -i])
+      expected = np.arange(max(0, i - 4), i + 1)
+      assert len(q) == len(expected)
+      np.testing.assert_array_equal(q.arr, np.column_stack([expected, -expected]))
+
+  def test_time_series_buffer(self):
+    buf = TimeSeriesBuffer(maxlen=4, fields=['a', 'b'])
+    for i in range(6):
+      buf.append(i * 0.1, i, bool(i % 2))
+
+    assert len(buf) == 4
+    np.testing.assert_allclose(buf.t, [0.2, 0.3, 0.4, 0.5])
+    np.testing.assert_array_equal(buf['a'], [2, 3, 4, 5])
+    assert buf.t.flags.c_contiguous and buf['b'].flags.c_contiguous
+    np.testing.assert_allclose(buf.interp(np.array([0.0, 0.25, 1.0]), 'a'), [2, 2.5, 5])
+    assert buf.interp(0.45, 'b') == 0.5
+
+  def test_sample_points(self):
+    buckets = SimplePointBuckets(x_bounds=[(0, 1), (1, 2), (2, 3)], min_points=[0, 0, 0], min_points_total=0, points_per_bucket=10, rowsize=2)
+    for i in range(100):
+      buckets.add_point(np.random.uniform(0, 3), i)
+
+    for num_points in (1, 10, 30, 100):
+      np.random.seed(num_points)
+      sampled = buckets.get_points(num_points)
+      np.random.seed(num_points)
+      idxs = np.random.choice(np.arange(len(buckets)), min(len(buckets), num_points), replace=False)
+      np.testing.assert_array_equal(sampled, buckets.get_points()[idxs])
+
+  def test_bucket_points(self):
+    buckets = SimplePointBuckets(x_bounds=[(0, 1), (1, 2), (2, 3)], min_points=[0, 0, 0], min_points_total=0, points_per_bucket=10, rowsize=2)
+    for i in range(25):
+      buckets.add_point(np.random.uniform(0, 3), i)
+
+    views = buckets.bucket_points()
+    assert [len(v) for v in views] == [len(x) for x in buckets.buckets.values()]
+    assert all(np.shares_memory(v, buckets.buf) for v in views if len(v))
+
+    points = buckets.get_points()
+    np.testing.assert_array_equal(points, np.concatenate(views))
+    assert not np.shares_memory(points, buckets.buf)
+
+    # the copy is unaffected by new points
+    expected = points.copy()
+    for i in range(25):
+      buckets.add_point(np.random.uniform(0, 3), 100 + i)
+    np.testing.assert_array_equal(points, expected)
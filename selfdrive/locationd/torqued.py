@@ -1,6 +1,5 @@
 #!/usr/bin/env python3
 import numpy as np
-from collections import deque, defaultdict
 
 import cereal.messaging as messaging
 from cereal import car, log
@@ -10,7 +9,7 @@ from openpilot.common.filter_simple import FirstOrderFilter
 from openpilot.common.swaglog import cloudlog
 from openpilot.common.transformations.orientation import rot_from_euler
 from openpilot.selfdrive.controls.lib.vehicle_model import ACCELERATION_DUE_TO_GRAVITY
-from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator
+from openpilot.selfdrive.locationd.helpers import PointBuckets, ParameterEstimator, TimeSeriesBuffer
 
 HISTORY = 5  # secs
 POINTS_PER_BUCKET = 1500
@@ -51,7 +50,7 @@ class TorqueBuckets(PointBuckets):
 
 
 class TorqueEstimator(ParameterEstimator):
-  def __init__(self, CP, decimated=False, track_all_points=False):
+  def __init__(self, CP, decimated=False, track_all_points=False, restore_params=True):
     self.hist_len = int(HISTORY / DT_MDL)
     self.lag = CP.steerActuatorDelay + .2  # from controlsd
     self.track_all_points = track_all_points  # for offline analysis, without max lateral accel or max steer torque filters
@@ -95,29 +94,30 @@ class TorqueEstimator(ParameterEstimator):
     self.max_friction = (1.0 + self.friction_sanity) * self.offline_friction
 
     # try to restore cached params
-    params = Params()
-    params_cache = params.get("CarParamsPrevRoute")
-    torque_cache = params.get("LiveTorqueParameters")
-    if params_cache is not None and torque_cache is not None:
-      try:
-        with log.Event.from_bytes(torque_cache) as log_evt:
-          cache_ltp = log_evt.liveTorqueParameters
-        with car.CarParams.from_bytes(params_cache) as msg:
-          cache_CP = msg
-        if self.get_restore_key(cache_CP, cache_ltp.version) == self.get_restore_key(CP, VERSION):
-          if cache_ltp.liveValid:
-            initial_params = {
-              'latAccelFactor': cache_ltp.latAccelFactorFiltered,
-              'latAccelOffset': cache_ltp.latAccelOffsetFiltered,
-              'frictionCoefficient': cache_ltp.frictionCoefficientFiltered
-            }
-          initial_params['points'] = cache_ltp.points
-          self.decay = cache_ltp.decay
-          self.filtered_points.load_points(initial_params['points'])
-          cloudlog.info("restored torque params from cache")
-      except Exception:
-        cloudlog.exception("failed to restore cached torque params")
-        params.remove("LiveTorqueParameters")
+    if restore_params:
+      params = Params()
+      params_cache = params.get("CarParamsPrevRoute")
+      torque_cache = params.get("LiveTorqueParameters")
+      if params_cache is not None and torque_cache is not None:
+        try:
+          with log.Event.from_bytes(torque_cache) as log_evt:
+            cache_ltp = log_evt.liveTorqueParameters
+          with car.CarParams.from_bytes(params_cache) as msg:
+            cache_CP = msg
+          if self.get_restore_key(cache_CP, cache_ltp.version) == self.get_restore_key(CP, VERSION):
+            if cache_ltp.liveValid:
+              initial_params = {
+                'latAccelFactor': cache_ltp.latAccelFactorFiltered,
+                'latAccelOffset': cache_ltp.latAccelOffsetFiltered,
+                'frictionCoefficient': cache_ltp.frictionCoefficientFiltered
+              }
+            initial_params['points'] = cache_ltp.points
+            self.decay = cache_ltp.decay
+            self.filtered_points.load_points(initial_params['points'])
+            cloudlog.info("restored torque params from cache")
+        except Exception:
+          cloudlog.exception("failed to restore cached torque params")
+          params.remove("LiveTorqueParameters")
 
     self.filtered_params = {}
     for param in initial_params:
@@ -134,7 +134,11 @@ class TorqueEstimator(ParameterEstimator):
   def reset(self):
     self.resets += 1.0
     self.decay = MIN_FILTER_DECAY
-    self.raw_points = defaultdict(lambda: deque(maxlen=self.hist_len))
+    self.raw_points = {
+      'carControl': TimeSeriesBuffer(self.hist_len, ['lat_active']),
+      'carOutput': TimeSeriesBuffer(self.hist_len, ['steer_torque']),
+      'carState': TimeSeriesBuffer(self.hist_len, ['vego', 'steer_override']),
+    }
     self.filtered_points = TorqueBuckets(x_bounds=STEER_BUCKET_BOUNDS,
                                          min_points=self.min_bucket_points,
                                          min_points_total=self.min_points_total,
@@ -164,35 +168,30 @@ class TorqueEstimator(ParameterEstimator):
 
   def handle_log(self, t, which, msg):
     if which == "carControl":
-      self.raw_points["carControl_t"].append(t + self.lag)
-      self.raw_points["lat_active"].append(msg.latActive)
+      self.raw_points["carControl"].append(t + self.lag, msg.latActive)
     elif which == "carOutput":
-      self.raw_points["carOutput_t"].append(t + self.lag)
-      self.raw_points["steer_torque"].append(-msg.actuatorsOutput.steer)
+      self.raw_points["carOutput"].append(t + self.lag, -msg.actuatorsOutput.steer)
     elif which == "carState":
-      self.raw_points["carState_t"].append(t + self.lag)
       # TODO: check if high aEgo affects resulting lateral accel
-      self.raw_points["vego"].append(msg.vEgo)
-      self.raw_points["steer_override"].append(msg.steeringPressed)
+      self.raw_points["carState"].append(t + self.lag, msg.vEgo, msg.steeringPressed)
     elif which == "liveCalibration":
       device_from_calib = rot_from_euler(np.array(msg.rpyCalib))
       self.calib_from_device = device_from_calib.T
 
     # calculate lateral accel from past steering torque
     elif which == "livePose":
-      if len(self.raw_points['steer_torque']) == self.hist_len:
+      if len(self.raw_points['carOutput']) == self.hist_len:
         angular_velocity_device = np.array([msg.angularVelocityDevice.x, msg.angularVelocityDevice.y, msg.angularVelocityDevice.z])
         angular_velocity_calibrated = np.matmul(self.calib_from_device, angular_velocity_device)
 
         yaw_rate = angular_velocity_calibrated[2]
         roll = msg.orientationNED.x
         # check lat active up to now (without lag compensation)
-        lat_active = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL),
-                               self.raw_points['carControl_t'], self.raw_points['lat_active']).astype(bool)
-        steer_override = np.interp(np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL),
-                                   self.raw_points['carState_t'], self.raw_points['steer_override']).astype(bool)
-        vego = np.interp(t, self.raw_points['carState_t'], self.raw_points['vego'])
-        steer = np.interp(t, self.raw_points['carOutput_t'], self.raw_points['steer_torque']).item()
+        engage_window = np.arange(t - MIN_ENGAGE_BUFFER, t + self.lag, DT_MDL)
+        lat_active = self.raw_points['carControl'].interp(engage_window, 'lat_active').astype(bool)
+        steer_override = self.raw_points['carState'].interp(engage_window, 'steer_override').astype(bool)
+        vego = self.raw_points['carState'].interp(t, 'vego')
+        steer = self.raw_points['carOutput'].interp(t, 'steer_torque').item()
         lateral_acc = (vego * yaw_rate) - (np.sin(roll) * ACCELERATION_DUE_TO_GRAVITY).item()
         if all(lat_active) and not any(steer_override) and (vego > MIN_VEL) and (abs(steer) > STEER_MIN_THRESHOLD):
           if abs(lateral_acc) <= LAT_ACC_THRESHOLD:
@@ -227,7 +226,7 @@ class TorqueEstimator(ParameterEstimator):
           self.update_params({'latAccelFactor': latAccelFactor, 'latAccelOffset': latAccelOffset, 'frictionCoefficient': frictionCoeff})
 
     if with_points:
-      liveTorqueParameters.points = self.filtered_points.get_points()[:, [0, 2]].tolist()
+      liveTorqueParameters.points = np.concatenate([x[:, [0, 2]] for x in self.filtered_points.bucket_points()]).tolist()
 
     liveTorqueParameters.latAccelFactorFiltered = float(self.filtered_params['latAccelFactor'].x)
     liveTorqueParameters.latAccelOffsetFiltered = float(self.filtered_params['latAccelOffset'].x)
@@ -3,43 +3,102 @@ import sys
 import math
 import capnp
 import numbers
-import dictdiffer
 from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
 
 from openpilot.tools.lib.logreader import LogReader
 
 EPSILON = sys.float_info.epsilon
-
-
-def remove_ignored_fields(msg, ignore):
-  msg = msg.as_builder()
-  for key in ignore:
-    attr = msg
-    keys = key.split(".")
-    if msg.which() != keys[0] and len(keys) > 1:
-      continue
-
-    for k in keys[:-1]:
-      # indexing into list
-      if k.isdigit():
-        attr = attr[int(k)]
+MAX_DIFF_EXAMPLES = 10  # detailed diffs kept per field path
+
+
+@dataclass
+class FieldDiff:
+  path: str  # field path without list indices
+  count: int = 0
+  max_error: float | None = None  # largest absolute difference, if the field is numeric
+  examples: list[tuple[str, Any, Any]] = field(default_factory=list)  # (path, ref value, new value)
+
+
+class LogDiffer:
+  """
+  Compares messages by walking their schema. Structs without ignored fields below them
+  are compared by bytes first, only mismatching ones are walked field by field.
+  """
+  def __init__(self, ignore_fields, tolerance, max_examples):
+    self.ignore = {tuple(f.split(".")) for f in ignore_fields}
+    self.ignore_prefixes = {p[:i] for p in self.ignore for i in range(len(p))}
+    self.tolerance = tolerance
+    self.max_examples = max_examples
+    self.diffs: dict[str, FieldDiff] = {}
+    self._fields: dict[int, tuple[tuple[str, ...], bool]] = {}
+
+  def add(self, path, a, b, err=None, kind=""):
+    field_path = ".".join(p for p in path if not p.isdigit()) + kind
+    d = self.diffs.get(field_path)
+    if d is None:
+      d = self.diffs[field_path] = FieldDiff(field_path)
+
+    d.count += 1
+    if err is not None:
+      d.max_error = err if d.max_error is None else max(d.max_error, err)
+    if len(d.examples) < self.max_examples:
+      d.examples.append((".".join(path) + kind, a, b))
+
+  def fields(self, msg):
+    node_id = msg.schema.node.id
+    if node_id not in self._fields:
+      self._fields[node_id] = (msg.schema.non_union_fields, len(msg.schema.union_fields) > 0)
+    return self._fields[node_id]
+
+  def compare_struct(self, a, b, path=()):
+    if path in self.ignore:
+      return
+    if path not in self.ignore_prefixes and a.as_builder().to_bytes() == b.as_builder().to_bytes():
+      return
+
+    names, has_union = self.fields(a)
+    for name in names:
+      self.compare(getattr(a, name), getattr(b, name), path + (name,))
+
+    if has_union:
+      which_a, which_b = a.which(), b.which()
+      if which_a != which_b:
+        self.add(path, which_a, which_b, kind="[which]")
       else:
-        attr = getattr(attr, k)
-
-    v = getattr(attr, keys[-1])
-    if isinstance(v, bool):
-      val = False
-    elif isinstance(v, numbers.Number):
-      val = 0
-    elif isinstance(v, (list, capnp.lib.capnp._DynamicListBuilder)):
-      val = []
-    else:
-      raise NotImplementedError(f"Unknown type: {type(v)}")
-    setattr(attr, keys[-1], val)
-  return msg
-
-
-def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None,):
+        self.compare(getattr(a, which_a), getattr(b, which_b), path + (which_a,))
+
+  def compare_list(self, a, b, path):
+    if len(a) != len(b):
+      self.add(path, len(a), len(b), kind="[len]")
+    for i, (va, vb) in enumerate(zip(a, b, strict=False)):
+      self.compare(va, vb, path + (str(i),))
+
+  def compare(self, a, b, path):
+    if path in self.ignore:
+      return
+
+    if isinstance(a, capnp.lib.capnp._DynamicStructReader):
+      self.compare_struct(a, b, path)
+    elif isinstance(a, capnp.lib.capnp._DynamicListReader):
+      self.compare_list(a, b, path)
+    elif isinstance(a, capnp.lib.capnp._DynamicEnum):
+      if str(a) != str(b):
+        self.add(path, str(a), str(b))
+    elif a != b:
+      if isinstance(a, float) and isinstance(b, float) and math.isnan(a) and math.isnan(b):
+        return
+
+      err = None
+      if isinstance(a, numbers.Number) and isinstance(b, numbers.Number) and not isinstance(a, bool):
+        err = abs(a - b)
+        if math.isfinite(a) and math.isfinite(b) and err <= max(self.tolerance, self.tolerance * max(abs(a), abs(b))):
+          return
+      self.add(path, a, b, err)
+
+
+def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=None, max_examples=MAX_DIFF_EXAMPLES):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -56,37 +115,14 @@ def compare_logs(log1, log2, ignore_fields=None, ignore_msgs=None, tolerance=Non
     cnt2 = Counter(m.which() for m in log2)
     raise Exception(f"logs are not same length: {len(log1)} VS {len(log2)}\n\t\t{cnt1}\n\t\t{cnt2}")
 
-  diff = []
+  differ = LogDiffer(ignore_fields, tolerance, max_examples)
   for msg1, msg2 in zip(log1, log2, strict=True):
     if msg1.which() != msg2.which():
       raise Exception("msgs not aligned between logs")
 
-    msg1 = remove_ignored_fields(msg1, ignore_fields)
-    msg2 = remove_ignored_fields(msg2, ignore_fields)
-
-    if msg1.to_bytes() != msg2.to_bytes():
-      msg1_dict = msg1.as_reader().to_dict(verbose=True)
-      msg2_dict = msg2.as_reader().to_dict(verbose=True)
+    differ.compare_struct(msg1, msg2)
 
-      dd = dictdiffer.diff(msg1_dict, msg2_dict, ignore=ignore_fields)
-
-      # Dictdiffer only supports relative tolerance, we also want to check for absolute
-      # TODO: add this to dictdiffer
-      def outside_tolerance(diff):
-        try:
-          if diff[0] == "change":
-            a, b = diff[2]
-            finite = math.isfinite(a) and math.isfinite(b)
-            if finite and isinstance(a, numbers.Number) and isinstance(b, numbers.Number):
-              return abs(a - b) > max(tolerance, tolerance * max(abs(a), abs(b)))
-        except TypeError:
-          pass
-        return True
-
-      dd = list(filter(outside_tolerance, dd))
-
-      diff.extend(dd)
-  return diff
+  return [differ.diffs[k] for k in sorted(differ.diffs)]
 
 
 def format_process_diff(diff):
@@ -96,15 +132,14 @@ def format_process_diff(diff):
     diff_short += f"        {diff}\n"
     diff_long += f"\t{diff}\n"
   else:
-    cnt: dict[str, int] = {}
     for d in diff:
-      diff_long += f"\t{str(d)}\n"
-
-      k = str(d[1])
-      cnt[k] = 1 if k not in cnt else cnt[k] + 1
+      max_error = f" (max error: {d.max_error:.6g})" if d.max_error is not None else ""
+      diff_short += f"        {d.path}: {d.count}{max_error}\n"
 
-    for k, v in sorted(cnt.items()):
-      diff_short += f"        {k}: {v}\n"
+      for path, a, b in d.examples:
+        diff_long += f"\t{path}: {a!r} -> {b!r}\n"
+      if d.count > len(d.examples):
+        diff_long += f"\t{d.path}: {d.count - len(d.examples)} more\n"
 
   return diff_short, diff_long
 
@@ -0,0 +1,230 @@
+"""
+In-process replay transport for Python daemons.
+
+The daemon runs in a thread of the replay process and every socket it creates is backed by an
+InProcessBus instead of msgq. The bus mirrors msgq's fake socket events (recv_called/recv_ready
+per endpoint, a poller that returns all sockets), so ReplayContext drives the daemon through
+exactly the same receive sequence as over real sockets, minus the IPC round-trips and copies.
+"""
+import importlib
+import threading
+from collections import defaultdict, deque
+from collections.abc import Iterator
+from contextlib import contextmanager
+
+import cereal.messaging as messaging
+
+# daemons that were verified to produce the same output as over msgq
+IN_PROCESS_PROCS = {"controlsd", "radard", "plannerd", "calibrationd", "paramsd", "torqued"}
+
+
+class ReplayTransportClosed(BaseException):
+  """Unwinds a daemon blocked on its bus once the container is stopped"""
+
+
+class ReplayTransportError(Exception):
+  pass
+
+
+class InProcessEvent:
+  def __init__(self, bus: 'InProcessBus'):
+    self.bus = bus
+    self.is_set = False
+
+  def set(self) -> None:
+    with self.bus.cond:
+      self.is_set = True
+      self.bus.cond.notify_all()
+
+  def clear(self) -> None:
+    with self.bus.cond:
+      self.is_set = False
+
+  def peek(self) -> bool:
+    return self.is_set
+
+  def wait(self) -> None:
+    with self.bus.cond:
+      self.bus.cond.wait_for(lambda: self.is_set or self.bus.done)
+      if not self.is_set:
+        self.bus.check()
+
+
+class InProcessEventHandle:
+  def __init__(self, bus: 'InProcessBus', enabled: bool):
+    self.enabled = enabled
+    self.recv_called_event = InProcessEvent(bus)
+    self.recv_ready_event = InProcessEvent(bus)
+
+
+class InProcessPoller:
+  """Same as msgq's fake poller, all sockets are always ready and the locking happens in receive"""
+  def __init__(self):
+    self.sockets: list[InProcessSubSocket] = []
+
+  def registerSocket(self, sock: 'InProcessSubSocket') -> None:
+    self.sockets.append(sock)
+
+  def poll(self, timeout: int) -> list['InProcessSubSocket']:
+    return self.sockets
+
+
+class InProcessSubSocket:
+  def __init__(self, bus: 'InProcessBus', endpoint: str, conflate: bool, timeout: int | None):
+    self.bus = bus
+    self.endpoint = endpoint
+    self.timeout = timeout
+    self.queue: deque[bytes] = deque(maxlen=1 if conflate else None)
+
+  def receive(self, non_blocking: bool = False) -> bytes | None:
+    handle = self.bus.events.get(self.endpoint)
+    if handle is not None and handle.enabled:
+      handle.recv_called_event.set()
+      handle.recv_ready_event.wait()
+      handle.recv_ready_event.clear()
+
+    with self.bus.cond:
+      # nothing gets published while the daemon runs, so a receive with a timeout would time out
+      if not non_blocking and self.timeout is None:
+        self.bus.cond.wait_for(lambda: len(self.queue) or self.bus.done)
+        if not len(self.queue):
+          self.bus.check()
+      return self.queue.popleft() if len(self.queue) else None
+
+
+class InProcessPubSocket:
+  def __init__(self, bus: 'InProcessBus', endpoint: str):
+    self.bus = bus
+    self.endpoint = endpoint
+
+  def send(self, dat: bytes) -> None:
+    with self.bus.cond:
+      for sock in self.bus.subscribers[self.endpoint]:
+        sock.queue.append(dat)
+      self.bus.cond.notify_all()
+
+  def all_readers_updated(self) -> bool:
+    with self.bus.cond:
+      socks = self.bus.subscribers[self.endpoint]
+      return len(socks) > 0 and all(len(sock.queue) == 0 for sock in socks)
+
+
+class InProcessBus:
+  def __init__(self, name: str):
+    self.name = name
+    self.cond = threading.Condition()
+    self.subscribers: defaultdict[str, list[InProcessSubSocket]] = defaultdict(list)
+    self.events: dict[str, InProcessEventHandle] = {}
+    self.closed = False
+    self.exception: BaseException | None = None
+
+  @property
+  def done(self) -> bool:
+    return self.closed or self.exception is not None
+
+  def check(self) -> None:
+    if self.exception is not None:
+      raise ReplayTransportError(f"{self.name} died") from self.exception
+    if self.closed:
+      raise ReplayTransportClosed
+
+  def fail(self, exception: BaseException) -> None:
+    with self.cond:
+      self.exception = exception
+      self.cond.notify_all()
+
+  def close(self) -> None:
+    with self.cond:
+      self.closed = True
+      self.cond.notify_all()
+
+  def fake_event_handle(self, endpoint: str, enable: bool = False) -> InProcessEventHandle:
+    if endpoint not in self.events:
+      self.events[endpoint] = InProcessEventHandle(self, enable)
+    self.events[endpoint].enabled = enable
+    return self.events[endpoint]
+
+  def wait_for_one_event(self, events: list[InProcessEvent]) -> int:
+    with self.cond:
+      while True:
+        for i, event in enumerate(events):
+          if event.peek():
+            return i
+        self.check()
+        self.cond.wait()
+
+  def sub_sock(self, endpoint: str, poller: InProcessPoller | None = None, conflate: bool = False,
+               timeout: int | None = None) -> InProcessSubSocket:
+    sock = InProcessSubSocket(self, endpoint, conflate, timeout)
+    with self.cond:
+      self.subscribers[endpoint].append(sock)
+    if poller is not None:
+      poller.registerSocket(sock)
+    return sock
+
+  def pub_sock(self, endpoint: str) -> InProcessPubSocket:
+    return InProcessPubSocket(self, endpoint)
+
+  @contextmanager
+  def bind(self) -> Iterator['InProcessBus']:
+    """Sockets created by the current thread in this context are on this bus"""
+    _install()
+    ident = threading.get_ident()
+    prev = _bound_buses.get(ident)
+    _bound_buses[ident] = self
+    try:
+      yield self
+    finally:
+      if prev is None:
+        del _bound_buses[ident]
+      else:
+        _bound_buses[ident] = prev
+
+  def start_daemon(self, module: str) -> threading.Thread:
+    def run():
+      with self.bind():
+        try:
+          importlib.import_module(module).main()
+        except ReplayTransportClosed:
+          return
+        except BaseException as e:
+          self.fail(e)
+        else:
+          self.fail(ReplayTransportError(f"{self.name} exited"))
+
+    thread = threading.Thread(target=run, name=self.name, daemon=True)
+    thread.start()
+    return thread
+
+
+_bound_buses: dict[int, InProcessBus] = {}
+_msgq_sub_sock = messaging.sub_sock
+_msgq_pub_sock = messaging.pub_sock
+_msgq_poller = messaging.Poller
+
+
+def _sub_sock(endpoint, poller=None, addr="127.0.0.1", conflate=False, timeout=None):
+  bus = _bound_buses.get(threading.get_ident())
+  if bus is None:
+    return _msgq_sub_sock(endpoint, poller=poller, addr=addr, conflate=conflate, timeout=timeout)
+  return bus.sub_sock(endpoint, poller=poller, conflate=conflate, timeout=timeout)
+
+
+def _pub_sock(endpoint):
+  bus = _bound_buses.get(threading.get_ident())
+  if bus is None:
+    return _msgq_pub_sock(endpoint)
+  return bus.pub_sock(endpoint)
+
+
+def _poller():
+  if threading.get_ident() not in _bound_buses:
+    return _msgq_poller()
+  return InProcessPoller()
+
+
+def _install() -> None:
+  # threads without a bound bus keep using msgq
+  messaging.sub_sock = _sub_sock
+  messaging.pub_sock = _pub_sock
+  messaging.Poller = _poller
@@ -9,7 +9,7 @@ from openpilot.system.hardware import PC
 from openpilot.tools.lib.openpilotci import BASE_URL, get_url
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
 from openpilot.selfdrive.test.process_replay.process_replay import get_process_config, replay_process
-from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.framereader import FrameReader, FrameType, get_video_indexes
 from openpilot.tools.lib.logreader import LogReader, save_log
 
 TEST_ROUTE = "2f4452b03ccb98f0|2022-12-03--13-45-30"
@@ -74,11 +74,14 @@ if __name__ == "__main__":
 
   # load logs
   lr = list(LogReader(get_url(TEST_ROUTE, SEGMENT)))
-  frs = {
-    'roadCameraState': FrameReader(get_url(TEST_ROUTE, SEGMENT, log_type="fcamera"), readahead=True),
-    'driverCameraState': FrameReader(get_url(TEST_ROUTE, SEGMENT, log_type="dcamera"), readahead=True),
-    'wideRoadCameraState': FrameReader(get_url(TEST_ROUTE, SEGMENT, log_type="ecamera"), readahead=True)
+  camera_urls = {
+    'roadCameraState': get_url(TEST_ROUTE, SEGMENT, log_type="fcamera"),
+    'driverCameraState': get_url(TEST_ROUTE, SEGMENT, log_type="dcamera"),
+    'wideRoadCameraState': get_url(TEST_ROUTE, SEGMENT, log_type="ecamera"),
   }
+  # index the cameras in parallel
+  index_data = get_video_indexes(camera_urls.values(), FrameType.h265_stream)
+  frs = {cam: FrameReader(url, readahead=True, index_data=idx) for (cam, url), idx in zip(camera_urls.items(), index_data, strict=True)}
 
   log_msgs = []
   # run replays
@@ -2,10 +2,12 @@
 import os
 import time
 import copy
+import gc
 import json
 import heapq
 import signal
 import platform
+import threading
 from collections import Counter, OrderedDict
 from dataclasses import dataclass, field
 from typing import Any
@@ -28,6 +30,7 @@ from openpilot.system.manager.process_config import managed_processes
 from openpilot.selfdrive.test.process_replay.vision_meta import meta_from_camera_state, available_streams
 from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.capture import ProcessOutputCapture
+from openpilot.selfdrive.test.process_replay.inprocess import IN_PROCESS_PROCS, InProcessBus
 from openpilot.tools.lib.logreader import LogIterable
 from openpilot.tools.lib.framereader import BaseFrameReader
 
@@ -102,6 +105,9 @@ class ReplayContext:
   def all_recv_ready_events(self):
     return [man.recv_ready_event for man in self.events.values()]
 
+  def wait_for_one_event(self, events) -> int:
+    return messaging.wait_for_one_event(events)
+
   def send_sync(self, pm, endpoint, dat):
     self.events[endpoint].recv_called_event.wait()
     self.events[endpoint].recv_called_event.clear()
@@ -111,22 +117,44 @@ class ReplayContext:
   def unlock_sockets(self):
     expected_sets = len(self.events)
     while expected_sets > 0:
-      index = messaging.wait_for_one_event(self.all_recv_called_events)
+      index = self.wait_for_one_event(self.all_recv_called_events)
       self.all_recv_called_events[index].clear()
       self.all_recv_ready_events[index].set()
       expected_sets -= 1
 
   def wait_for_recv_called(self):
-    messaging.wait_for_one_event(self.all_recv_called_events)
+    self.wait_for_one_event(self.all_recv_called_events)
 
   def wait_for_next_recv(self, trigger_empty_recv):
-    index = messaging.wait_for_one_event(self.all_recv_called_events)
+    index = self.wait_for_one_event(self.all_recv_called_events)
     if self.main_pub is not None and self.main_pub_drained and trigger_empty_recv:
       self.all_recv_called_events[index].clear()
       self.all_recv_ready_events[index].set()
       self.all_recv_called_events[index].wait()
 
 
+class InProcessReplayContext(ReplayContext):
+  """Same lock-step protocol as ReplayContext, with the events living on an InProcessBus instead of msgq"""
+  def __init__(self, cfg, bus: InProcessBus):
+    super().__init__(cfg)
+    self.bus = bus
+
+  def open_context(self):
+    if self.main_pub is None:
+      self.events = OrderedDict()
+      pubs_with_events = [pub for pub in self.pubs if pub not in self.unlocked_pubs]
+      for pub in pubs_with_events:
+        self.events[pub] = self.bus.fake_event_handle(pub, enable=True)
+    else:
+      self.events = {self.main_pub: self.bus.fake_event_handle(self.main_pub, enable=True)}
+
+  def close_context(self):
+    del self.events
+
+  def wait_for_one_event(self, events) -> int:
+    return self.bus.wait_for_one_event(events)
+
+
 @dataclass
 class ProcessConfig:
   proc_name: str
@@ -148,10 +176,14 @@ class ProcessConfig:
 
 
 class ProcessContainer:
-  def __init__(self, cfg: ProcessConfig):
+  def __init__(self, cfg: ProcessConfig, in_process: bool = False):
     self.prefix = OpenpilotPrefix(clean_dirs_on_exit=False)
     self.cfg = copy.deepcopy(cfg)
     self.process = copy.deepcopy(managed_processes[cfg.proc_name])
+    # run supported python daemons as a thread of this process, talking over an InProcessBus
+    self.bus: InProcessBus | None = InProcessBus(cfg.proc_name) if in_process and cfg.proc_name in IN_PROCESS_PROCS else None
+    self.daemon_thread: threading.Thread | None = None
+    self.gc_enabled = gc.isenabled()
     self.msg_queue: list[capnp._DynamicStructReader] = []
     self.cnt = 0
     self.pm: messaging.PubMaster | None = None
@@ -165,6 +197,12 @@ class ProcessContainer:
   def has_empty_queue(self) -> bool:
     return len(self.msg_queue) == 0
 
+  @property
+  def is_alive(self) -> bool:
+    if self.daemon_thread is not None:
+      return self.daemon_thread.is_alive()
+    return self.process.proc is not None and self.process.proc.is_alive()
+
   @property
   def pubs(self) -> list[str]:
     return self.cfg.pubs
@@ -219,6 +257,13 @@ class ProcessContainer:
     self.cfg.vision_pubs = [meta.camera_state for meta in streams_metas if meta.camera_state in self.cfg.vision_pubs]
 
   def _start_process(self):
+    if self.bus is not None:
+      # daemons disable gc and set realtime priorities, restored on stop
+      self.gc_enabled = gc.isenabled()
+      self.process.prepare()
+      self.daemon_thread = self.bus.start_daemon(self.process.module)
+      return
+
     if self.capture is not None:
       self.process.launcher = LauncherWithCapture(self.capture, self.process.launcher)
     self.process.prepare()
@@ -236,18 +281,25 @@ class ProcessContainer:
         params = Params()
         self.cfg.config_callback(params, self.cfg, all_msgs)
 
-      self.rc = ReplayContext(self.cfg)
-      self.rc.open_context()
+      if self.bus is not None:
+        self.rc = InProcessReplayContext(self.cfg, self.bus)
+        self.rc.open_context()
+        with self.bus.bind():
+          self.pm = messaging.PubMaster(self.cfg.pubs)
+          self.sockets = [messaging.sub_sock(s, timeout=100) for s in self.cfg.subs]
+      else:
+        self.rc = ReplayContext(self.cfg)
+        self.rc.open_context()
 
-      self.pm = messaging.PubMaster(self.cfg.pubs)
-      self.sockets = [messaging.sub_sock(s, timeout=100) for s in self.cfg.subs]
+        self.pm = messaging.PubMaster(self.cfg.pubs)
+        self.sockets = [messaging.sub_sock(s, timeout=100) for s in self.cfg.subs]
 
       if len(self.cfg.vision_pubs) != 0:
         assert frs is not None
         self._setup_vision_ipc(all_msgs, frs)
         assert self.vipc_server is not None
 
-      if capture_output:
+      if capture_output and self.bus is None:
         self.capture = ProcessOutputCapture(self.cfg.proc_name, p.prefix)
 
       self._start_process()
@@ -260,16 +312,27 @@ class ProcessContainer:
         while not all(self.pm.all_readers_updated(s) for s in self.cfg.pubs if s not in self.cfg.ignore_alive_pubs):
           time.sleep(0)
 
+        # the daemon thread shares our environment, only let it run inside the prefix
+        if self.bus is not None:
+          self.rc.wait_for_recv_called()
+
   def stop(self):
     with self.prefix:
-      self.process.signal(signal.SIGKILL)
-      self.process.stop()
+      if self.bus is not None:
+        self.bus.close()
+        if self.daemon_thread is not None:
+          self.daemon_thread.join(timeout=1)
+        if self.gc_enabled:
+          gc.enable()
+      else:
+        self.process.signal(signal.SIGKILL)
+        self.process.stop()
       self.rc.close_context()
       self.prefix.clean_dirs()
       self._clean_env()
 
   def run_step(self, msg: capnp._DynamicStructReader, frs: dict[str, BaseFrameReader] | None) -> list[capnp._DynamicStructReader]:
-    assert self.rc and self.pm and self.sockets and self.process.proc
+    assert self.rc and self.pm and self.sockets and self.is_alive
 
     output_msgs = []
     with self.prefix, Timeout(self.cfg.timeout, error_msg=f"timed out testing process {repr(self.cfg.proc_name)}"):
@@ -313,7 +376,9 @@ class ProcessContainer:
             m.logMonoTime = msg.logMonoTime + int(self.cfg.processing_time * 1e9)
             output_msgs.append(m.as_reader())
         self.cnt += 1
-    assert self.process.proc.is_alive()
+    if self.bus is not None:
+      self.bus.check()
+    assert self.is_alive
 
     return output_msgs
 
@@ -641,6 +706,18 @@ def get_custom_params_from_lr(lr: LogIterable, initial_state: str = "first") ->
   return custom_params
 
 
+def get_migration_flags(cfgs: Iterable[ProcessConfig]) -> dict[str, bool]:
+  """
+  Config dependent migrate_all flags. Logs migrated once with these flags can be
+  replayed by any set of configs with the same flags, see replay_process(migrated=True).
+  """
+  cfgs = list(cfgs)
+  return {
+    "panda_states": any("pandaStates" in cfg.pubs for cfg in cfgs),
+    "camera_states": any(len(cfg.vision_pubs) != 0 for cfg in cfgs),
+  }
+
+
 def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args, **kwargs) -> list[capnp._DynamicStructReader]:
   if isinstance(name, str):
     cfgs = [get_process_config(name)]
@@ -655,18 +732,20 @@ def replay_process_with_name(name: str | Iterable[str], lr: LogIterable, *args,
 def replay_process(
   cfg: ProcessConfig | Iterable[ProcessConfig], lr: LogIterable, frs: dict[str, BaseFrameReader] = None,
   fingerprint: str = None, return_all_logs: bool = False, custom_params: dict[str, Any] = None,
-  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False
+  captured_output_store: dict[str, dict[str, str]] = None, disable_progress: bool = False, migrated: bool = False,
+  in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
   if isinstance(cfg, Iterable):
     cfgs = list(cfg)
   else:
     cfgs = [cfg]
 
-  all_msgs = migrate_all(lr, old_logtime=True,
-                         manager_states=True,
-                         panda_states=any("pandaStates" in cfg.pubs for cfg in cfgs),
-                         camera_states=any(len(cfg.vision_pubs) != 0 for cfg in cfgs))
-  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress)
+  if migrated:
+    # already passed through migrate_all with old_logtime, manager_states and get_migration_flags(cfgs)
+    all_msgs = list(lr)
+  else:
+    all_msgs = migrate_all(lr, old_logtime=True, manager_states=True, **get_migration_flags(cfgs))
+  process_logs = _replay_multi_process(cfgs, all_msgs, frs, fingerprint, custom_params, captured_output_store, disable_progress, in_process)
 
   if return_all_logs:
     keys = {m.which() for m in process_logs}
@@ -682,7 +761,8 @@ def replay_process(
 
 def _replay_multi_process(
   cfgs: list[ProcessConfig], lr: LogIterable, frs: dict[str, BaseFrameReader] | None, fingerprint: str | None,
-  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool
+  custom_params: dict[str, Any] | None, captured_output_store: dict[str, dict[str, str]] | None, disable_progress: bool,
+  in_process: bool = False
 ) -> list[capnp._DynamicStructReader]:
   if fingerprint is not None:
     params_config = generate_params_config(lr=lr, fingerprint=fingerprint, custom_params=custom_params)
@@ -706,7 +786,7 @@ def _replay_multi_process(
   try:
     containers = []
     for cfg in cfgs:
-      container = ProcessContainer(cfg)
+      container = ProcessContainer(cfg, in_process)
       containers.append(container)
       container.start(params_config, env_config, all_msgs, frs, fingerprint, captured_output_store is not None)
 
@@ -743,8 +823,8 @@ def _replay_multi_process(
     for container in containers:
       container.stop()
       if captured_output_store is not None:
-        assert container.capture is not None
-        out, err = container.capture.read_outerr()
+        # in-process daemons write to our own stdout and stderr
+        out, err = container.capture.read_outerr() if container.capture is not None else ("", "")
         captured_output_store[container.cfg.proc_name] = {"out": out, "err": err}
 
   return log_msgs
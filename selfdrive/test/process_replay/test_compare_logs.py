@@ -0,0 +1,57 @@
+import pytest
+
+from cereal import log
+from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_process_diff
+
+
+def car_states(v_egos, **kwargs):
+  return [log.Event.new_message(logMonoTime=i, carState={'vEgo': v, **kwargs}).as_reader() for i, v in enumerate(v_egos)]
+
+
+class TestCompareLogs:
+  def test_equal(self):
+    assert compare_logs(car_states([1., 2.]), car_states([1., 2.])) == []
+
+  def test_ignored_fields(self):
+    ref = car_states([1., 2.])
+    new = [log.Event.new_message(logMonoTime=10 + i, carState={'vEgo': 3.}).as_reader() for i in range(2)]
+    assert len(compare_logs(ref, new)) == 2
+    assert compare_logs(ref, new, ignore_fields=["logMonoTime", "carState.vEgo"]) == []
+    # ignored messages are dropped before the logs are aligned
+    assert compare_logs(ref + [log.Event.new_message(can=[]).as_reader()], ref, ignore_msgs=["can"]) == []
+
+  def test_tolerance(self):
+    ref, new = car_states([1., 100.]), car_states([1. + 1e-6, 100. + 1e-3])
+    diffs = compare_logs(ref, new)
+    assert [d.path for d in diffs] == ["carState.vEgo"]
+    assert diffs[0].count == 2
+    assert diffs[0].max_error == pytest.approx(1e-3, rel=1e-3)  # vEgo is a float32
+
+    # relative to the larger value, or absolute for small values
+    assert compare_logs(ref, new, tolerance=1e-5) == []
+    assert [d.count for d in compare_logs(ref, new, tolerance=1e-6)] == [1]
+
+  def test_length_mismatch(self):
+    with pytest.raises(Exception, match="logs are not same length"):
+      compare_logs(car_states([1., 2.]), car_states([1.]))
+
+    ref = car_states([1.], buttonEvents=[{'type': 'accelCruise'}])
+    new = car_states([1.], buttonEvents=[{'type': 'accelCruise'}, {'type': 'decelCruise'}])
+    diffs = compare_logs(ref, new)
+    assert [(d.path, d.count, d.examples) for d in diffs] == [("carState.buttonEvents[len]", 1, [("carState.buttonEvents[len]", 1, 2)])]
+
+  def test_examples_per_field(self):
+    ref, new = car_states(range(20), buttonEvents=[{'type': 'accelCruise'}]), car_states(range(1, 21), buttonEvents=[{'type': 'decelCruise'}])
+    diffs = compare_logs(ref, new, ignore_fields=["logMonoTime"], max_examples=3)
+    assert [(d.path, d.count, len(d.examples)) for d in diffs] == [("carState.buttonEvents.type", 20, 3), ("carState.vEgo", 20, 3)]
+    # list indices are kept in the examples, but not in the aggregated path
+    assert diffs[0].examples[0] == ("carState.buttonEvents.0.type", "accelCruise", "decelCruise")
+    assert diffs[1].max_error == 1
+
+  def test_diff_format(self):
+    diffs = compare_logs(car_states([1., 2., 3.]), car_states([1.5, 2., 4.]), max_examples=1)
+    diff_short, diff_long = format_process_diff(diffs)
+    assert diff_short == "        carState.vEgo: 2 (max error: 1)\n"
+    assert diff_long == "\tcarState.vEgo: 1.0 -> 1.5\n\tcarState.vEgo: 1 more\n"
+
+    assert format_process_diff("process failed") == ("        process failed\n", "\tprocess failed\n")
@@ -0,0 +1,135 @@
+import math
+import threading
+import time
+import pytest
+
+import cereal.messaging as messaging
+from openpilot.selfdrive.car.toyota.values import CAR as TOYOTA
+from openpilot.selfdrive.test.process_replay.inprocess import InProcessBus, ReplayTransportClosed, ReplayTransportError
+from openpilot.selfdrive.test.process_replay.process_replay import InProcessReplayContext, ProcessConfig, get_process_config, replay_process
+
+CFG = ProcessConfig(proc_name="echo", pubs=["carState", "liveCalibration"], subs=["carControl"], ignore=[])
+
+
+def echo_daemon(bus, fail_frame=None):
+  with bus.bind():
+    try:
+      sm = messaging.SubMaster(['carState', 'liveCalibration'], poll='carState')
+      pm = messaging.PubMaster(['carControl'])
+      while True:
+        sm.update()
+        if sm.frame == fail_frame:
+          raise ValueError("daemon failed")
+
+        msg = messaging.new_message('carControl')
+        msg.carControl.enabled = sm['carState'].cruiseState.enabled
+        msg.carControl.latActive = sm.updated['liveCalibration']
+        pm.send('carControl', msg)
+    except ReplayTransportClosed:
+      pass
+    except BaseException as e:
+      bus.fail(e)
+
+
+def start_echo_daemon(fail_frame=None):
+  bus = InProcessBus(CFG.proc_name)
+  rc = InProcessReplayContext(CFG, bus)
+  rc.open_context()
+  with bus.bind():
+    pm = messaging.PubMaster(CFG.pubs)
+    sock = messaging.sub_sock("carControl", timeout=100)
+
+  thread = threading.Thread(target=echo_daemon, args=(bus, fail_frame), daemon=True)
+  thread.start()
+  while not all(pm.all_readers_updated(s) for s in CFG.pubs):
+    time.sleep(0)
+  rc.wait_for_recv_called()
+  return bus, rc, pm, sock, thread
+
+
+def calibrationd_msgs():
+  msgs = [messaging.new_message('carParams', valid=True, logMonoTime=0)]
+  for i in range(1, 1200):
+    t = i * 50_000_000
+    cs = messaging.new_message('carState', valid=True, logMonoTime=t)
+    cs.carState.vEgo = 20.
+    co = messaging.new_message('cameraOdometry', valid=True, logMonoTime=t + 1)
+    co.cameraOdometry.trans = [20., 0.04 + 0.02 * math.sin(i / 50), -0.1]
+    co.cameraOdometry.rot = [0., 0., 0.001]
+    co.cameraOdometry.transStd = [0.001, 0.001, 0.001]
+    msgs += [cs, co]
+  return msgs
+
+
+def torqued_msgs():
+  msgs = []
+  for i in range(2000):
+    t = i * 10_000_000
+    steer = 0.8 * math.sin(i / 100)
+    cc = messaging.new_message('carControl', valid=True, logMonoTime=t)
+    cc.carControl.latActive = True
+    co = messaging.new_message('carOutput', valid=True, logMonoTime=t + 1)
+    co.carOutput.actuatorsOutput.steer = steer
+    cs = messaging.new_message('carState', valid=True, logMonoTime=t + 2)
+    cs.carState.vEgo = 20.
+    msgs += [cc, co, cs]
+    if i % 5 == 0:
+      lp = messaging.new_message('livePose', valid=True, logMonoTime=t + 3)
+      lp.livePose.angularVelocityDevice.z = -0.1 * steer
+      lp.livePose.angularVelocityDevice.valid = True
+      lp.livePose.orientationNED.x = 0.01
+      lp.livePose.orientationNED.valid = True
+      msgs.append(lp)
+    if i % 25 == 0:
+      lc = messaging.new_message('liveCalibration', valid=True, logMonoTime=t + 4)
+      lc.liveCalibration.rpyCalib = [0., 0.02, -0.01]
+      lc.liveCalibration.calStatus = 'calibrated'
+      msgs.append(lc)
+  return msgs
+
+
+REPLAY_INPUTS = {
+  'calibrationd': calibrationd_msgs,
+  'torqued': torqued_msgs,
+}
+
+
+class TestInProcessTransport:
+  def test_lock_step(self):
+    bus, rc, pm, sock, thread = start_echo_daemon()
+    for i in range(100):
+      cs = messaging.new_message('carState')
+      cs.carState.cruiseState.enabled = bool(i % 2)
+      pm.send('carState', cs)
+      if i % 3 == 0:
+        pm.send('liveCalibration', messaging.new_message('liveCalibration'))
+
+      rc.unlock_sockets()
+      rc.wait_for_next_recv(False)
+
+      msgs = messaging.drain_sock(sock)
+      assert len(msgs) == 1
+      assert msgs[0].carControl.enabled == bool(i % 2)
+      assert msgs[0].carControl.latActive == (i % 3 == 0)
+
+    bus.close()
+    thread.join(timeout=1)
+    assert not thread.is_alive()
+
+  def test_daemon_failure(self):
+    _, rc, pm, _, _ = start_echo_daemon(fail_frame=2)
+    with pytest.raises(ReplayTransportError):
+      for _ in range(5):
+        pm.send('carState', messaging.new_message('carState'))
+        rc.unlock_sockets()
+        rc.wait_for_next_recv(False)
+
+  @pytest.mark.parametrize("proc_name", REPLAY_INPUTS.keys())
+  def test_matches_msgq(self, proc_name):
+    cfg = get_process_config(proc_name)
+    lr = [m.as_reader() for m in REPLAY_INPUTS[proc_name]()]
+    msgq_msgs = replay_process(cfg, lr, fingerprint=TOYOTA.TOYOTA_COROLLA_TSS2, disable_progress=True)
+    in_process_msgs = replay_process(cfg, lr, fingerprint=TOYOTA.TOYOTA_COROLLA_TSS2, disable_progress=True, in_process=True)
+
+    assert len(msgq_msgs) > 100
+    assert [m.as_builder().to_bytes() for m in in_process_msgs] == [m.as_builder().to_bytes() for m in msgq_msgs]
@@ -1,18 +1,25 @@
 #!/usr/bin/env python3
 import argparse
 import concurrent.futures
+import mmap
 import os
+import shutil
 import sys
+import tempfile
+import time
 from collections import defaultdict
 from tqdm import tqdm
 from typing import Any
 
+from cereal import log as capnp_log
 from openpilot.common.git import get_commit
 from openpilot.selfdrive.car.car_helpers import interface_names
 from openpilot.tools.lib.openpilotci import get_url, upload_file
 from openpilot.selfdrive.test.process_replay.compare_logs import compare_logs, format_diff
+from openpilot.selfdrive.test.process_replay.migration import migrate_all
 from openpilot.selfdrive.test.process_replay.process_replay import CONFIGS, PROC_REPLAY_DIR, FAKEDATA, replay_process, \
-                                                                   check_openpilot_enabled, check_most_messages_valid
+                                                                   check_openpilot_enabled, check_most_messages_valid, \
+                                                                   get_migration_flags
 from openpilot.tools.lib.filereader import FileReader
 from openpilot.tools.lib.logreader import LogReader, save_log
 
@@ -70,11 +77,15 @@ EXCLUDED_PROCS = {"modeld", "dmonitoringmodeld"}
 
 
 def run_test_process(data):
-  segment, cfg, args, cur_log_fn, ref_log_path, lr_dat = data
+  segment, cfg, args, cur_log_fn, ref_log_path, store_fn = data
   res = None
+  wall_time = 0.
   if not args.upload_only:
-    lr = LogReader.from_bytes(lr_dat)
-    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs)
+    st = time.monotonic()
+    lr = load_segment(store_fn)
+    res, log_msgs = test_process(cfg, lr, segment, ref_log_path, cur_log_fn, args.ignore_fields, args.ignore_msgs, migrated=True,
+                                 in_process=args.in_process)
+    wall_time = time.monotonic() - st
     # save logs so we can upload when updating refs
     save_log(cur_log_fn, log_msgs)
 
@@ -83,16 +94,36 @@ def run_test_process(data):
     assert os.path.exists(cur_log_fn), f"Cannot find log to upload: {cur_log_fn}"
     upload_file(cur_log_fn, os.path.basename(cur_log_fn))
     os.remove(cur_log_fn)
-  return (segment, cfg.proc_name, res)
+  return (segment, cfg.proc_name, res, wall_time)
 
 
-def get_log_data(segment):
+def segment_store_fn(store_dir, segment, flags):
+  variant = "_".join(k for k, v in flags if v) or "base"
+  return os.path.join(store_dir, f"{segment}_{variant}")
+
+
+def prepare_segment(data):
+  """
+  Download and decode a source segment once, then store it migrated for every set of
+  migration flags it's replayed with. Jobs mmap the stores instead of re-parsing the log.
+  """
+  segment, store_dir, variants = data
   r, n = segment.rsplit("--", 1)
   with FileReader(get_url(r, n)) as f:
-    return (segment, f.read())
+    msgs = list(LogReader.from_bytes(f.read()))
+
+  for flags in variants:
+    save_log(segment_store_fn(store_dir, segment, flags), migrate_all(msgs, old_logtime=True, manager_states=True, **dict(flags)))
+  return segment
+
 
+def load_segment(store_fn):
+  with open(store_fn, "rb") as f:
+    dat = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  return list(capnp_log.Event.read_multiple_bytes(dat))
 
-def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None):
+
+def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=None, ignore_msgs=None, migrated=False, in_process=False):
   if ignore_fields is None:
     ignore_fields = []
   if ignore_msgs is None:
@@ -101,7 +132,7 @@ def test_process(cfg, lr, segment, ref_log_path, new_log_path, ignore_fields=Non
   ref_log_msgs = list(LogReader(ref_log_path))
 
   try:
-    log_msgs = replay_process(cfg, lr, disable_progress=True)
+    log_msgs = replay_process(cfg, lr, disable_progress=True, migrated=migrated, in_process=in_process)
   except Exception as e:
     raise Exception("failed on segment: " + segment) from e
 
@@ -148,6 +179,8 @@ if __name__ == "__main__":
                       help="Updates reference logs using current commit")
   parser.add_argument("--upload-only", action="store_true",
                       help="Skips testing processes and uploads logs from previous test run")
+  parser.add_argument("--in-process", action="store_true",
+                      help="Run supported python daemons in-process instead of over msgq")
   parser.add_argument("-j", "--jobs", type=int, default=max(cpu_count - 2, 1),
                       help="Max amount of parallel jobs")
   args = parser.parse_args()
@@ -182,41 +215,58 @@ if __name__ == "__main__":
     assert len(untested) == 0, f"Cars missing routes: {str(untested)}"
 
   log_paths: defaultdict[str, dict[str, dict[str, str]]] = defaultdict(lambda: defaultdict(dict))
-  with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
-    if not args.upload_only:
-      download_segments = [seg for car, seg in segments if car in tested_cars]
-      log_data: dict[str, LogReader] = {}
-      p1 = pool.map(get_log_data, download_segments)
-      for segment, lr in tqdm(p1, desc="Getting Logs", total=len(download_segments)):
-        log_data[segment] = lr
-
-    pool_args: Any = []
-    for car_brand, segment in segments:
-      if car_brand not in tested_cars:
+  segment_jobs: defaultdict[str, list[Any]] = defaultdict(list)
+  segment_variants: defaultdict[str, set[tuple[tuple[str, bool], ...]]] = defaultdict(set)
+  store_dir = tempfile.mkdtemp(prefix="process_replay_")
+  for car_brand, segment in segments:
+    if car_brand not in tested_cars:
+      continue
+
+    for cfg in CONFIGS:
+      if cfg.proc_name not in tested_procs:
         continue
 
-      for cfg in CONFIGS:
-        if cfg.proc_name not in tested_procs:
-          continue
-
-        cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst")
-        if args.update_refs:  # reference logs will not exist if routes were just regenerated
-          ref_log_path = get_url(*segment.rsplit("--", 1))
-        else:
-          ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst")
-          ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
+      cur_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{cur_commit}.zst")
+      if args.update_refs:  # reference logs will not exist if routes were just regenerated
+        ref_log_path = get_url(*segment.rsplit("--", 1))
+      else:
+        ref_log_fn = os.path.join(FAKEDATA, f"{segment}_{cfg.proc_name}_{ref_commit}.zst")
+        ref_log_path = ref_log_fn if os.path.exists(ref_log_fn) else BASE_URL + os.path.basename(ref_log_fn)
 
-        dat = None if args.upload_only else log_data[segment]
-        pool_args.append((segment, cfg, args, cur_log_fn, ref_log_path, dat))
+      flags = tuple(sorted(get_migration_flags([cfg]).items()))
+      segment_variants[segment].add(flags)
+      store_fn = segment_store_fn(store_dir, segment, flags)
+      segment_jobs[segment].append((segment, cfg, args, cur_log_fn, ref_log_path, store_fn))
 
-        log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
-        log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
+      log_paths[segment][cfg.proc_name]['ref'] = ref_log_path
+      log_paths[segment][cfg.proc_name]['new'] = cur_log_fn
 
-    results: Any = defaultdict(dict)
-    p2 = pool.map(run_test_process, pool_args)
-    for (segment, proc, result) in tqdm(p2, desc="Running Tests", total=len(pool_args)):
-      if not args.upload_only:
-        results[segment][proc] = result
+  results: Any = defaultdict(dict)
+  proc_wall_times: defaultdict[str, float] = defaultdict(float)
+  total_jobs = sum(len(jobs) for jobs in segment_jobs.values())
+  try:
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.jobs) as pool:
+      futures = []
+      if args.upload_only:
+        futures = [pool.submit(run_test_process, job) for jobs in segment_jobs.values() for job in jobs]
+      else:
+        # each segment is decoded and migrated once, its process configs fan out as soon as it's ready
+        prepare_futures = [pool.submit(prepare_segment, (segment, store_dir, variants)) for segment, variants in segment_variants.items()]
+        for fut in tqdm(concurrent.futures.as_completed(prepare_futures), desc="Getting Logs", total=len(prepare_futures)):
+          futures.extend(pool.submit(run_test_process, job) for job in segment_jobs[fut.result()])
+
+      for fut in tqdm(concurrent.futures.as_completed(futures), desc="Running Tests", total=total_jobs):
+        segment, proc, result, wall_time = fut.result()
+        if not args.upload_only:
+          results[segment][proc] = result
+          proc_wall_times[proc] += wall_time
+  finally:
+    shutil.rmtree(store_dir, ignore_errors=True)
+
+  if len(proc_wall_times):
+    print("***** replay wall time per process *****")
+    for proc, wall_time in sorted(proc_wall_times.items(), key=lambda x: x[1], reverse=True):
+      print(f"  {proc:<20} {wall_time:8.2f}s")
 
   diff_short, diff_long, failed = format_diff(results, log_paths, ref_commit)
   if not upload:
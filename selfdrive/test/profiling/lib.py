@@ -89,3 +89,6 @@ class SubMaster(messaging.SubMaster):
 class PubMaster(messaging.PubMaster):
   def __init__(self):
     self.sock = defaultdict(PubSocket)
+    self.msg_words = {}
+    self.send_count = {}
+    self.send_time = {}
@@ -298,6 +298,36 @@ cdef class AcadosOcpSolverCython:
         return out
 
 
+    def get_flat(self, str field_):
+        """
+        Get the last solution of the solver for all stages, concatenated into one array:
+
+            :param field: string in ['x', 'u']
+        """
+        out_fields = ['x', 'u']
+        if field_ not in out_fields:
+            raise Exception('AcadosOcpSolverCython.get_flat(): {} is an invalid argument.\
+                    \n Possible values are {}.'.format(field_, out_fields))
+
+        field = field_.encode('utf-8')
+        cdef const char *c_field = field
+        cdef int stage
+        cdef int offset = 0
+        cdef int[::1] dims = np.zeros((self.N+1,), dtype=np.intc)
+        for stage in range(self.N+1):
+            dims[stage] = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                self.nlp_dims, self.nlp_out, stage, c_field)
+
+        cdef cnp.ndarray[cnp.float64_t, ndim=1] out = np.zeros((np.sum(dims),))
+        for stage in range(self.N+1):
+            if dims[stage] > 0:
+                acados_solver_common.ocp_nlp_out_get(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, c_field, <void *> (<double *> out.data + offset))
+                offset += dims[stage]
+
+        return out
+
+
     def print_statistics(self):
         """
         prints statistics of previous solver run as a table:
@@ -587,6 +617,62 @@ cdef class AcadosOcpSolverCython:
                     self.nlp_solver, stage, field, <void *> value.data)
         return
 
+
+    def set_flat(self, str field_, value_):
+        """
+        Set numerical data inside the solver for all stages, with one Python call.
+
+            :param field: string in ['x', 'u', 'p', 'yref']
+            :param value: numpy array with the values of all stages concatenated,
+                          or one row per stage if all stages have the same dimension
+        """
+        if not isinstance(value_, np.ndarray):
+            raise Exception(f"set_flat: value must be numpy array, got {type(value_)}.")
+        cost_fields = ['yref']
+        out_fields = ['x', 'u']
+        if field_ not in cost_fields + out_fields + ['p']:
+            raise Exception("AcadosOcpSolverCython.set_flat(): {} is not a valid argument.\
+                \nPossible values are {}.".format(field_, cost_fields + out_fields + ['p']))
+
+        field = field_.encode('utf-8')
+        cdef const char *c_field = field
+        cdef cnp.ndarray[cnp.float64_t, ndim=1] value = np.ascontiguousarray(value_, dtype=np.float64).ravel()
+        cdef bint is_param = field_ == 'p'
+        cdef bint is_cost = field_ in cost_fields
+        cdef int stage
+        cdef int offset = 0
+        cdef int cost_dims[2]
+        cdef int[::1] dims = np.zeros((self.N+1,), dtype=np.intc)
+        for stage in range(self.N+1):
+            if is_param:
+                # parameters have the same dimension at every stage
+                dims[stage] = value.shape[0] // (self.N+1)
+            elif is_cost:
+                acados_solver_common.ocp_nlp_cost_dims_get_from_attr(self.nlp_config, \
+                    self.nlp_dims, self.nlp_out, stage, c_field, &cost_dims[0])
+                dims[stage] = cost_dims[0]
+            else:
+                dims[stage] = acados_solver_common.ocp_nlp_dims_get_from_attr(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, c_field)
+
+        if np.sum(dims) != value.shape[0]:
+            msg = 'AcadosOcpSolverCython.set_flat(): mismatching dimension for field "{}" '.format(field_)
+            msg += 'with dimension {} (you have {})'.format(np.sum(dims), value.shape[0])
+            raise Exception(msg)
+
+        for stage in range(self.N+1):
+            if dims[stage] == 0:
+                continue
+            if is_param:
+                assert acados_solver.acados_update_params(self.capsule, stage, <double *> value.data + offset, dims[stage]) == 0
+            elif is_cost:
+                acados_solver_common.ocp_nlp_cost_model_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_in, stage, c_field, <void *> (<double *> value.data + offset))
+            else:
+                acados_solver_common.ocp_nlp_out_set(self.nlp_config,
+                    self.nlp_dims, self.nlp_out, stage, c_field, <void *> (<double *> value.data + offset))
+            offset += dims[stage]
+
     def cost_set(self, int stage, str field_, value_):
         """
         Set numerical data in the cost module of the solver.
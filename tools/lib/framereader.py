@@ -1,11 +1,15 @@
 import json
 import os
 import pickle
+import queue
+import select
 import struct
 import subprocess
 import threading
+import weakref
+from concurrent.futures import ProcessPoolExecutor
 from enum import IntEnum
-from functools import wraps
+from functools import partial, wraps
 
 import numpy as np
 from lru import LRU
@@ -13,7 +17,7 @@ from lru import LRU
 import _io
 from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.exceptions import DataUnreadableError
-from openpilot.tools.lib.vidindex import hevc_index
+from openpilot.tools.lib.vidindex import hevc_dimensions, hevc_index
 from openpilot.common.file_helpers import atomic_write_in_dir
 
 from openpilot.tools.lib.filereader import FileReader, resolve_name
@@ -22,6 +26,10 @@ HEVC_SLICE_B = 0
 HEVC_SLICE_P = 1
 HEVC_SLICE_I = 2
 
+# end of sequence and end of bitstream NAL units, makes the decoder output every frame written before them
+HEVC_END_OF_GOP = b"\x00\x00\x01\x48\x01\x00\x00\x01\x4a\x01"
+DECODER_SESSION_TIMEOUT = 30
+
 
 class GOPReader:
   def get_gop(self, num):
@@ -104,7 +112,9 @@ def index_stream(fn, ft):
 
   frame_types, dat_len, prefix = hevc_index(fn)
   index = np.array(frame_types + [(0xFFFFFFFF, dat_len)], dtype=np.uint32)
-  probe = ffprobe(fn, "hevc")
+  # dimensions come from the SPS, with the same layout as ffprobe's output
+  w, h = hevc_dimensions(prefix)
+  probe = {'streams': [{'width': w, 'height': h}]}
 
   return {
     'index': index,
@@ -116,6 +126,12 @@ def index_stream(fn, ft):
 def get_video_index(fn, frame_type, cache_dir=DEFAULT_CACHE_DIR):
   return index_stream(fn, frame_type, cache_dir=cache_dir)
 
+
+def get_video_indexes(fns, frame_type, cache_dir=DEFAULT_CACHE_DIR, num_processes=None):
+  # index many video files in parallel, e.g. all cameras of a route
+  with ProcessPoolExecutor(num_processes) as executor:
+    return list(executor.map(partial(get_video_index, frame_type=frame_type, cache_dir=cache_dir), fns))
+
 def read_file_check_size(f, sz, cookie):
   buff = bytearray(sz)
   bytes_read = f.readinto(buff)
@@ -166,6 +182,29 @@ def rgb24tonv12(rgb):
   return nv12.clip(0, 255).astype('uint8')
 
 
+def frame_size(w, h, pix_fmt):
+  if pix_fmt in ("nv12", "yuv420p"):
+    return w*h*3//2
+  elif pix_fmt in ("rgb24", "yuv444p"):
+    return w*h*3
+  raise NotImplementedError
+
+
+def frames_from_buffer(dat, w, h, pix_fmt):
+  if pix_fmt == "rgb24":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
+  elif pix_fmt == "nv12":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+  elif pix_fmt == "yuv420p":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
+  elif pix_fmt == "yuv444p":
+    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
+  else:
+    raise NotImplementedError
+
+  return ret
+
+
 def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
   threads = os.getenv("FFMPEG_THREADS", "0")
   cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
@@ -182,19 +221,85 @@ def decompress_video_data(rawdat, vid_fmt, w, h, pix_fmt):
           "-pix_fmt", pix_fmt,
           "-"]
   dat = subprocess.check_output(args, input=rawdat)
+  return frames_from_buffer(dat, w, h, pix_fmt)
 
-  if pix_fmt == "rgb24":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, h, w, 3)
-  elif pix_fmt == "nv12":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv420p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, (h*w*3//2))
-  elif pix_fmt == "yuv444p":
-    ret = np.frombuffer(dat, dtype=np.uint8).reshape(-1, 3, h, w)
-  else:
-    raise NotImplementedError
 
-  return ret
+class HEVCDecoderSession:
+  """A long running ffmpeg process that GOPs are piped into one after another.
+
+  Each GOP is terminated with end of sequence NAL units so its frames are output without
+  waiting for more input, and they're read straight into the returned array.
+  """
+  def __init__(self, vid_fmt, w, h, pix_fmt):
+    self.w, self.h = w, h
+    self.pix_fmt = pix_fmt
+    self.frame_size = frame_size(w, h, pix_fmt)
+
+    threads = os.getenv("FFMPEG_THREADS", "0")
+    cuda = os.getenv("FFMPEG_CUDA", "0") == "1"
+    cmd = [
+      "ffmpeg", "-v", "quiet",
+      "-threads", threads,
+      # frame threading holds frames back until more input arrives
+      "-thread_type", "slice",
+      "-hwaccel", "none" if not cuda else "cuda",
+      "-c:v", "hevc",
+      "-analyzeduration", "0",
+      "-probesize", "32",
+      "-vsync", "0",
+      "-f", vid_fmt,
+      "-flags2", "showall",
+      "-i", "pipe:0",
+      "-threads", threads,
+      "-f", "rawvideo",
+      "-pix_fmt", pix_fmt,
+      "-flush_packets", "1",
+      "pipe:1"
+    ]
+    self.proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    self.write_queue: queue.Queue[bytes | None] = queue.Queue()
+    self.t = threading.Thread(target=self.write_thread, args=(self.proc, self.write_queue), daemon=True)
+    self.t.start()
+    # most readers are never closed, so also stop ffmpeg once the session is garbage collected
+    self._finalizer = weakref.finalize(self, self._stop, self.proc, self.write_queue, self.t)
+
+  @staticmethod
+  def write_thread(proc, write_queue):
+    try:
+      while (dat := write_queue.get()) is not None:
+        proc.stdin.write(dat)
+        proc.stdin.flush()
+    except BrokenPipeError:
+      pass
+    finally:
+      proc.stdin.close()
+
+  @staticmethod
+  def _stop(proc, write_queue, t):
+    write_queue.put(None)
+    proc.kill()
+    proc.wait()
+    proc.stdout.close()
+    t.join()
+
+  def decode(self, rawdat, num_frames):
+    self.write_queue.put(rawdat + HEVC_END_OF_GOP)
+
+    # a new array per GOP, the cached frames are views into it
+    ret = np.empty(num_frames * self.frame_size, dtype=np.uint8)
+    view = memoryview(ret)
+    pos = 0
+    while pos < len(ret):
+      ready, _, _ = select.select([self.proc.stdout], [], [], DECODER_SESSION_TIMEOUT)
+      read = self.proc.stdout.raw.readinto(view[pos:]) if ready else 0
+      if not read:
+        raise DataUnreadableError(f"decoder session returned {pos // self.frame_size}/{num_frames} frames")
+      pos += read
+
+    return frames_from_buffer(ret, self.w, self.h, self.pix_fmt)
+
+  def close(self):
+    self._finalizer()
 
 
 class BaseFrameReader:
@@ -213,14 +318,15 @@ class BaseFrameReader:
     raise NotImplementedError
 
 
-def FrameReader(fn, cache_dir=DEFAULT_CACHE_DIR, readahead=False, readbehind=False, index_data=None):
+def FrameReader(fn, cache_dir=DEFAULT_CACHE_DIR, readahead=False, readbehind=False, index_data=None, cache_size=None, decoder_session=True):
   frame_type = fingerprint_video(fn)
   if frame_type == FrameType.raw:
     return RawFrameReader(fn)
   elif frame_type in (FrameType.h265_stream,):
     if not index_data:
       index_data = get_video_index(fn, frame_type, cache_dir)
-    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind)
+    return StreamFrameReader(fn, frame_type, index_data, readahead=readahead, readbehind=readbehind,
+                             cache_size=cache_size, decoder_session=decoder_session)
   else:
     raise NotImplementedError(frame_type)
 
@@ -280,13 +386,7 @@ class VideoStreamDecompressor:
     self.w = w
     self.h = h
     self.pix_fmt = pix_fmt
-
-    if pix_fmt in ("nv12", "yuv420p"):
-      self.out_size = w*h*3//2  # yuv420p
-    elif pix_fmt in ("rgb24", "yuv444p"):
-      self.out_size = w*h*3
-    else:
-      raise NotImplementedError
+    self.out_size = frame_size(w, h, pix_fmt)
 
     self.proc = None
     self.t = threading.Thread(target=self.write_thread)
@@ -425,13 +525,19 @@ class StreamGOPReader(GOPReader):
 
 class GOPFrameReader(BaseFrameReader):
   #FrameReader with caching and readahead for formats that are group-of-picture based
+  #cache_size limits the decoded frames cache in bytes instead of to 64 frames
+  #decoder_session keeps one ffmpeg process per pixel format instead of starting one for every GOP
 
-  def __init__(self, readahead=False, readbehind=False):
+  def __init__(self, readahead=False, readbehind=False, cache_size=None, decoder_session=True):
     self.open_ = True
 
     self.readahead = readahead
     self.readbehind = readbehind
     self.frame_cache = LRU(64)
+    self.cache_size = cache_size
+    self.max_frame_size = 0
+    self.decoder_session = decoder_session
+    self.decoder_sessions = {}
 
     if self.readahead:
       self.cache_lock = threading.RLock()
@@ -455,6 +561,10 @@ class GOPFrameReader(BaseFrameReader):
       self.readahead_c.release()
       self.readahead_thread.join()
 
+    for session in self.decoder_sessions.values():
+      session.close()
+    self.decoder_sessions.clear()
+
   def _readahead_thread(self):
     while True:
       self.readahead_c.acquire()
@@ -488,14 +598,31 @@ class GOPFrameReader(BaseFrameReader):
 
       frame_b, num_frames, skip_frames, rawdat = self.get_gop(num)
 
-      ret = decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
+      ret = self._decompress(rawdat, skip_frames + num_frames, pix_fmt)
       ret = ret[skip_frames:]
       assert ret.shape[0] == num_frames
 
+      if self.cache_size is not None and frame_size(self.w, self.h, pix_fmt) > self.max_frame_size:
+        self.max_frame_size = frame_size(self.w, self.h, pix_fmt)
+        self.frame_cache.set_size(max(1, self.cache_size // self.max_frame_size))
+
       for i in range(ret.shape[0]):
         self.frame_cache[(frame_b+i, pix_fmt)] = ret[i]
 
-      return self.frame_cache[(num, pix_fmt)]
+      # the cache may hold fewer frames than a GOP
+      return ret[num - frame_b]
+
+  def _decompress(self, rawdat, num_frames, pix_fmt):
+    if self.decoder_session:
+      if pix_fmt not in self.decoder_sessions:
+        self.decoder_sessions[pix_fmt] = HEVCDecoderSession(self.vid_fmt, self.w, self.h, pix_fmt)
+      try:
+        return self.decoder_sessions[pix_fmt].decode(rawdat, num_frames)
+      except DataUnreadableError:
+        # fall back to a process per GOP from now on
+        self.decoder_sessions.pop(pix_fmt).close()
+        self.decoder_session = False
+    return decompress_video_data(rawdat, self.vid_fmt, self.w, self.h, pix_fmt)
 
   def get(self, num, count=1, pix_fmt="yuv420p"):
     assert self.frame_count is not None
@@ -518,9 +645,9 @@ class GOPFrameReader(BaseFrameReader):
 
 
 class StreamFrameReader(StreamGOPReader, GOPFrameReader):
-  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False):
+  def __init__(self, fn, frame_type, index_data, readahead=False, readbehind=False, cache_size=None, decoder_session=True):
     StreamGOPReader.__init__(self, fn, frame_type, index_data)
-    GOPFrameReader.__init__(self, readahead, readbehind)
+    GOPFrameReader.__init__(self, readahead, readbehind, cache_size, decoder_session)
 
 
 def GOPFrameIterator(gop_reader, pix_fmt):
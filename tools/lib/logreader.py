@@ -1,22 +1,28 @@
 #!/usr/bin/env python3
 import bz2
 from functools import cache, partial
-import multiprocessing
 import capnp
 import enum
+import itertools
+import numpy as np
 import os
 import pathlib
+import struct
 import sys
 import tqdm
 import urllib.parse
 import warnings
 import zstandard as zstd
 
+from collections import defaultdict
 from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from urllib.parse import parse_qs, urlparse
 
 from cereal import log as capnp_log
+from openpilot.common.file_helpers import atomic_write_in_dir
 from openpilot.common.swaglog import cloudlog
+from openpilot.tools.lib.cache import cache_path_for_file_path, DEFAULT_CACHE_DIR
 from openpilot.tools.lib.comma_car_segments import get_url as get_comma_segments_url
 from openpilot.tools.lib.openpilotci import get_url
 from openpilot.tools.lib.filereader import FileReader, file_exists, internal_source_available
@@ -26,6 +32,11 @@ LogMessage = type[capnp._DynamicStructReader]
 LogIterable = Iterable[LogMessage]
 RawLogIterable = Iterable[bytes]
 
+STREAM_CHUNK_SIZE = 1024 * 1024
+BZ2_MAGIC = b'BZh9'
+# https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+ZSTD_MAGIC = b'\x28\xB5\x2F\xFD'
+
 
 def save_log(dest, log_msgs, compress=True):
   dat = b"".join(msg.as_builder().to_bytes() for msg in log_msgs)
@@ -39,6 +50,23 @@ def save_log(dest, log_msgs, compress=True):
     f.write(dat)
 
 
+def _check_extension(fn: str) -> str:
+  _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
+  if ext not in ('', '.bz2', '.zst'):
+    # old rlogs weren't compressed
+    raise Exception(f"unknown extension {ext}")
+  return ext
+
+
+def _filter_union_types(ents: Iterable[capnp._DynamicStructReader]) -> Iterator[capnp._DynamicStructReader]:
+  for ent in ents:
+    try:
+      ent.which()
+      yield ent
+    except capnp.lib.capnp.KjException:
+      pass
+
+
 class _LogFileReader:
   def __init__(self, fn, canonicalize=True, only_union_types=False, sort_by_time=False, dat=None):
     self.data_version = None
@@ -46,18 +74,14 @@ class _LogFileReader:
 
     ext = None
     if not dat:
-      _, ext = os.path.splitext(urllib.parse.urlparse(fn).path)
-      if ext not in ('', '.bz2', '.zst'):
-        # old rlogs weren't compressed
-        raise Exception(f"unknown extension {ext}")
+      ext = _check_extension(fn)
 
       with FileReader(fn) as f:
         dat = f.read()
 
-    if ext == ".bz2" or dat.startswith(b'BZh9'):
+    if ext == ".bz2" or dat.startswith(BZ2_MAGIC):
       dat = bz2.decompress(dat)
-    elif ext == ".zst" or dat.startswith(b'\x28\xB5\x2F\xFD'):
-      # https://github.com/facebook/zstd/blob/dev/doc/zstd_compression_format.md#zstandard-frames
+    elif ext == ".zst" or dat.startswith(ZSTD_MAGIC):
       dat = zstd.decompress(dat)
 
     ents = capnp_log.Event.read_multiple_bytes(dat)
@@ -73,15 +97,304 @@ class _LogFileReader:
       self._ents.sort(key=lambda x: x.logMonoTime)
 
   def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
-    for ent in self._ents:
-      if self._only_union_types:
-        try:
-          ent.which()
-          yield ent
-        except capnp.lib.capnp.KjException:
-          pass
+    if self._only_union_types:
+      yield from _filter_union_types(self._ents)
+    else:
+      yield from self._ents
+
+
+def _decompress_stream(f, ext: str) -> Iterator[bytes]:
+  """Incrementally decompress a bz2, zstd or uncompressed log file object"""
+  head = f.read(STREAM_CHUNK_SIZE)
+  chunks = itertools.chain([head], iter(partial(f.read, STREAM_CHUNK_SIZE), b""))
+
+  if ext == ".bz2" or head.startswith(BZ2_MAGIC):
+    decompressor = bz2.BZ2Decompressor()
+    for dat in chunks:
+      while dat:
+        # concatenated bz2 streams need a new decompressor per stream
+        if decompressor.eof:
+          decompressor = bz2.BZ2Decompressor()
+        yield decompressor.decompress(dat)
+        dat = decompressor.unused_data if decompressor.eof else b""
+  elif ext == ".zst" or head.startswith(ZSTD_MAGIC):
+    decompressor = zstd.ZstdDecompressor().decompressobj(read_across_frames=True)
+    for dat in chunks:
+      yield decompressor.decompress(dat)
+  else:
+    yield from chunks
+
+
+def _frame_size(buf, offset: int) -> int | None:
+  """Size of the capnp message starting at offset, or None if its segment table isn't buffered yet"""
+  if len(buf) - offset < 4:
+    return None
+  num_segments = struct.unpack_from('<I', buf, offset)[0] + 1
+  table_size = (4 + 4 * num_segments + 7) & ~7  # segment table is padded to a word boundary
+  if len(buf) - offset < table_size:
+    return None
+  segment_words = struct.unpack_from(f'<{num_segments}I', buf, offset + 4)
+  return table_size + 8 * sum(segment_words)
+
+
+def _split_frames(chunks: Iterable[bytes]) -> Iterator[bytes]:
+  """Split a stream of decompressed chunks into serialized capnp messages"""
+  buf = bytearray()
+  for chunk in chunks:
+    buf += chunk
+    pos = 0
+    with memoryview(buf) as view:
+      while (size := _frame_size(view, pos)) is not None and pos + size <= len(view):
+        yield bytes(view[pos:pos + size])
+        pos += size
+    del buf[:pos]
+
+  if len(buf):
+    raise EOFError(f"log ends with a truncated message ({len(buf)} bytes)")
+
+
+def _event_from_frame(frame: bytes) -> capnp._DynamicStructReader:
+  with capnp_log.Event.from_bytes(frame) as ent:
+    return ent
+
+
+class _StreamingLogFileReader:
+  """Decompresses and parses a log file incrementally, yielding events as they are decoded.
+
+  Nothing is kept between iterations, so every pass re-reads the file. With sort_by_time,
+  the serialized messages (but not the compressed file or event readers) are held until
+  the whole file has been read.
+  """
+  def __init__(self, fn, only_union_types=False, sort_by_time=False):
+    self._fn = fn
+    self._ext = _check_extension(fn)
+    self._only_union_types = only_union_types
+    self._sort_by_time = sort_by_time
+
+  def _events(self) -> Iterator[tuple[capnp._DynamicStructReader, bytes]]:
+    with FileReader(self._fn) as f:
+      try:
+        for frame in _split_frames(_decompress_stream(f, self._ext)):
+          yield _event_from_frame(frame), frame
+      except (capnp.KjException, EOFError):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+
+  def _sorted_events(self) -> Iterator[capnp._DynamicStructReader]:
+    frames = sorted(((ent.logMonoTime, frame) for ent, frame in self._events()), key=lambda x: x[0])
+    for _, frame in frames:
+      yield _event_from_frame(frame)
+
+  def __iter__(self) -> Iterator[capnp._DynamicStructReader]:
+    ents = self._sorted_events() if self._sort_by_time else (ent for ent, _ in self._events())
+    if self._only_union_types:
+      yield from _filter_union_types(ents)
+    else:
+      yield from ents
+
+
+EVENT_TYPES = {name: i for i, name in enumerate(capnp_log.Event.schema.union_fields)}
+UNKNOWN_EVENT_TYPE = np.iinfo(np.uint16).max
+LOG_INDEX_DTYPE = np.dtype([('offset', '<u8'), ('size', '<u4'), ('type', '<u2'), ('logMonoTime', '<u8')])
+
+
+def _extract_frames(chunks: Iterable[bytes], entries: np.ndarray) -> Iterator[bytes]:
+  """Slice the indexed messages out of a stream of decompressed chunks, stopping after the last one"""
+  if not len(entries):
+    return
+
+  buf = bytearray()
+  buf_offset = 0  # stream offset of buf[0]
+  wanted = iter(entries[['offset', 'size']].tolist())
+  offset, size = next(wanted)
+  for chunk in chunks:
+    buf += chunk
+    while offset + size <= buf_offset + len(buf):
+      start = offset - buf_offset
+      yield bytes(buf[start:start + size])
+      offset, size = next(wanted, (None, None))
+      if offset is None:
+        return
+
+    # nothing before the next wanted message is needed anymore
+    drop = min(len(buf), offset - buf_offset)
+    del buf[:drop]
+    buf_offset += drop
+
+  raise EOFError("log is shorter than its index")
+
+
+class _LogIndex:
+  """Offset, size, union type and logMonoTime of every message in the decompressed log file.
+
+  Lets filter/first/window queries skip files that don't contain the requested types and
+  only parse the matching messages of those that do.
+  """
+  def __init__(self, fn: str, entries: np.ndarray):
+    self._fn = fn
+    self._ext = _check_extension(fn)
+    self.entries = entries
+
+  @staticmethod
+  def cache_path(fn: str, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    return cache_path_for_file_path(fn, cache_dir) + ".logindex.npy"
+
+  @classmethod
+  def build(cls, fn: str) -> '_LogIndex':
+    rows = []
+    offset = 0
+    with FileReader(fn) as f:
+      try:
+        for frame in _split_frames(_decompress_stream(f, _check_extension(fn))):
+          ent = _event_from_frame(frame)
+          try:
+            msg_type = EVENT_TYPES[ent.which()]
+          except capnp.KjException:
+            msg_type = UNKNOWN_EVENT_TYPE
+          rows.append((offset, len(frame), msg_type, ent.logMonoTime))
+          offset += len(frame)
+      except (capnp.KjException, EOFError):
+        warnings.warn("Corrupted events detected", RuntimeWarning, stacklevel=1)
+    return cls(fn, np.array(rows, dtype=LOG_INDEX_DTYPE))
+
+  @classmethod
+  def load(cls, fn: str, cache_dir: str = DEFAULT_CACHE_DIR) -> '_LogIndex':
+    """Load the cached index for fn, building and caching it first if missing"""
+    cache_path = cls.cache_path(fn, cache_dir)
+    if os.path.exists(cache_path):
+      return cls(fn, np.load(cache_path))
+
+    index = cls.build(fn)
+    with atomic_write_in_dir(cache_path, mode="wb", overwrite=True) as f:
+      np.save(f, index.entries)
+    return index
+
+  def select(self, msg_type: str | None = None, start_time: int | None = None, end_time: int | None = None) -> np.ndarray:
+    if msg_type is not None and msg_type not in EVENT_TYPES:
+      # like filtering the messages without an index, services missing from the schema match nothing
+      return self.entries[:0]
+
+    mask = np.ones(len(self.entries), dtype=bool)
+    if msg_type is not None:
+      mask &= self.entries['type'] == EVENT_TYPES[msg_type]
+    if start_time is not None:
+      mask &= self.entries['logMonoTime'] >= start_time
+    if end_time is not None:
+      mask &= self.entries['logMonoTime'] < end_time
+    return self.entries[mask]
+
+  def read(self, entries: np.ndarray) -> Iterator[capnp._DynamicStructReader]:
+    """Parse the messages of the given index entries, in file order"""
+    if not len(entries):
+      return
+
+    with FileReader(self._fn) as f:
+      head = f.read(4)
+      f.seek(0)
+      if self._ext == "" and not head.startswith((BZ2_MAGIC, ZSTD_MAGIC)):
+        # uncompressed logs can be read directly at each message
+        for offset, size in entries[['offset', 'size']].tolist():
+          f.seek(offset)
+          yield _event_from_frame(f.read(size))
       else:
-        yield ent
+        for frame in _extract_frames(_decompress_stream(f, self._ext), entries):
+          yield _event_from_frame(frame)
+
+
+def _pack_segment_result(ret):
+  """Serialize lists of events into a single buffer, which is much cheaper to send between processes than the readers.
+
+  Other results are returned unchanged, except for iterators, which can't be pickled and are returned as lists.
+  """
+  if isinstance(ret, (_LogFileReader, _StreamingLogFileReader, Iterator)):
+    ret = list(ret)
+  if isinstance(ret, list) and len(ret) and all(isinstance(m, (capnp._DynamicStructReader, capnp._DynamicStructBuilder)) and
+                      m.schema.node.id == capnp_log.Event.schema.node.id for m in ret):
+    return True, b"".join((m.as_builder() if isinstance(m, capnp._DynamicStructReader) else m).to_bytes() for m in ret)
+  return False, ret
+
+
+def _unpack_segment_result(packed) -> list:
+  is_events, ret = packed
+  return list(capnp_log.Event.read_multiple_bytes(ret)) if is_events else ret
+
+
+def _run_on_segment(func, lr_cls, sort_by_time, only_union_types, identifier):
+  return _pack_segment_result(func(lr_cls(identifier, sort_by_time=sort_by_time, only_union_types=only_union_types)))
+
+
+def _parse_field_paths(fields: Iterable[str]) -> dict[str, list[str]]:
+  """Group "service.field.path" strings by service"""
+  paths = defaultdict(list)
+  for field in fields:
+    service, _, path = field.partition(".")
+    assert service in EVENT_TYPES, f"unknown service {service}"
+    assert len(path), f"no field given for {service}"
+    if path not in paths[service]:
+      paths[service].append(path)
+  return dict(paths)
+
+
+def _get_field(msg, path: str):
+  try:
+    for name in path.split("."):
+      msg = getattr(msg, name)
+  except capnp.KjException:
+    # inactive union member
+    return np.nan
+  if isinstance(msg, capnp.lib.capnp._DynamicEnum):
+    return str(msg)
+  return list(msg) if isinstance(msg, capnp._DynamicListReader) else msg
+
+
+def _extract_columns(msgs: LogIterable, paths: dict[str, list[str]]) -> dict[str, dict[str, np.ndarray]]:
+  values: dict[str, dict[str, list]] = {service: {path: [] for path in ['logMonoTime', *service_paths]} for service, service_paths in paths.items()}
+  for msg in msgs:
+    try:
+      service = msg.which()
+    except capnp.KjException:
+      continue
+    if service not in values:
+      continue
+
+    service_values = values[service]
+    service_values['logMonoTime'].append(msg.logMonoTime)
+    service_msg = getattr(msg, service)
+    for path in paths[service]:
+      service_values[path].append(_get_field(service_msg, path))
+
+  columns = {}
+  for service, service_values in values.items():
+    columns[service] = {}
+    for path, v in service_values.items():
+      column = np.array(v, dtype=np.uint64) if path == 'logMonoTime' else np.array(v)
+      if column.dtype == object:
+        raise ValueError(f"{service}.{path} can't be stored as a column")
+      columns[service][path] = column
+  return columns
+
+
+class _ColumnCache:
+  """One .npy file per extracted service field of a log file, loaded back with mmap"""
+  def __init__(self, fn: str, cache_dir: str = DEFAULT_CACHE_DIR):
+    self.path = cache_path_for_file_path(fn, cache_dir) + ".columns"
+
+  def _column_path(self, service: str, path: str) -> str:
+    return os.path.join(self.path, f"{service}.{path}.npy")
+
+  def missing(self, paths: dict[str, list[str]]) -> dict[str, list[str]]:
+    missing = {service: [p for p in service_paths if not os.path.exists(self._column_path(service, p))] for service, service_paths in paths.items()}
+    return {service: service_paths for service, service_paths in missing.items() if len(service_paths)}
+
+  def load(self, paths: dict[str, list[str]]) -> dict[str, dict[str, np.ndarray]]:
+    return {service: {p: np.load(self._column_path(service, p), mmap_mode='r') for p in ['logMonoTime', *service_paths]}
+            for service, service_paths in paths.items()}
+
+  def save(self, columns: dict[str, dict[str, np.ndarray]]) -> None:
+    os.makedirs(self.path, exist_ok=True)
+    for service, service_columns in columns.items():
+      for path, column in service_columns.items():
+        with atomic_write_in_dir(self._column_path(service, path), mode="wb", overwrite=True) as f:
+          np.save(f, column)
 
 
 class ReadMode(enum.StrEnum):
@@ -270,36 +583,82 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return identifiers
 
   def __init__(self, identifier: str | list[str], default_mode: ReadMode = ReadMode.RLOG,
-               default_source=auto_source, sort_by_time=False, only_union_types=False):
+               default_source=auto_source, sort_by_time=False, only_union_types=False, streaming=False,
+               use_index=False, cache_dir=DEFAULT_CACHE_DIR):
     self.default_mode = default_mode
     self.default_source = default_source
     self.identifier = identifier
 
     self.sort_by_time = sort_by_time
     self.only_union_types = only_union_types
-
-    self.__lrs: dict[int, _LogFileReader] = {}
+    # decode segments incrementally instead of loading them fully into memory
+    self.streaming = streaming
+    # answer filter/first/window queries from per-file message type indexes cached in cache_dir
+    self.use_index = use_index
+    self.cache_dir = cache_dir
+
+    self.__lrs: dict[int, _LogFileReader | _StreamingLogFileReader] = {}
+    self.__indexes: dict[int, _LogIndex] = {}
     self.reset()
 
   def _get_lr(self, i):
     if i not in self.__lrs:
-      self.__lrs[i] = _LogFileReader(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
+      lr_cls = _StreamingLogFileReader if self.streaming else _LogFileReader
+      self.__lrs[i] = lr_cls(self.logreader_identifiers[i], sort_by_time=self.sort_by_time, only_union_types=self.only_union_types)
     return self.__lrs[i]
 
+  def _get_index(self, i):
+    if i not in self.__indexes:
+      self.__indexes[i] = _LogIndex.load(self.logreader_identifiers[i], self.cache_dir)
+    return self.__indexes[i]
+
+  def _indexed_events(self, msg_type: str | None = None, start_time: int | None = None, end_time: int | None = None):
+    for i in range(len(self.logreader_identifiers)):
+      index = self._get_index(i)
+      entries = index.select(msg_type, start_time, end_time)
+      if self.only_union_types:
+        entries = entries[entries['type'] != UNKNOWN_EVENT_TYPE]
+      msgs = index.read(entries)
+      if self.sort_by_time:
+        msgs = sorted(msgs, key=lambda m: m.logMonoTime)
+      yield from msgs
+
   def __iter__(self):
     for i in range(len(self.logreader_identifiers)):
       yield from self._get_lr(i)
 
-  def _run_on_segment(self, func, i):
-    return func(self._get_lr(i))
+  def imap_across_segments(self, num_processes, func, ordered=True, max_in_flight=None):
+    """Run func on each segment in a pool of worker processes, yielding the results as they finish.
+
+    Workers open their segment from its identifier, and at most max_in_flight (default: twice the
+    number of processes) segments are being processed or waiting to be yielded at any time.
+    """
+    max_in_flight = max_in_flight or 2 * num_processes
+    lr_cls = _StreamingLogFileReader if self.streaming else _LogFileReader
+    run = partial(_run_on_segment, func, lr_cls, self.sort_by_time, self.only_union_types)
 
-  def run_across_segments(self, num_processes, func, desc=None):
-    with multiprocessing.Pool(num_processes) as pool:
-      ret = []
-      num_segs = len(self.logreader_identifiers)
-      for p in tqdm.tqdm(pool.imap(partial(self._run_on_segment, func), range(num_segs)), total=num_segs, desc=desc):
-        ret.extend(p)
-      return ret
+    identifiers = iter(self.logreader_identifiers)
+    executor = ProcessPoolExecutor(num_processes)
+    try:
+      futures = [executor.submit(run, fn) for fn in itertools.islice(identifiers, max_in_flight)]
+      while len(futures):
+        if ordered:
+          future = futures.pop(0)
+        else:
+          future = wait(futures, return_when=FIRST_COMPLETED).done.pop()
+          futures.remove(future)
+
+        futures.extend(executor.submit(run, fn) for fn in itertools.islice(identifiers, 1))
+        yield _unpack_segment_result(future.result())
+    finally:
+      executor.shutdown(wait=True, cancel_futures=True)
+
+  def run_across_segments(self, num_processes, func, desc=None, ordered=True, max_in_flight=None):
+    ret = []
+    num_segs = len(self.logreader_identifiers)
+    for p in tqdm.tqdm(self.imap_across_segments(num_processes, func, ordered, max_in_flight), total=num_segs, desc=desc):
+      ret.extend(p)
+    return ret
 
   def reset(self):
     self.logreader_identifiers = self._parse_identifiers(self.identifier)
@@ -309,11 +668,73 @@ are uploaded or auto fallback to qlogs with '/a' selector at the end of the rout
     return _LogFileReader("", dat=dat)
 
   def filter(self, msg_type: str):
-    return (getattr(m, m.which()) for m in filter(lambda m: m.which() == msg_type, self))
+    msgs = self._indexed_events(msg_type) if self.use_index else filter(lambda m: m.which() == msg_type, self)
+    return (getattr(m, m.which()) for m in msgs)
 
   def first(self, msg_type: str):
     return next(self.filter(msg_type), None)
 
+  def window(self, start_time: int, end_time: int, msg_type: str | None = None):
+    """Events with start_time <= logMonoTime < end_time, optionally only of msg_type"""
+    if self.use_index:
+      return self._indexed_events(msg_type, start_time, end_time)
+    return (m for m in self if start_time <= m.logMonoTime < end_time and (msg_type is None or m.which() == msg_type))
+
+  def events(self, services: Iterable[str]):
+    """Events of the given services. With use_index, the other messages are skipped without being decoded"""
+    services = set(services)
+    for i in range(len(self.logreader_identifiers)):
+      msgs = (m for m in self._segment_events(i, services) if m.which() in services)
+      if self.use_index and self.sort_by_time:
+        msgs = sorted(msgs, key=lambda m: m.logMonoTime)
+      yield from msgs
+
+  def _segment_events(self, i, services: Iterable[str], file_order: bool = False):
+    if self.use_index:
+      # index reads are always in file order
+      index = self._get_index(i)
+      return index.read(index.entries[np.isin(index.entries['type'], [EVENT_TYPES[s] for s in services if s in EVENT_TYPES])])
+    if file_order and self.sort_by_time:
+      return _StreamingLogFileReader(self.logreader_identifiers[i], only_union_types=self.only_union_types)
+    return self._get_lr(i)
+
+  def extract_columns(self, fields: list[str], cache=True) -> dict[str, dict[str, np.ndarray]]:
+    """Extract fields such as "carState.vEgo" into NumPy arrays, grouped by service along with each message's logMonoTime.
+
+    With cache, the columns of each segment are stored in cache_dir and memory-mapped on later calls.
+    Columns are always extracted in file order, so fields cached by readers with other settings stay aligned.
+    """
+    paths = _parse_field_paths(fields)
+
+    segment_columns = []
+    for i, fn in enumerate(self.logreader_identifiers):
+      if not cache:
+        segment_columns.append(_extract_columns(self._segment_events(i, paths.keys(), file_order=True), paths))
+        continue
+
+      column_cache = _ColumnCache(fn, self.cache_dir)
+      missing = column_cache.missing(paths)
+      if len(missing):
+        column_cache.save(_extract_columns(self._segment_events(i, missing.keys(), file_order=True), missing))
+      segment_columns.append(column_cache.load(paths))
+
+    columns = {}
+    for service, service_paths in paths.items():
+      columns[service] = {}
+      for path in ['logMonoTime', *service_paths]:
+        # empty segments would otherwise upcast the other segments' dtypes
+        parts = [c[service][path] for c in segment_columns]
+        parts = [p for p in parts if len(p)] or parts[:1]
+        if len(parts) == 1:
+          columns[service][path] = parts[0]
+        else:
+          columns[service][path] = np.concatenate(parts) if len(parts) else np.array([])
+
+      if self.sort_by_time:
+        order = np.argsort(columns[service]['logMonoTime'], kind='stable')
+        columns[service] = {path: column[order] for path, column in columns[service].items()}
+    return columns
+
 
 if __name__ == "__main__":
   import codecs
@@ -1,12 +1,14 @@
 import http.server
 import os
+import random
+import re
 import shutil
 import socket
 import pytest
 
 from openpilot.selfdrive.test.helpers import http_server_context
 from openpilot.system.hardware.hw import Paths
-from openpilot.tools.lib.url_file import URLFile
+from openpilot.tools.lib.url_file import CHUNK_SIZE, URLFile, prune_cache
 
 
 class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
@@ -28,6 +30,36 @@ class CachingTestRequestHandler(http.server.BaseHTTPRequestHandler):
     self.end_headers()
 
 
+class RangeTestRequestHandler(http.server.BaseHTTPRequestHandler):
+  DATA = random.Random(0).randbytes(5 * CHUNK_SIZE + 123)
+  requests: list[str | None] = []
+
+  def do_GET(self):
+    byte_range = self.headers.get("Range")
+    self.requests.append(byte_range)
+    if byte_range is None:
+      self.send_response(200)
+      body = self.DATA
+    else:
+      start, end = map(int, re.match(r"bytes=(\d+)-(\d+)", byte_range).groups())
+      self.send_response(206)
+      body = self.DATA[start:end + 1]
+    self.send_header("Content-Length", str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_HEAD(self):
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(self.DATA)))
+    self.end_headers()
+
+
+class AlignedRangeTestRequestHandler(RangeTestRequestHandler):
+  # a length that is a multiple of CHUNK_SIZE
+  DATA = random.Random(0).randbytes(2 * CHUNK_SIZE)
+  requests: list[str | None] = []
+
+
 @pytest.fixture
 def host():
   with http_server_context(handler=CachingTestRequestHandler) as (host, port):
@@ -128,3 +160,48 @@ class TestFileDownload:
     CachingTestRequestHandler.FILE_EXISTS = True
     length = URLFile(file_url).get_length()
     assert length == 4
+
+  def test_parallel_chunks(self):
+    data = RangeTestRequestHandler.DATA
+    with http_server_context(handler=RangeTestRequestHandler) as (host, port):
+      if os.path.exists(Paths.download_cache_root()):
+        shutil.rmtree(Paths.download_cache_root())
+      url = f"http://{host}:{port}/test.bin"
+
+      # adjacent chunks are merged and sequential reads prefetch the following chunks
+      RangeTestRequestHandler.requests.clear()
+      f = URLFile(url, cache=True)
+      assert b"".join(iter(lambda: f.read(CHUNK_SIZE // 2), b"")) == data
+      assert len(RangeTestRequestHandler.requests) < len(data) // CHUNK_SIZE
+
+      for _ in range(20):
+        start, length = random.randrange(len(data)), random.randrange(2 * CHUNK_SIZE)
+        for cache in (True, False):
+          f = URLFile(url, cache=cache)
+          f.seek(start)
+          assert f.read(length) == data[start:start + length]
+
+      # least recently used chunks are evicted first
+      URLFile(url, cache=True).read(CHUNK_SIZE)
+      prune_cache(2 * CHUNK_SIZE)
+      cache_size = sum(e.stat().st_size for e in os.scandir(Paths.download_cache_root()))
+      assert 0 < cache_size <= 2 * CHUNK_SIZE
+      RangeTestRequestHandler.requests.clear()
+      assert URLFile(url, cache=True).read(CHUNK_SIZE) == data[:CHUNK_SIZE]
+      assert RangeTestRequestHandler.requests == []
+      assert URLFile(url, cache=True).read() == data
+
+  def test_read_at_eof(self):
+    data = AlignedRangeTestRequestHandler.DATA
+    with http_server_context(handler=AlignedRangeTestRequestHandler) as (host, port):
+      if os.path.exists(Paths.download_cache_root()):
+        shutil.rmtree(Paths.download_cache_root())
+      url = f"http://{host}:{port}/test.bin"
+
+      f = URLFile(url, cache=True)
+      assert f.read() == data
+      AlignedRangeTestRequestHandler.requests.clear()
+      assert f.read() == b""
+      assert f.read(CHUNK_SIZE) == b""
+      assert AlignedRangeTestRequestHandler.requests == []
+      assert not os.path.exists(f._chunk_path(len(data) // CHUNK_SIZE))
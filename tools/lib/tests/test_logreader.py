@@ -6,11 +6,12 @@ import tempfile
 import os
 import pytest
 import requests
+import numpy as np
 
 from parameterized import parameterized
 
 from cereal import log as capnp_log
-from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException
+from openpilot.tools.lib.logreader import LogIterable, LogReader, comma_api_source, parse_indirect, ReadMode, InternalUnavailableException, save_log, _LogIndex
 from openpilot.tools.lib.route import SegmentRange
 from openpilot.tools.lib.url_file import URLFileException
 
@@ -24,6 +25,26 @@ def noop(segment: LogIterable):
   return segment
 
 
+def mono_times(segment: LogIterable):
+  return [np.array([m.logMonoTime for m in segment])]
+
+
+def mono_times_array(segment: LogIterable):
+  return np.array([m.logMonoTime for m in segment])
+
+
+def summary(segment: LogIterable):
+  return {"count": sum(1 for _ in segment)}
+
+
+def count(segment: LogIterable):
+  return sum(1 for _ in segment)
+
+
+def car_states(segment: LogIterable):
+  return (m for m in segment if m.which() == "carState")
+
+
 @contextlib.contextmanager
 def setup_source_scenario(mocker, is_internal=False):
   internal_source_mock = mocker.patch("openpilot.tools.lib.logreader.internal_source")
@@ -255,3 +276,170 @@ class TestLogReader:
       msgs = list(LogReader(qlog.name, only_union_types=True))
       assert len(msgs) == num_msgs
       [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  @pytest.mark.parametrize("sort_by_time", [True, False])
+  def test_streaming(self, ext, sort_by_time):
+    dat = b"".join(capnp_log.Event.new_message(logMonoTime=t).to_bytes() for t in (5, 3, 9, 1, 7) * 50)
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, f"rlog{ext}")
+      save_log(fn, capnp_log.Event.read_multiple_bytes(dat))
+
+      lr = LogReader(fn, sort_by_time=sort_by_time)
+      streaming_lr = LogReader(fn, sort_by_time=sort_by_time, streaming=True)
+      expected = [m.as_builder().to_bytes() for m in lr]
+      assert [m.as_builder().to_bytes() for m in streaming_lr] == expected
+      # readers don't hold on to events, every iteration re-reads the file
+      assert [m.as_builder().to_bytes() for m in streaming_lr] == expected
+
+  def test_streaming_corrupted(self):
+    with tempfile.NamedTemporaryFile() as qlog:
+      num_msgs = 100
+      dat = b"".join(capnp_log.Event.new_message().to_bytes() for _ in range(num_msgs))
+      with open(qlog.name, "wb") as f:
+        f.write(dat + dat[:20])
+
+      with pytest.warns(RuntimeWarning, match="Corrupted events detected"):
+        msgs = list(LogReader(qlog.name, streaming=True))
+      assert len(msgs) == num_msgs
+
+  def test_streaming_only_union_types(self):
+    with tempfile.NamedTemporaryFile() as qlog:
+      event_msg = capnp_log.Event.new_message()
+      event_bytes = event_msg.to_bytes()
+      non_union_bytes = bytearray(event_bytes)
+      non_union_bytes[event_msg.total_size.word_count * 8] = 0xff
+      with open(qlog.name, "wb") as f:
+        f.write(event_bytes + non_union_bytes + event_bytes)
+
+      assert len(list(LogReader(qlog.name, streaming=True))) == 3
+      assert len(list(LogReader(qlog.name, streaming=True, only_union_types=True))) == 2
+
+  @pytest.mark.parametrize("ext", ["", ".bz2", ".zst"])
+  @pytest.mark.parametrize("sort_by_time", [True, False])
+  def test_index(self, mocker, ext, sort_by_time):
+    services = ["carState", "carParams", "controlsState", "can"]
+    dat = b"".join(capnp_log.Event.new_message(logMonoTime=(t * 7919) % 1000, **{services[t % 3]: {}}).to_bytes() for t in range(1000))
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, f"rlog{ext}")
+      save_log(fn, capnp_log.Event.read_multiple_bytes(dat))
+
+      lr = LogReader(fn, sort_by_time=sort_by_time)
+      indexed_lr = LogReader(fn, sort_by_time=sort_by_time, use_index=True, cache_dir=tmpdir)
+      for service in services:
+        expected = [m.as_builder().to_bytes() for m in lr.filter(service)]
+        assert [m.as_builder().to_bytes() for m in indexed_lr.filter(service)] == expected
+        assert len(expected) == 0 or indexed_lr.first(service).as_builder().to_bytes() == expected[0]
+
+        expected = [m.as_builder().to_bytes() for m in lr.window(200, 400, service)]
+        assert [m.as_builder().to_bytes() for m in indexed_lr.window(200, 400, service)] == expected
+      assert len(list(indexed_lr.window(200, 400))) == 200
+
+      expected = [m.as_builder().to_bytes() for m in lr if m.which() in ("carState", "can")]
+      assert [m.as_builder().to_bytes() for m in indexed_lr.events(["carState", "can"])] == expected
+      assert [m.as_builder().to_bytes() for m in lr.events(["carState", "can"])] == expected
+
+      # services that aren't in the schema match nothing, like without the index
+      for reader in (lr, indexed_lr):
+        assert reader.first("notAService") is None
+        assert list(reader.window(200, 400, "notAService")) == []
+        assert len(list(reader.events(["carState", "notAService"]))) == 334
+
+      # a new reader loads the cached index instead of re-building it
+      assert os.path.exists(_LogIndex.cache_path(fn, tmpdir))
+      build_mock = mocker.patch.object(_LogIndex, "build")
+      assert len(list(LogReader(fn, use_index=True, cache_dir=tmpdir).filter("carParams"))) == 333
+      assert build_mock.call_count == 0
+
+  def test_index_only_union_types(self):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      event_msg = capnp_log.Event.new_message(logMonoTime=1)
+      event_bytes = event_msg.to_bytes()
+      non_union_bytes = bytearray(event_bytes)
+      non_union_bytes[event_msg.total_size.word_count * 8] = 0xff
+      fn = os.path.join(tmpdir, "rlog")
+      with open(fn, "wb") as f:
+        f.write(event_bytes + non_union_bytes + event_bytes)
+
+      assert len(list(LogReader(fn, use_index=True, cache_dir=tmpdir).window(0, 2))) == 3
+      for use_index in (True, False):
+        msgs = list(LogReader(fn, only_union_types=True, use_index=use_index, cache_dir=tmpdir).window(0, 2))
+        assert len(msgs) == 2
+        [m.which() for m in msgs]
+
+  @pytest.mark.parametrize("ordered", [True, False])
+  def test_run_across_segments_local(self, ordered):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(6):
+        fns.append(os.path.join(tmpdir, f"{seg}.zst"))
+        dat = b"".join(capnp_log.Event.new_message(logMonoTime=seg * 100 + t, carState={}).to_bytes() for t in range(100))
+        save_log(fns[-1], capnp_log.Event.read_multiple_bytes(dat))
+
+      lr = LogReader(fns)
+      expected = [m.as_builder().to_bytes() for m in lr]
+      msgs = lr.run_across_segments(2, noop, ordered=ordered, max_in_flight=3)
+      if ordered:
+        assert [m.as_builder().to_bytes() for m in msgs] == expected
+      else:
+        assert sorted(m.as_builder().to_bytes() for m in msgs) == sorted(expected)
+
+      times = np.concatenate(lr.run_across_segments(2, mono_times, ordered=ordered))
+      assert sorted(times) == list(range(600))
+
+      # other results are returned as they are
+      results = list(lr.imap_across_segments(2, mono_times_array, ordered=ordered))
+      assert all(isinstance(r, np.ndarray) and r.shape == (100,) for r in results)
+      assert sorted(np.concatenate(results)) == list(range(600))
+      assert list(lr.imap_across_segments(2, summary, ordered=ordered)) == [{"count": 100}] * 6
+      assert list(lr.imap_across_segments(2, count, ordered=ordered)) == [100] * 6
+      assert len(lr.run_across_segments(2, car_states, ordered=ordered)) == 600
+
+  @pytest.mark.parametrize("use_index", [True, False])
+  def test_extract_columns(self, mocker, use_index):
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fns = []
+      for seg in range(3):
+        fns.append(os.path.join(tmpdir, f"{seg}.bz2"))
+        msgs = []
+        for t in range(100):
+          msgs.append(capnp_log.Event.new_message(logMonoTime=seg * 1000 + 2 * t, carState={'vEgo': t, 'gearShifter': 'drive'}).to_bytes())
+          msgs.append(capnp_log.Event.new_message(logMonoTime=seg * 1000 + 2 * t + 1,
+                                                  controlsState={'lateralControlState': {'torqueState': {'output': -t}}}).to_bytes())
+        save_log(fns[-1], capnp_log.Event.read_multiple_bytes(b"".join(msgs)))
+
+      fields = ["carState.vEgo", "carState.gearShifter", "controlsState.lateralControlState.torqueState.output"]
+      lr = LogReader(fns, use_index=use_index, cache_dir=tmpdir)
+      columns = lr.extract_columns(fields, cache=False)
+      assert columns.keys() == {"carState", "controlsState"}
+      assert columns["carState"]["logMonoTime"].tolist() == [seg * 1000 + 2 * t for seg in range(3) for t in range(100)]
+      assert columns["carState"]["vEgo"].tolist() == list(range(100)) * 3
+      assert set(columns["carState"]["gearShifter"].tolist()) == {"drive"}
+      assert columns["controlsState"]["lateralControlState.torqueState.output"].tolist() == [-t for t in range(100)] * 3
+
+      # cached columns are loaded instead of parsing the logs again
+      cached_columns = lr.extract_columns(fields)
+      extract_mock = mocker.patch("openpilot.tools.lib.logreader._extract_columns")
+      cached_columns = LogReader(fns, cache_dir=tmpdir).extract_columns(fields)
+      assert extract_mock.call_count == 0
+      for service, service_columns in columns.items():
+        for path, column in service_columns.items():
+          np.testing.assert_array_equal(cached_columns[service][path], column)
+
+  def test_extract_columns_cache_order(self):
+    # columns cached by readers with different sort_by_time and use_index settings stay aligned
+    with tempfile.TemporaryDirectory() as tmpdir:
+      fn = os.path.join(tmpdir, "rlog.bz2")
+      times = np.random.default_rng(0).permutation(100)
+      msgs = [capnp_log.Event.new_message(logMonoTime=int(t), carState={'vEgo': int(t), 'aEgo': -int(t)}).to_bytes() for t in times]
+      save_log(fn, capnp_log.Event.read_multiple_bytes(b"".join(msgs)))
+
+      LogReader(fn, sort_by_time=True, cache_dir=tmpdir).extract_columns(["carState.vEgo"])
+      columns = LogReader(fn, use_index=True, cache_dir=tmpdir).extract_columns(["carState.vEgo", "carState.aEgo"])["carState"]
+      assert columns["logMonoTime"].tolist() == times.tolist()
+      assert columns["vEgo"].tolist() == times.tolist()
+      assert columns["aEgo"].tolist() == (-times).tolist()
+
+      columns = LogReader(fn, sort_by_time=True, cache_dir=tmpdir).extract_columns(["carState.vEgo", "carState.aEgo"])["carState"]
+      assert columns["logMonoTime"].tolist() == list(range(100))
+      assert columns["aEgo"].tolist() == [-t for t in range(100)]
@@ -1,14 +1,58 @@
+import gc
 import pytest
 import requests
+import subprocess
 import tempfile
 
 from collections import defaultdict
 import numpy as np
-from openpilot.tools.lib.framereader import FrameReader
+from openpilot.tools.lib.framereader import FrameReader, GOPFrameReader, HEVCDecoderSession, frame_size, frames_from_buffer
 from openpilot.tools.lib.logreader import LogReader
 
 
+class FakeGOPFrameReader(GOPFrameReader):
+  # GOPs of 10 frames, each filled with its frame number
+  def __init__(self, cache_size):
+    self.frame_count, self.w, self.h = 100, 8, 4
+    self.decoded_gops = 0
+    super().__init__(cache_size=cache_size, decoder_session=False)
+
+  def get_gop(self, num):
+    frame_b = num - num % 10
+    return frame_b, 10, 0, frame_b
+
+  def _decompress(self, rawdat, num_frames, pix_fmt):
+    self.decoded_gops += 1
+    sz = frame_size(self.w, self.h, pix_fmt)
+    return frames_from_buffer(np.repeat(np.arange(rawdat, rawdat + num_frames, dtype=np.uint8), sz), self.w, self.h, pix_fmt)
+
+
 class TestReaders:
+  def test_framereader_cache_smaller_than_gop(self):
+    fr = FakeGOPFrameReader(cache_size=3 * frame_size(8, 4, "yuv420p"))
+    for num in [0, 9, 5, 42, 41, 99, 0]:
+      assert np.all(fr.get(num)[0] == num)
+    assert len(fr.frame_cache) == 3
+
+    # frames still in the cache aren't decoded again
+    decoded_gops = fr.decoded_gops
+    assert np.all(fr.get(9, 1)[0] == 9)
+    assert fr.decoded_gops == decoded_gops
+
+  def test_decoder_session_cleanup(self, mocker):
+    # the ffmpeg processes of readers that are never closed stop once the reader is garbage collected
+    popen = subprocess.Popen
+    mocker.patch("openpilot.tools.lib.framereader.subprocess.Popen", lambda cmd, **kwargs: popen(["cat"], **kwargs))
+    fr = FakeGOPFrameReader(cache_size=None)
+    fr.decoder_sessions["yuv420p"] = HEVCDecoderSession("hevc", fr.w, fr.h, "yuv420p")
+    proc, t = fr.decoder_sessions["yuv420p"].proc, fr.decoder_sessions["yuv420p"].t
+    assert proc.poll() is None and t.is_alive()
+
+    del fr
+    gc.collect()
+    assert proc.poll() is not None
+    assert not t.is_alive()
+
   @pytest.mark.skip("skip for bandwidth reasons")
   def test_logreader(self):
     def _check_data(lr):
@@ -61,3 +105,18 @@ class TestReaders:
 
     fr_url = FrameReader("https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true")
     _check_data(fr_url)
+
+  @pytest.mark.skip("skip for bandwidth reasons")
+  def test_framereader_decoder_session(self):
+    url = "https://github.com/commaai/comma2k19/blob/master/Example_1/b0c9d2329ad1606b%7C2018-08-02--08-34-47/40/video.hevc?raw=true"
+    with tempfile.NamedTemporaryFile(suffix=".hevc") as fp:
+      r = requests.get(url, timeout=10)
+      fp.write(r.content)
+      fp.flush()
+
+      # frames decoded by one long running ffmpeg process match decoding each GOP separately
+      with FrameReader(fp.name, decoder_session=False) as fr, FrameReader(fp.name, cache_size=0) as fr_session:
+        for num in [0, 15, 600, 1199, 300, 301, 0]:
+          for pix_fmt in ["yuv420p", "rgb24"]:
+            assert np.all(fr.get(num, pix_fmt=pix_fmt)[0] == fr_session.get(num, pix_fmt=pix_fmt)[0])
+        assert fr_session.decoder_session
@@ -0,0 +1,65 @@
+import os
+import pytest
+
+from openpilot.tools.lib.framereader import FrameType, get_video_index, get_video_indexes
+from openpilot.tools.lib import vidindex
+from openpilot.tools.lib.vidindex import NAL_UNIT_START_CODE, VideoFileInvalid, get_hevc_nal_unit_starts, hevc_dimensions, hevc_index
+
+# VPS, SPS and PPS of 330x246 (coded as 336x248 with a conformance window) and 1928x1208 streams encoded with x265
+PARAMETER_SETS_330x246 = bytes.fromhex("00000140010c01ffff01600000030090000003000003003c9280900000000142010101600000030090000003000003003ca00a880f9c95964a92" +
+                                       "4caf016808000003000800000300a040000000014401c172b46240")
+PARAMETER_SETS_1928x1208 = bytes.fromhex("00000140010c01ffff01600000030090000003000003009695900900000001420101016000000300900000030000030096a003c48012e596564" +
+                                         "924caf0168080000003008000000a04000000014401c172b46240")
+
+# first slices of an IDR I frame and a P frame, with made up slice data
+I_SLICE = NAL_UNIT_START_CODE + bytes.fromhex("2601ac") + bytes(range(16, 64))
+P_SLICE = NAL_UNIT_START_CODE + bytes.fromhex("0201d0") + bytes(range(16, 40))
+
+
+class TestVidIndex:
+  def test_nal_unit_starts(self):
+    for _ in range(20):
+      dat = os.urandom(10000).replace(b"\x00\x00\x01", b"") + NAL_UNIT_START_CODE + b"\x00" + os.urandom(100) + b"\x00" + NAL_UNIT_START_CODE
+      expected = []
+      i = -1
+      while (i := dat.find(NAL_UNIT_START_CODE, i + 1)) != -1:
+        expected.append(i)
+      assert get_hevc_nal_unit_starts(dat).tolist() == expected
+
+  @pytest.mark.parametrize("prefix, dimensions", [
+    (PARAMETER_SETS_330x246, (330, 246)),
+    (PARAMETER_SETS_1928x1208, (1928, 1208)),
+  ])
+  def test_sps_dimensions(self, prefix, dimensions):
+    assert hevc_dimensions(prefix) == dimensions
+
+  def test_video_indexes(self, tmp_path):
+    fns = []
+    for i, prefix in enumerate([PARAMETER_SETS_330x246, PARAMETER_SETS_1928x1208] * 2):
+      fns.append(str(tmp_path / f"{i}.hevc"))
+      with open(fns[-1], "wb") as f:
+        f.write(b"\x00" + prefix + (I_SLICE + P_SLICE * i) * (i + 1))
+
+    indexes = get_video_indexes(fns, FrameType.h265_stream, cache_dir=str(tmp_path / "parallel"), num_processes=2)
+    for i, (fn, index) in enumerate(zip(fns, indexes, strict=True)):
+      expected = get_video_index(fn, FrameType.h265_stream, cache_dir=str(tmp_path / "serial"))
+      assert index['probe'] == expected['probe'] == {'streams': [{'width': 330, 'height': 246} if i % 2 == 0 else {'width': 1928, 'height': 1208}]}
+      assert index['global_prefix'] == expected['global_prefix']
+      assert index['index'].tolist() == expected['index'].tolist()
+      assert index['index'][:-1, 0].tolist() == ([2] + [1] * i) * (i + 1)
+
+  def test_hevc_index_closes_mmap(self, tmp_path, mocker):
+    read_spy = mocker.spy(vidindex, "read_hevc_file")
+    fn = str(tmp_path / "video.hevc")
+    with open(fn, "wb") as f:
+      f.write(b"\x00" + PARAMETER_SETS_330x246 + I_SLICE + P_SLICE)
+    frame_types, _, prefix_dat = hevc_index(fn)
+    assert len(frame_types) == 2 and prefix_dat == PARAMETER_SETS_330x246
+    assert read_spy.spy_return.closed
+
+    # also closed when the file is invalid
+    with open(fn, "wb") as f:
+      f.write(b"\x01" + PARAMETER_SETS_330x246)
+    with pytest.raises(VideoFileInvalid):
+      hevc_index(fn)
+    assert read_spy.spy_return.closed
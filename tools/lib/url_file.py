@@ -1,7 +1,9 @@
 import logging
 import os
 import socket
+import threading
 import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from hashlib import sha256
 from urllib3 import PoolManager, Retry
 from urllib3.response import BaseHTTPResponse
@@ -12,6 +14,13 @@ from openpilot.system.hardware.hw import Paths
 #  Cache chunk size
 K = 1000
 CHUNK_SIZE = 1000 * K
+#  Chunks downloaded concurrently, and how far ahead of sequential reads to prefetch
+MAX_PARALLEL_DOWNLOADS = 8
+READAHEAD_CHUNKS = 4
+#  Adjacent missing chunks are fetched with a single range request, up to this many
+MAX_MERGED_CHUNKS = 8
+#  Least recently used chunks are evicted once the download cache grows beyond this, 0 to disable
+CACHE_MAX_SIZE = int(os.environ.get("FILEREADER_CACHE_MAX_SIZE", 10 * 1000 * 1000 * K))
 
 logging.getLogger("urllib3").setLevel(logging.WARNING)
 
@@ -24,12 +33,62 @@ class URLFileException(Exception):
   pass
 
 
+def merge_adjacent(chunks: list[int], max_len: int) -> list[list[int]]:
+  runs: list[list[int]] = []
+  for chunk in sorted(chunks):
+    if len(runs) and runs[-1][-1] == chunk - 1 and len(runs[-1]) < max_len:
+      runs[-1].append(chunk)
+    else:
+      runs.append([chunk])
+  return runs
+
+
+def prune_cache(max_size: int = CACHE_MAX_SIZE) -> None:
+  """Delete the least recently used files from the download cache until it's below max_size"""
+  try:
+    entries = [e for e in os.scandir(Paths.download_cache_root()) if e.is_file()]
+  except FileNotFoundError:
+    return
+
+  files = []
+  for e in entries:
+    try:
+      st = e.stat()
+      files.append((st.st_mtime, st.st_size, e.path))
+    except FileNotFoundError:
+      pass
+
+  total = sum(size for _, size, _ in files)
+  for _, size, path in sorted(files):
+    if total <= max_size:
+      break
+    try:
+      os.remove(path)
+    except FileNotFoundError:
+      pass
+    total -= size
+
+
 class URLFile:
   _pool_manager: PoolManager|None = None
+  _executor: ThreadPoolExecutor|None = None
+  #  Chunk downloads in progress, shared between all files so a chunk is only downloaded once
+  _inflight: dict[str, Future] = {}
+  _inflight_lock = threading.Lock()
+  _cache_bytes_written = 0
 
   @staticmethod
   def reset() -> None:
     URLFile._pool_manager = None
+    URLFile._executor = None
+    URLFile._inflight = {}
+    URLFile._inflight_lock = threading.Lock()
+
+  @staticmethod
+  def executor() -> ThreadPoolExecutor:
+    if URLFile._executor is None:
+      URLFile._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_DOWNLOADS, thread_name_prefix="URLFile")
+    return URLFile._executor
 
   @staticmethod
   def pool_manager() -> PoolManager:
@@ -43,6 +102,7 @@ class URLFile:
     self._url = url
     self._timeout = Timeout(connect=timeout, read=timeout)
     self._pos = 0
+    self._last_read_end: int|None = None
     self._length: int|None = None
     self._debug = debug
     #  True by default, false if FILEREADER_CACHE is defined, but can be overwritten by the cache input
@@ -91,32 +151,86 @@ class URLFile:
       return self.read_aux(ll=ll)
 
     file_begin = self._pos
-    file_end = self._pos + ll if ll is not None else self.get_length()
-    assert file_end != -1, f"Remote file is empty or doesn't exist: {self._url}"
-    #  We have to align with chunks we store. Position is the begginiing of the latest chunk that starts before or at our file
-    position = (file_begin // CHUNK_SIZE) * CHUNK_SIZE
-    response = b""
-    while True:
-      self._pos = position
-      chunk_number = self._pos / CHUNK_SIZE
-      file_name = hash_256(self._url) + "_" + str(chunk_number)
-      full_path = os.path.join(Paths.download_cache_root(), str(file_name))
-      data = None
-      #  If we don't have a file, download it
-      if not os.path.exists(full_path):
-        data = self.read_aux(ll=CHUNK_SIZE)
-        with atomic_write_in_dir(full_path, mode="wb") as new_cached_file:
-          new_cached_file.write(data)
+    length = self.get_length()
+    assert length != -1, f"Remote file is empty or doesn't exist: {self._url}"
+    file_end = min(self._pos + ll, length) if ll is not None else length
+    if file_begin >= file_end:
+      # nothing to read, don't schedule the chunk past the end of the file
+      return b""
+    first_chunk = file_begin // CHUNK_SIZE
+    chunks = range(first_chunk, max(first_chunk + 1, -(-file_end // CHUNK_SIZE)))
+
+    #  Prefetch the chunks following sequential reads while these are being used
+    sequential = self._last_read_end == file_begin
+    readahead = range(chunks.stop, min(chunks.stop + READAHEAD_CHUNKS, -(-length // CHUNK_SIZE))) if sequential else range(0)
+    downloads = self._schedule_downloads([*chunks, *readahead])
+
+    response = []
+    for chunk in chunks:
+      if chunk in downloads:
+        data = downloads[chunk].result()[chunk]
       else:
-        with open(full_path, "rb") as cached_file:
-          data = cached_file.read()
-
-      response += data[max(0, file_begin - position): min(CHUNK_SIZE, file_end - position)]
-
-      position += CHUNK_SIZE
-      if position >= file_end:
-        self._pos = file_end
-        return response
+        data = self._read_cached_chunk(chunk)
+      position = chunk * CHUNK_SIZE
+      response.append(data[max(0, file_begin - position): max(0, file_end - position)])
+
+    self._pos = self._last_read_end = file_end
+    return b"".join(response)
+
+  def _chunk_path(self, chunk: int) -> str:
+    return os.path.join(Paths.download_cache_root(), hash_256(self._url) + "_" + str(float(chunk)))
+
+  def _read_cached_chunk(self, chunk: int) -> bytes:
+    path = self._chunk_path(chunk)
+    try:
+      with open(path, "rb") as cached_file:
+        data = cached_file.read()
+      os.utime(path)  # mark as recently used
+      return data
+    except FileNotFoundError:
+      #  Evicted by another reader in the meantime
+      return self._download_chunks([chunk])[chunk]
+
+  def _schedule_downloads(self, chunks: list[int]) -> dict[int, Future]:
+    """Start downloading the chunks which aren't cached or already being downloaded, merging adjacent chunks into one request"""
+    downloads = {}
+    with URLFile._inflight_lock:
+      missing = []
+      for chunk in chunks:
+        path = self._chunk_path(chunk)
+        if path in URLFile._inflight:
+          downloads[chunk] = URLFile._inflight[path]
+        elif not os.path.exists(path):
+          missing.append(chunk)
+
+      for run in merge_adjacent(missing, MAX_MERGED_CHUNKS):
+        future = URLFile.executor().submit(self._download_chunks, run)
+        for chunk in run:
+          URLFile._inflight[self._chunk_path(chunk)] = future
+          downloads[chunk] = future
+    return downloads
+
+  def _download_chunks(self, chunks: list[int]) -> dict[int, bytes]:
+    try:
+      start = chunks[0] * CHUNK_SIZE
+      end = min((chunks[-1] + 1) * CHUNK_SIZE, self.get_length()) - 1
+      data = self._get({'Range': f"bytes={start}-{end}"}, download_range=True) if start <= end else b""
+
+      ret = {}
+      for i, chunk in enumerate(chunks):
+        ret[chunk] = data[i * CHUNK_SIZE:(i + 1) * CHUNK_SIZE]
+        with atomic_write_in_dir(self._chunk_path(chunk), mode="wb", overwrite=True) as new_cached_file:
+          new_cached_file.write(ret[chunk])
+    finally:
+      with URLFile._inflight_lock:
+        for chunk in chunks:
+          URLFile._inflight.pop(self._chunk_path(chunk), None)
+
+    URLFile._cache_bytes_written += len(data)
+    if CACHE_MAX_SIZE > 0 and URLFile._cache_bytes_written > CACHE_MAX_SIZE // 20:
+      URLFile._cache_bytes_written = 0
+      prune_cache(CACHE_MAX_SIZE)
+    return ret
 
   def read_aux(self, ll: int|None=None) -> bytes:
     download_range = False
@@ -126,11 +240,16 @@ class URLFile:
         end = self.get_length() - 1
       else:
         end = min(self._pos + ll, self.get_length()) - 1
-      if self._pos >= end:
+      if self._pos > end:
         return b""
       headers['Range'] = f"bytes={self._pos}-{end}"
       download_range = True
 
+    ret = self._get(headers, download_range)
+    self._pos += len(ret)
+    return ret
+
+  def _get(self, headers: dict[str, str], download_range: bool) -> bytes:
     if self._debug:
       t1 = time.time()
 
@@ -150,7 +269,6 @@ class URLFile:
     if (not download_range) and response_code != 200:  # OK
       raise URLFileException(f"Error {response_code} {headers} ({self._url}): {repr(ret)[:500]}")
 
-    self._pos += len(ret)
     return ret
 
   def seek(self, pos:int) -> None:
@@ -1,10 +1,13 @@
 #!/usr/bin/env python3
 import argparse
+import mmap
 import os
 import struct
 from enum import IntEnum
 
-from openpilot.tools.lib.filereader import FileReader
+import numpy as np
+
+from openpilot.tools.lib.filereader import FileReader, resolve_name
 
 DEBUG = int(os.getenv("DEBUG", "0"))
 
@@ -258,10 +261,90 @@ def get_hevc_slice_type(dat: bytes, nal_unit_start: int, nal_unit_type: HevcNalU
     raise VideoFileInvalid("slice_type must be 0, 1, or 2")
   return slice_type, is_first_slice
 
-def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
+class BitReader:
+  def __init__(self, dat: bytes):
+    self.dat = dat
+    self.pos = 0
+
+  def u(self, n: int) -> int:
+    val = 0
+    for _ in range(n):
+      if self.pos >= len(self.dat) * 8:
+        raise VideoFileInvalid("read past end of data")
+      val = (val << 1) | ((self.dat[self.pos >> 3] >> (7 - (self.pos & 7))) & 1)
+      self.pos += 1
+    return val
+
+  def ue(self) -> int:
+    leading_zeros = 0
+    while self.u(1) == 0:
+      leading_zeros += 1
+    return (1 << leading_zeros) - 1 + self.u(leading_zeros)
+
+def get_hevc_nal_unit_starts(dat) -> np.ndarray:
+  # indexes of every NAL unit start code, equivalent to repeatedly calling dat.index(NAL_UNIT_START_CODE)
+  arr = np.frombuffer(dat, dtype=np.uint8)
+  ones = np.flatnonzero(arr[2:] == 1)
+  return ones[(arr[ones] == 0) & (arr[ones + 1] == 0)]
+
+def get_hevc_sps_dimensions(dat: bytes, nal_unit_start: int) -> tuple[int, int]:
+  # 7.3.2.2.1 General sequence parameter set RBSP syntax, up to the conformance window
+  # 7.4.2 emulation_prevention_three_byte is removed to get the RBSP
+  rbsp_start = nal_unit_start + NAL_UNIT_START_CODE_SIZE + NAL_UNIT_HEADER_SIZE
+  rbsp = bytes(dat[rbsp_start:nal_unit_start + get_hevc_nal_unit_length(dat, nal_unit_start)]).replace(b"\x00\x00\x03", b"\x00\x00")
+  r = BitReader(rbsp)
+
+  r.u(4) # sps_video_parameter_set_id
+  max_sub_layers_minus1 = r.u(3)
+  r.u(1) # sps_temporal_id_nesting_flag
+
+  # 7.3.3 Profile, tier and level syntax
+  r.u(88) # general profile and tier
+  r.u(8) # general_level_idc
+  sub_layer_flags = [(r.u(1), r.u(1)) for _ in range(max_sub_layers_minus1)]
+  if max_sub_layers_minus1 > 0:
+    r.u(2 * (8 - max_sub_layers_minus1)) # reserved_zero_2bits
+  for profile_present, level_present in sub_layer_flags:
+    r.u(88 * profile_present + 8 * level_present)
+
+  r.ue() # sps_seq_parameter_set_id
+  chroma_format_idc = r.ue()
+  if chroma_format_idc == 3:
+    r.u(1) # separate_colour_plane_flag
+  width = r.ue() # pic_width_in_luma_samples
+  height = r.ue() # pic_height_in_luma_samples
+
+  # Table 6-1 SubWidthC and SubHeightC
+  if r.u(1): # conformance_window_flag
+    sub_width = 2 if chroma_format_idc in (1, 2) else 1
+    sub_height = 2 if chroma_format_idc == 1 else 1
+    left, right, top, bottom = r.ue(), r.ue(), r.ue(), r.ue()
+    width -= sub_width * (left + right)
+    height -= sub_height * (top + bottom)
+
+  if DEBUG:
+    print("  sps dimensions:", width, height)
+  return width, height
+
+def read_hevc_file(hevc_file_name: str):
+  # local files are memory mapped instead of read
+  fn = resolve_name(hevc_file_name)
+  if not fn.startswith(("http://", "https://")) and os.path.getsize(fn) > 0:
+    with open(fn, "rb") as f:
+      return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
   with FileReader(hevc_file_name) as f:
-    dat = f.read()
+    return f.read()
 
+def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, int, bytes]:
+  dat = read_hevc_file(hevc_file_name)
+  try:
+    return _hevc_index(dat, allow_corrupt)
+  finally:
+    # close the memory map now instead of when it's garbage collected, get_video_indexes indexes many files
+    if isinstance(dat, mmap.mmap):
+      dat.close()
+
+def _hevc_index(dat, allow_corrupt: bool) -> tuple[list, int, bytes]:
   if len(dat) < NAL_UNIT_START_CODE_SIZE + 1:
     raise VideoFileInvalid("data is too short")
 
@@ -273,17 +356,28 @@ def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, in
 
   i = 1 # skip past first byte 0x00
   try:
-    while i < len(dat):
-      require_nal_unit_start(dat, i)
-      nal_unit_len = get_hevc_nal_unit_length(dat, i)
+    require_nal_unit_start(dat, i)
+
+    # find every NAL unit at once, only parameter sets and the first slice of each frame need to be parsed
+    nal_unit_starts = get_hevc_nal_unit_starts(dat)
+    nal_unit_ends = np.append(nal_unit_starts[1:], len(dat))
+    header_starts = np.minimum(nal_unit_starts + NAL_UNIT_START_CODE_SIZE, len(dat) - 1)
+    rbsp_starts = np.minimum(header_starts + NAL_UNIT_HEADER_SIZE, len(dat) - 1)
+    # copies, a view into dat would keep a memory map from being closed
+    header_bytes, rbsp_bytes = np.frombuffer(dat, dtype=np.uint8)[[header_starts, rbsp_starts]]
+    nal_unit_types = (header_bytes >> 1) & 0x3F
+    parse = np.isin(nal_unit_types, HEVC_PARAMETER_SET_NAL_UNITS) | \
+            (np.isin(nal_unit_types, HEVC_CODED_SLICE_SEGMENT_NAL_UNITS) & (rbsp_bytes >> 7 == 1))
+    parse[-1] = True # the last NAL unit is checked for truncation
+
+    for i, nal_unit_end in zip(nal_unit_starts[parse].tolist(), nal_unit_ends[parse].tolist(), strict=True):
       nal_unit_type = get_hevc_nal_unit_type(dat, i)
       if nal_unit_type in HEVC_PARAMETER_SET_NAL_UNITS:
-        prefix_dat += dat[i:i+nal_unit_len]
+        prefix_dat += dat[i:nal_unit_end]
       elif nal_unit_type in HEVC_CODED_SLICE_SEGMENT_NAL_UNITS:
         slice_type, is_first_slice = get_hevc_slice_type(dat, i, nal_unit_type)
         if is_first_slice:
           frame_types.append((slice_type, i))
-      i += nal_unit_len
   except Exception as e:
     if not allow_corrupt:
       raise
@@ -291,6 +385,13 @@ def hevc_index(hevc_file_name: str, allow_corrupt: bool=False) -> tuple[list, in
 
   return frame_types, len(dat), prefix_dat
 
+def hevc_dimensions(prefix_dat: bytes) -> tuple[int, int]:
+  # width and height from the SPS in the parameter sets returned by hevc_index
+  for i in get_hevc_nal_unit_starts(prefix_dat).tolist():
+    if get_hevc_nal_unit_type(prefix_dat, i) == HevcNalUnitType.SPS_NUT:
+      return get_hevc_sps_dimensions(prefix_dat, i)
+  raise VideoFileInvalid("no SPS found")
+
 def main() -> None:
   parser = argparse.ArgumentParser()
   parser.add_argument("input_file", type=str)
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Runs the learners of paramsd, torqued and calibrationd directly on logs, without process replay.
+Each route is processed by its own worker, which only reads the services its learners consume.
+The parameter trajectories of a route are saved as columns to <out>/<route>.npz, as "<estimator>.<column>".
+
+  ./run_estimators.py --out /tmp/estimators "a2a0ccea32023010|2023-07-27--13-01-19" ...
+"""
+import argparse
+import math
+import os
+import traceback
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import tqdm
+
+from openpilot.selfdrive.locationd.calibrationd import Calibrator
+from openpilot.selfdrive.locationd.models.car_kf import States
+from openpilot.selfdrive.locationd.paramsd import ParamsLearner
+from openpilot.selfdrive.locationd.torqued import TorqueEstimator
+from openpilot.selfdrive.test.process_replay.migration import migrate_carOutput, migrate_carParams
+from openpilot.tools.lib.logreader import LogReader
+
+
+class EstimatorRunner:
+  """Feeds an estimator like its daemon does, and keeps a row of outputs each time the daemon would publish"""
+  name = ''
+  services: list[str] = []
+  columns: list[str] = []
+
+  def __init__(self, CP):
+    self.CP = CP
+    self.frame = 0
+    self.valid: dict[str, bool] = {}
+    self.rows: list[list[float]] = []
+
+  def all_checks(self, which: str, valid: bool) -> bool:
+    # like SubMaster.all_checks, without the frequency checks
+    self.valid[which] = valid
+    return len(self.valid) == len(self.services) and all(self.valid.values())
+
+  def handle_log(self, t: float, which: str, msg, valid: bool) -> None:
+    raise NotImplementedError
+
+  def get_columns(self) -> dict[str, np.ndarray]:
+    rows = np.array(self.rows, dtype=np.float64).reshape(-1, len(self.columns))
+    return {f'{self.name}.{column}': rows[:, i] for i, column in enumerate(self.columns)}
+
+
+class ParamsdRunner(EstimatorRunner):
+  name = 'paramsd'
+  services = ['livePose', 'liveCalibration', 'carState']
+  # filter states, before paramsd's rate limits
+  columns = ['t', 'steerRatio', 'stiffnessFactor', 'angleOffsetAverageDeg', 'angleOffsetDeg', 'roll']
+
+  def __init__(self, CP):
+    super().__init__(CP)
+    self.learner = ParamsLearner(CP, CP.steerRatio, 1.0, 0.0)
+
+  def handle_log(self, t, which, msg, valid):
+    if self.all_checks(which, valid):
+      self.learner.handle_log(t, which, msg)
+
+    if which == 'livePose':
+      x = self.learner.kf.x
+      if not all(map(math.isfinite, x)):
+        self.learner = ParamsLearner(self.CP, self.CP.steerRatio, 1.0, 0.0)
+        x = self.learner.kf.x
+
+      self.rows.append([t, x[States.STEER_RATIO].item(), x[States.STIFFNESS].item(), math.degrees(x[States.ANGLE_OFFSET].item()),
+                        math.degrees(x[States.ANGLE_OFFSET].item() + x[States.ANGLE_OFFSET_FAST].item()), x[States.ROAD_ROLL].item()])
+
+
+class TorquedRunner(EstimatorRunner):
+  name = 'torqued'
+  services = ['carControl', 'carOutput', 'carState', 'liveCalibration', 'livePose']
+  columns = ['t', 'latAccelFactor', 'latAccelOffset', 'frictionCoefficient', 'latAccelFactorRaw', 'latAccelOffsetRaw',
+             'frictionCoefficientRaw', 'liveValid', 'totalBucketPoints']
+
+  def __init__(self, CP):
+    super().__init__(CP)
+    # don't restore the cached params of the route last driven on this machine
+    self.estimator = TorqueEstimator(CP, restore_params=False)
+
+  def handle_log(self, t, which, msg, valid):
+    if self.all_checks(which, valid):
+      self.estimator.handle_log(t, which, msg)
+
+    # 4Hz driven by livePose
+    if which == 'livePose':
+      self.frame += 1
+      if self.frame % 5 == 0:
+        ltp = self.estimator.get_msg(valid=all(self.valid.values())).liveTorqueParameters
+        self.rows.append([t, ltp.latAccelFactorFiltered, ltp.latAccelOffsetFiltered, ltp.frictionCoefficientFiltered, ltp.latAccelFactorRaw,
+                          ltp.latAccelOffsetRaw, ltp.frictionCoefficientRaw, ltp.liveValid, ltp.totalBucketPoints])
+
+
+class CalibrationdRunner(EstimatorRunner):
+  name = 'calibrationd'
+  services = ['cameraOdometry', 'carState', 'carParams']
+  columns = ['t', 'roll', 'pitch', 'yaw', 'validBlocks', 'calPerc', 'calStatus']
+
+  def __init__(self, CP):
+    super().__init__(CP)
+    self.calibrator = Calibrator(param_put=False)
+    self.calibrator.not_car = CP.notCar
+    self.v_ego = 0.0
+
+  def handle_log(self, t, which, msg, valid):
+    self.valid[which] = valid
+    if which == 'carParams':
+      self.calibrator.not_car = msg.notCar
+    elif which == 'carState':
+      self.v_ego = msg.vEgo
+    elif which == 'cameraOdometry':
+      self.calibrator.handle_v_ego(self.v_ego)
+      self.calibrator.handle_cam_odom(msg.trans, msg.rot, msg.wideFromDeviceEuler, msg.transStd, msg.roadTransformTrans, msg.roadTransformTransStd)
+
+      # 4Hz driven by cameraOdometry
+      self.frame += 1
+      if self.frame % 5 == 0:
+        lc = self.calibrator.get_msg(valid=all(self.valid.values())).liveCalibration
+        self.rows.append([t, *lc.rpyCalib, lc.validBlocks, lc.calPerc, lc.calStatus.raw])
+
+
+RUNNERS = {runner.name: runner for runner in (ParamsdRunner, TorquedRunner, CalibrationdRunner)}
+
+
+def run_route(route: str, estimators: list[str], out_dir: str) -> dict[str, int]:
+  lr = LogReader(route, sort_by_time=True, use_index=True)
+  services = {service for name in estimators for service in RUNNERS[name].services}
+  # carControl is needed to migrate routes from before carOutput
+  msgs = migrate_carOutput(migrate_carParams(list(lr.events({'carParams', 'carControl', *services}))))
+
+  CP = next((msg.carParams for msg in msgs if msg.which() == 'carParams'), None)
+  assert CP is not None, f"no carParams in {route}"
+
+  # older routes lack services like livePose, fail instead of saving empty trajectories
+  present = {msg.which() for msg in msgs}
+  for name in estimators:
+    missing = [service for service in RUNNERS[name].services if service not in present]
+    if len(missing):
+      raise ValueError(f"{route} has no {', '.join(missing)} for {name}")
+
+  runners = [RUNNERS[name](CP) for name in estimators]
+  consumers = defaultdict(list)
+  for runner in runners:
+    for service in runner.services:
+      consumers[service].append(runner)
+
+  for msg in msgs:
+    which = msg.which()
+    t = msg.logMonoTime * 1e-9
+    dat = getattr(msg, which)
+    for runner in consumers[which]:
+      runner.handle_log(t, which, dat, msg.valid)
+
+  columns = {name: column for runner in runners for name, column in runner.get_columns().items()}
+  np.savez_compressed(os.path.join(out_dir, f"{route.replace('/', '_').replace('|', '_')}.npz"), **columns)
+  return {runner.name: len(runner.rows) for runner in runners}
+
+
+if __name__ == "__main__":
+  parser = argparse.ArgumentParser(description="Run the parameter estimators over many routes in parallel",
+                                   formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+  parser.add_argument("routes", nargs="*", help="Routes or segment ranges to run on")
+  parser.add_argument("--routes-file", help="File with one route per line")
+  parser.add_argument("--estimators", nargs="+", choices=list(RUNNERS), default=list(RUNNERS))
+  parser.add_argument("--out", default="estimators", help="Output directory")
+  parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count(), help="Number of routes processed in parallel")
+  args = parser.parse_args()
+
+  routes = list(args.routes)
+  if args.routes_file is not None:
+    with open(args.routes_file) as f:
+      routes += [line.strip() for line in f if len(line.strip())]
+  os.makedirs(args.out, exist_ok=True)
+
+  failed = []
+  with ProcessPoolExecutor(args.jobs) as executor:
+    futures = {executor.submit(run_route, route, args.estimators, args.out): route for route in routes}
+    for future in tqdm.tqdm(as_completed(futures), total=len(futures)):
+      try:
+        future.result()
+      except Exception:
+        failed.append(futures[future])
+        traceback.print_exc()
+
+  print(f"{len(routes) - len(failed)}/{len(routes)} routes saved to {args.out}")
+  for route in failed:
+    print(f"  failed: {route}")
@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+import pytest
+
+from cereal import log, messaging
+from openpilot.selfdrive.car.toyota.interface import CarInterface
+from openpilot.tools.lib.logreader import save_log
+from openpilot.tools.tuning.run_estimators import RUNNERS, run_route
+
+
+def route_msgs(car_output=True, live_pose=True):
+  # 20s of driving through gentle curves, with every service the estimators consume
+  msgs = []
+  CP = messaging.new_message('carParams', valid=True, logMonoTime=0)
+  CP.carParams = CarInterface.get_non_essential_params('TOYOTA_COROLLA_TSS2')
+  msgs.append(CP)
+
+  for i in range(2000):
+    t = int(1e9) + i * int(1e7)
+    steer = math.sin(i / 100)
+    cs = messaging.new_message('carState', valid=True, logMonoTime=t)
+    cs.carState.vEgo = 20.
+    cs.carState.steeringAngleDeg = 5 * steer
+    cs.carState.steeringPressed = False
+    cc = messaging.new_message('carControl', valid=True, logMonoTime=t + 1)
+    cc.carControl.latActive = True
+    cc.carControl.actuatorsOutputDEPRECATED.steer = 0.3 * steer
+    msgs += [cs, cc]
+    if car_output:
+      co = messaging.new_message('carOutput', valid=True, logMonoTime=t + 2)
+      co.carOutput.actuatorsOutput.steer = 0.3 * steer
+      msgs.append(co)
+
+    if i % 5 == 0:
+      lc = messaging.new_message('liveCalibration', valid=True, logMonoTime=t + 3)
+      lc.liveCalibration.rpyCalib = [0., 0., 0.]
+      lc.liveCalibration.calStatus = log.LiveCalibrationData.Status.calibrated
+      odo = messaging.new_message('cameraOdometry', valid=True, logMonoTime=t + 4)
+      odo.cameraOdometry.trans = [20., 0., 0.]
+      odo.cameraOdometry.rot = [0., 0., 0.1 * steer]
+      odo.cameraOdometry.transStd = [1., 1., 1.]
+      odo.cameraOdometry.rotStd = [0.1, 0.1, 0.1]
+      odo.cameraOdometry.wideFromDeviceEuler = [0., 0., 0.]
+      odo.cameraOdometry.roadTransformTrans = [0., 0., 0.]
+      odo.cameraOdometry.roadTransformTransStd = [1., 1., 1.]
+      msgs += [lc, odo]
+      if live_pose:
+        lp = messaging.new_message('livePose', valid=True, logMonoTime=t + 5)
+        lp.livePose.angularVelocityDevice.z = -0.1 * steer
+        lp.livePose.angularVelocityDevice.zStd = 0.01
+        lp.livePose.angularVelocityDevice.valid = True
+        lp.livePose.orientationNED.xStd = 0.01
+        lp.livePose.orientationNED.valid = True
+        lp.livePose.posenetOK = True
+        lp.livePose.sensorsOK = True
+        lp.livePose.inputsOK = True
+        msgs.append(lp)
+
+  return [msg.as_reader() for msg in msgs]
+
+
+class TestRunEstimators:
+  @pytest.mark.parametrize("car_output", [True, False])
+  def test_run_route(self, tmp_path, mocker, car_output):
+    # the learners start from a clean state, the host's cached params are never read
+    mocker.patch("openpilot.selfdrive.locationd.torqued.Params", side_effect=AssertionError("read host params"))
+
+    route = str(tmp_path / "rlog")
+    save_log(route, route_msgs(car_output=car_output))
+    num_rows = run_route(route, list(RUNNERS), str(tmp_path))
+    assert set(num_rows) == set(RUNNERS)
+    assert all(n > 0 for n in num_rows.values())
+
+    with np.load(tmp_path / f"{route.replace('/', '_')}.npz") as columns:
+      for name, runner in RUNNERS.items():
+        for column in runner.columns:
+          assert len(columns[f'{name}.{column}']) == num_rows[name]
+        assert np.all(np.diff(columns[f'{name}.t']) >= 0)
+
+  def test_missing_services(self, tmp_path):
+    route = str(tmp_path / "rlog")
+    save_log(route, route_msgs(live_pose=False))
+    with pytest.raises(ValueError, match="livePose"):
+      run_route(route, ['torqued'], str(tmp_path))
+
+    # estimators that don't need livePose still run
+    assert run_route(route, ['calibrationd'], str(tmp_path))['calibrationd'] > 0